@@ -3,12 +3,14 @@ from tkinter import ttk, messagebox
 from client_main_constants import COLOR_BTN, COLOR_BG_CHAT, COLOR_BG_APP, COLOR_MY_MSG, COLOR_OTHER_MSG, FONT_MAIN
 
 class GroupChatWindow:
-    def __init__(self, master, server, me, group_name):
+    def __init__(self, master, server, me, session, group_name):
         self.master = master
         self.server = server
         self.me = me
+        self.session = session
         self.group_name = group_name
         self._alive = True
+        self._last_id = 0  # cursor da busca incremental
         self.master.title(f"Grupo: {group_name}")
         self.master.geometry("700x550")
         top = tk.Frame(self.master, bg=COLOR_BTN, height=60)
@@ -36,10 +38,13 @@ class GroupChatWindow:
 
     def load_conversation(self):
         try:
-            conv = self.server.get_group_conversation(self.group_name)
+            conv = self.server.get_group_conversation_since(self.session, self.group_name, self._last_id)
+            conv = [row for row in conv if row[0] > self._last_id]
+            if not conv:
+                return
+            self._last_id = conv[-1][0]
             self.chat_area.config(state="normal")
-            self.chat_area.delete(1.0, tk.END)
-            for sender, content, ts in conv:
+            for msg_id, sender, content, ts in conv:
                 tag = "me" if sender == self.me else "other"
                 display = f"[{sender}] {content}\n" if tag == "other" else f"{content}\n"
                 self.chat_area.insert(tk.END, f" {display}", tag)
@@ -54,7 +59,7 @@ class GroupChatWindow:
         if not text:
             return
         try:
-            ok = self.server.send_group_message(self.me, self.group_name, text)
+            ok = self.server.send_group_message(self.session, self.group_name, text)
             if ok:
                 self.entry_msg.delete(0, tk.END)
                 self.load_conversation()
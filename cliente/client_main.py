@@ -2,15 +2,28 @@ import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, font
 import Pyro5.api
 import Pyro5.server
-import base64
 import os
 import threading
 from datetime import datetime, timedelta
+from file_transfer import transfer_proxy, upload_file, download_file, MAX_FILE_SIZE
+from event_stream import EventStream
+from rpc_worker import RpcWorker, RpcBatch
+from message_view import MessageView
+from local_cache import LocalCache
 
 # =============================================================================
 # DEFINIÇÃO DO SERVIDOR
 # =============================================================================
 SERVER_NAME = "PYRONAME:whatsut.server"
+HISTORY_PAGE = 100  # mensagens por página (get_*_since / get_*_before)
+SEARCH_PAGE = 20     # resultados por página de search_messages
+PRESENCE_REFRESH_MS = 5000
+POLL_MS = 2000           # recarga da conversa aberta sem callback
+PUSH_POLL_MS = 15000     # com callback registrado, só uma recarga de segurança
+EVENT_VERSION = 1        # versão dos eventos de notify_events entendida pelo cliente
+GROUP_EVENTS = {"group_created", "group_deleted", "group_admin",
+                "member_request", "member_joined", "member_left"}
+USER_EVENTS = {"user_registered", "user_banned"}
 
 # Tenta importar constantes extras se existirem (opcional)
 try:
@@ -85,11 +98,11 @@ class LoginGUI:
             messagebox.showwarning("Aviso", "Preencha todos os campos.")
             return
         try:
-            auth, msg = self.server.login(user, passwd)
+            auth, msg, session = self.server.login(user, passwd)
             if auth:
                 self.master.destroy()
                 root = tk.Tk()
-                MainChatGUI(root, self.server, user)
+                MainChatGUI(root, self.server, user, session)
                 root.mainloop()
             else:
                 messagebox.showerror("Erro", msg)
@@ -103,25 +116,44 @@ class LoginGUI:
             messagebox.showwarning("Aviso", "Preencha usuário e senha.")
             return
         try:
-            success = self.server.register(user, passwd)
+            success, msg = self.server.register(user, passwd)
             if success:
-                messagebox.showinfo("Registro", "Usuário criado! Faça login.")
+                messagebox.showinfo("Registro", msg)
             else:
-                messagebox.showerror("Erro", "Nome de usuário indisponível.")
+                messagebox.showerror("Erro", msg)
         except Exception as e:
             messagebox.showerror("Erro", f"Erro ao registrar: {e}")
 
 
 class MainChatGUI:
-    def __init__(self, master, server, username):
+    def __init__(self, master, server, username, session):
         self.master = master
         self.server = server
         self.username = username
+        self.session = session  # token devolvido pelo login; vai em toda RPC
         
         self.active_chat_target = None  
         self.active_chat_is_group = False
+        self._push_ok = False  # eventos chegando por callback ou long-poll
+        self._events = None    # EventStream, quando o callback não é alcançável
         self.group_admins = {} 
-        self.messages_cache = []  # Cache para evitar piscar a tela
+        self.view = None          # MessageView da conversa aberta
+        self.sync_seq = 0         # Cursor do log de eventos do servidor (sync)
+        self._online = set()          # usuários online (estado incremental)
+        self._presence_version = 0
+        self._user_rows = {}          # username -> índice na user_list
+        self._banned = set()
+        # ("dm" | "group", nome) -> [id, remetente, trecho, timestamp, não lidas, seq],
+        # na ordem da caixa de entrada (mais recente primeiro)
+        self._inbox = {}
+        self._users = []              # últimas listas recebidas, para redesenhar na ordem do inbox
+        self._groups = []
+        self._pending = {}            # grupo administrado -> usernames aguardando aprovação
+        # RPCs fora da thread do Tk: uma fila para a interface e outra para
+        # as transferências, que não podem atrasar o envio de mensagens
+        self.rpc = RpcWorker(master, SERVER_NAME)
+        self.transfers = RpcWorker(master, SERVER_NAME, connect=transfer_proxy, name="transfer")
+        self.cache = LocalCache(username)  # histórico local: o chat abre sem esperar o servidor
 
         self.master.title(f"WhatsUT | {self.username}")
         self.master.geometry("1100x720")
@@ -133,11 +165,11 @@ class MainChatGUI:
 
         self.create_layout()
         
-        self.load_users()
-        self.load_groups()
+        self.load_home()  # usuários, presença, grupos e resumos numa chamada
         
         # Threads e Loops
         self.master.after(500, self._presence_loop)
+        self.master.after(PRESENCE_REFRESH_MS, self._refresh_presence)
         self.master.after(500, self._start_callback)
         self.master.after(2000, self._auto_refresh_data) # Polling de segurança
         
@@ -159,6 +191,10 @@ class MainChatGUI:
 
         tk.Label(header, text=f"WhatsUT | {self.username}", bg=THEME["primary"], fg="white", font=("Segoe UI", 14, "bold")).pack(side="left", padx=20)
         tk.Button(header, text="Sair", bg=THEME["danger"], fg="white", relief="flat", padx=15, command=self._safe_logout).pack(side="right", padx=20, pady=12)
+        tk.Button(header, text="🔍 Buscar", bg=THEME["secondary"], fg="white", relief="flat", padx=15, command=self.open_search).pack(side="right", pady=12)
+        # Progresso das transferências (upload/download rodam em segundo plano)
+        self.transfer_status = tk.Label(header, text="", bg=THEME["primary"], fg="white", font=("Segoe UI", 9))
+        self.transfer_status.pack(side="right", padx=10)
 
         # Container Principal
         container = tk.Frame(self.master, bg="white")
@@ -173,7 +209,7 @@ class MainChatGUI:
         self.user_list = tk.Listbox(sidebar, height=6, relief="flat", bg="#f4f4f4", font=("Segoe UI", 10), selectbackground="#d0d0d0", selectforeground="black")
         self.user_list.pack(fill="x", padx=10)
         self.user_list.bind("<Double-Button-1>", lambda e: self.on_contact_select())
-        ttk.Button(sidebar, text="↻ Atualizar Lista", style="Gray.TButton", command=self.load_users).pack(fill="x", padx=10, pady=5)
+        ttk.Button(sidebar, text="↻ Atualizar Lista", style="Gray.TButton", command=self.load_home).pack(fill="x", padx=10, pady=5)
 
         tk.Label(sidebar, text="Grupos", bg="white", font=("Segoe UI", 11, "bold"), anchor="w", fg=THEME["primary"]).pack(fill="x", padx=10, pady=(15, 5))
         self.group_list = tk.Listbox(sidebar, height=4, relief="flat", bg="#f4f4f4", font=("Segoe UI", 10), selectbackground="#d0d0d0", selectforeground="black")
@@ -197,6 +233,8 @@ class MainChatGUI:
         self._render_empty_state()
 
     def _render_empty_state(self):
+        self.active_chat_target = None
+        self.view = None
         for widget in self.right_frame.winfo_children():
             widget.destroy()
         frame = tk.Frame(self.right_frame, bg=THEME["bg_chat"])
@@ -205,11 +243,10 @@ class MainChatGUI:
         tk.Label(frame, text="Selecione um contato ou grupo para começar.", font=("Segoe UI", 12), bg=THEME["bg_chat"], fg="#999").pack(pady=10)
 
     def load_chat_interface(self, target_name, is_group):
+        # Respostas pendentes da conversa anterior não devem ser desenhadas nesta
+        self.rpc.cancel("chat")
         self.active_chat_target = target_name
         self.active_chat_is_group = is_group
-        
-        # Reseta o cache ao trocar de chat
-        self.messages_cache = []
 
         for widget in self.right_frame.winfo_children():
             widget.destroy()
@@ -224,19 +261,21 @@ class MainChatGUI:
 
         if not is_group:
              ttk.Button(chat_header, text="Arquivos", style="Gray.TButton", command=self.show_files_current).pack(side="right", padx=20)
-
-        self.canvas_chat = tk.Canvas(self.right_frame, bg=THEME["bg_chat"], highlightthickness=0)
-        self.scrollbar_chat = ttk.Scrollbar(self.right_frame, orient="vertical", command=self.canvas_chat.yview)
-        
-        self.msg_frame = tk.Frame(self.canvas_chat, bg=THEME["bg_chat"])
-        self.msg_frame.bind("<Configure>", lambda e: self.canvas_chat.configure(scrollregion=self.canvas_chat.bbox("all")))
-
-        self.canvas_window = self.canvas_chat.create_window((0, 0), window=self.msg_frame, anchor="nw", width=self.right_frame.winfo_width())
-        self.right_frame.bind("<Configure>", self._resize_canvas_frame)
-
-        self.canvas_chat.configure(yscrollcommand=self.scrollbar_chat.set)
-        self.canvas_chat.pack(side="top", fill="both", expand=True)
-        self.scrollbar_chat.pack(side="right", fill="y", in_=self.canvas_chat)
+        ttk.Button(chat_header, text="Anteriores", style="Gray.TButton", command=self._older_button).pack(side="right", padx=(20, 0))
+
+        # Só as mensagens perto da tela viram widgets; a página anterior é
+        # pedida quando a rolagem chega ao topo
+        self.view = MessageView(
+            self.right_frame, self.username, is_group, THEME, self.converter_hora_brasilia,
+            on_need_older=self.load_older_messages,
+            admin_name=self.group_admins.get(target_name, "") if is_group else "",
+        )
+        self.view.pack(side="top", fill="both", expand=True)
+        rows, has_older = self.cache.load(self._active_conversation(), HISTORY_PAGE)
+        if rows:
+            self.view.has_older = has_older
+            self.view.append(rows)
+            self.view.scroll_to_bottom()
 
         input_area = tk.Frame(self.right_frame, bg="#f0f0f0", height=70)
         input_area.pack(side="bottom", fill="x")
@@ -252,10 +291,6 @@ class MainChatGUI:
 
         self._load_conversation_data()
 
-    def _resize_canvas_frame(self, event):
-        canvas_width = event.width
-        self.canvas_chat.itemconfig(self.canvas_window, width=canvas_width)
-
     # =========================================================================
     # LÓGICA DE FUSO HORÁRIO
     # =========================================================================
@@ -268,114 +303,218 @@ class MainChatGUI:
             return str(timestamp_str)
 
     # =========================================================================
-    # RENDERIZAÇÃO DE BALÕES E CACHE
+    # MENSAGENS DA CONVERSA
     # =========================================================================
-    def add_message_bubble(self, sender, text, timestamp, is_me, is_admin=False):
-        bg_color = THEME["bubble_out"] if is_me else THEME["bubble_in"]
-        align = "e" if is_me else "w"
-        justify_txt = "right" if is_me else "left"
-        
-        row_container = tk.Frame(self.msg_frame, bg=THEME["bg_chat"])
-        row_container.pack(fill="x", pady=2, padx=15)
-        
-        bubble = tk.LabelFrame(row_container, bg=bg_color, bd=0, padx=8, pady=5)
-        bubble.pack(side=("right" if is_me else "left"), anchor=align)
-
-        if not is_me and self.active_chat_is_group:
-            color_name = "orange" if is_admin else "gray"
-            name_txt = sender + (" (Admin)" if is_admin else "")
-            tk.Label(bubble, text=name_txt, font=("Segoe UI", 8, "bold"), bg=bg_color, fg=color_name).pack(anchor="w")
-
-        tk.Label(bubble, text=text, font=("Segoe UI", 10), bg=bg_color, fg="black", wraplength=450, justify=justify_txt).pack(anchor="w")
-        
-        hora_formatada = self.converter_hora_brasilia(timestamp)
-        tk.Label(bubble, text=hora_formatada, font=("Segoe UI", 7), bg=bg_color, fg="#777").pack(anchor="e")
-
-    def _render_single_msg(self, data, admin_name):
-        if self.active_chat_is_group:
-            sender, content, ts = data
-        else:
-            sender, receiver, content, ts = data
-        
-        is_me = (sender == self.username)
-        is_admin_msg = (sender == admin_name) if self.active_chat_is_group else False
-
-        self.add_message_bubble(sender, content, ts, is_me, is_admin_msg)
+    def _view_row(self, data):
+        """Linha do servidor (privada ou de grupo) -> (id, remetente, conteúdo, hora)."""
+        if len(data) == 4:
+            return tuple(data)
+        msg_id, sender, receiver, content, ts = data
+        return (msg_id, sender, content, ts)
+
+    @staticmethod
+    def _fetch_since(proxy, session, target, is_group, after_id):
+        if is_group:
+            return proxy.get_group_conversation_since(session, target, after_id, HISTORY_PAGE)
+        return proxy.get_conversation_since(session, target, after_id, HISTORY_PAGE)
+
+    @staticmethod
+    def _fetch_before(proxy, session, target, is_group, before_id):
+        if is_group:
+            return proxy.get_group_conversation_before(session, target, before_id, HISTORY_PAGE)
+        return proxy.get_conversation_before(session, target, before_id, HISTORY_PAGE)
 
     def _load_conversation_data(self):
         if not self.active_chat_target: return
-        
-        try:
-            msgs = []
-            admin_name = ""
-            
-            if self.active_chat_is_group:
-                msgs = self.server.get_group_conversation(self.active_chat_target)
-                admin_name = self.group_admins.get(self.active_chat_target, "")
-            else:
-                msgs = self.server.get_conversation(self.username, self.active_chat_target)
 
-            # LÓGICA ANTI-PISCAR
-            # 1. Se nada mudou, não faz nada
-            if msgs == self.messages_cache:
-                return
+        # Busca incremental: só o que chegou depois da última mensagem vista.
+        # Na abertura (cursor 0) o servidor devolve a página mais recente.
+        target, is_group, session = self.active_chat_target, self.active_chat_is_group, self.session
+        first_load = not self.view.rows
+
+        def fetch(proxy, job, after_id):
+            novas_msgs = []
+            while True:
+                msgs = [m for m in self._fetch_since(proxy, session, target, is_group, after_id) if m[0] > after_id]
+                if not msgs:
+                    break
+                novas_msgs.extend(msgs)
+                after_id = msgs[-1][0]
+                if first_load or len(msgs) < HISTORY_PAGE:
+                    break
+            return novas_msgs
+
+        self.rpc.submit(fetch, self.view.last_id, tag="chat",
+                        on_result=lambda msgs: self._show_new_messages(msgs, first_load),
+                        on_error=lambda e: print(f"Erro ao carregar chat: {e}"))
+
+    def _show_new_messages(self, novas_msgs, first_load):
+        rows = [self._view_row(m) for m in novas_msgs]
+        if first_load:
+            self.view.has_older = len(novas_msgs) >= HISTORY_PAGE
+        self.cache.store(self._active_conversation(), rows,
+                         complete=first_load and not self.view.has_older)
+        # append() ignora as que eventos já exibiram enquanto a busca rodava
+        self.view.append(rows)
+        if first_load:
+            self.view.scroll_to_bottom()
+        self._mark_active_read()
+
+    def _active_conversation(self):
+        """Chave da conversa aberta, no formato dos eventos do servidor."""
+        if not self.active_chat_target:
+            return None
+        if self.active_chat_is_group:
+            return f"group:{self.active_chat_target}"
+        lo, hi = sorted((self.username, self.active_chat_target))
+        return f"dm:{lo}:{hi}"
+
+    def _apply_events(self, events):
+        """
+        Aplica eventos (callback, long-poll ou sync). A mensagem da conversa
+        aberta entra direto no cache e na tela quando prev_id bate com a
+        última mensagem vista; se houver lacuna (ou versão desconhecida), faz
+        a busca incremental. Mudanças de grupos/usuários recarregam a lista.
+        """
+        conversation = self._active_conversation()
+        reload_chat = reload_home = False
+        appended = []
+        touched = set()  # listas laterais a redesenhar ("dm" / "group")
+        for ev in events:
+            self.sync_seq = max(self.sync_seq, ev.get("seq") or 0)
+            kind = ev.get("type")
+            if ev.get("v") != EVENT_VERSION:
+                reload_chat = reload_home = True
+                continue
+            if kind in GROUP_EVENTS:
+                if kind == "group_deleted" or (kind == "member_left" and ev.get("user") == self.username):
+                    self.cache.drop(f"group:{ev.get('group')}")
+                reload_home = True
+                continue
+            if kind in USER_EVENTS:
+                reload_home = True
+                continue
+            if kind == "conversation_read":
+                touched.add(self._note_read(ev))
+                continue
+            if kind in ("message", "group_message"):
+                touched.add(self._note_message(ev))
+            if reload_chat or not conversation or ev.get("conversation") != conversation:
+                continue
+            if kind not in ("message", "group_message"):
+                continue
+            last_id = appended[-1][0] if appended else self.view.last_id
+            if ev["id"] <= last_id:
+                continue  # já exibida
+            if (ev.get("prev_id") or 0) != last_id:
+                reload_chat = True
+                continue
+            appended.append((ev["id"], ev["sender"], ev["content"], ev["timestamp"]))
+        if appended:
+            self.cache.store(conversation, appended)
+            self.view.append(appended)
+        if reload_chat:
+            self._load_conversation_data()
+        elif conversation:
+            self._mark_active_read()
+        if reload_home:
+            self.load_home()
+        else:
+            self._refresh_sidebar(touched - {None})
 
-            # 2. Se apenas chegaram novas mensagens (append)
-            len_cache = len(self.messages_cache)
-            if len(msgs) > len_cache and msgs[:len_cache] == self.messages_cache:
-                novas_msgs = msgs[len_cache:]
-                for data in novas_msgs:
-                    self._render_single_msg(data, admin_name)
-                
-                self.messages_cache = msgs
-                self.msg_frame.update_idletasks()
-                self.canvas_chat.yview_moveto(1.0)
+    def _catch_up(self):
+        """Busca com sync() tudo o que mudou desde sync_seq e aplica."""
+        if not self.sync_seq:
+            return
+        session = self.session
+
+        def fetch(proxy, job, since):
+            pages = []
+            while True:
+                result = proxy.sync(session, since)
+                if not result:
+                    break
+                pages.append(result)
+                if result["reset"] or not result["more"]:
+                    break
+                since = result["seq"]
+            return pages
+
+        self.rpc.submit(fetch, self.sync_seq, on_result=self._apply_sync,
+                        on_error=lambda e: print(f"Erro ao sincronizar: {e}"))
+
+    def _apply_sync(self, pages):
+        for result in pages:
+            if result["reset"]:
+                # cursor perdido (log podado ou servidor novo): recarrega tudo
+                self.sync_seq = result["seq"]
+                self._load_conversation_data()
+                self.load_home()
                 return
+            self._apply_events(result["events"])
+            self.sync_seq = max(self.sync_seq, result["seq"])
 
-            # 3. Se houve mudança drástica (delete, ou inicio), redesenha tudo
-            for w in self.msg_frame.winfo_children():
-                w.destroy()
+    def _older_button(self):
+        if self.view and self.view.rows and not self.view.has_older:
+            messagebox.showinfo("Info", "Não há mensagens anteriores.")
+            return
+        self.load_older_messages()
 
-            for data in msgs:
-                self._render_single_msg(data, admin_name)
+    def load_older_messages(self):
+        view = self.view
+        if not self.active_chat_target or not view.rows: return
+        if not view.has_older:
+            view.loading_older = False
+            return
+        view.loading_older = True
+        conversation = self._active_conversation()
+        rows, has_older = self.cache.load_before(conversation, view.first_id, HISTORY_PAGE)
+        if rows:
+            self.master.after_idle(view.prepend, rows, has_older)
+            return
 
-            self.messages_cache = msgs
-            self.msg_frame.update_idletasks()
-            self.canvas_chat.yview_moveto(1.0)
+        def _loaded(older):
+            rows = [self._view_row(m) for m in older]
+            has_older = len(older) >= HISTORY_PAGE
+            self.cache.store(conversation, rows, complete=not has_older)
+            view.prepend(rows, has_older)
 
-        except Exception as e:
-            print(f"Erro ao carregar chat: {e}")
+        target, is_group, session = self.active_chat_target, self.active_chat_is_group, self.session
+        self.rpc.submit(lambda proxy, job, before_id: self._fetch_before(proxy, session, target, is_group, before_id),
+                        view.first_id, tag="chat", on_result=_loaded,
+                        on_error=lambda e: print(f"Erro ao carregar histórico: {e}"))
 
     # =========================================================================
     # LÓGICA DO SERVIDOR + POLLING
     # =========================================================================
 
     def _auto_refresh_data(self):
-        if self.active_chat_target:
+        # Uma chamada a sync() cobre conversa, grupos e usuários
+        if self.sync_seq:
+            self._catch_up()
+        elif self.active_chat_target:
              try:
                  # Recarrega silenciosamente
                  self._load_conversation_data()
              except Exception:
                  pass
-        self.master.after(2000, self._auto_refresh_data)
+        self.master.after(PUSH_POLL_MS if self._push_ok else POLL_MS, self._auto_refresh_data)
 
     def send_message_current(self):
         if not self.active_chat_target: return
         text = self.entry_msg.get().strip()
         if not text: return
-        try:
-            ok = False
-            if self.active_chat_is_group:
-                ok = self.server.send_group_message(self.username, self.active_chat_target, text)
-            else:
-                ok = self.server.send_message(self.username, self.active_chat_target, text)
+        method = "send_group_message" if self.active_chat_is_group else "send_message"
+        self.entry_msg.delete(0, tk.END)
+
+        def _sent(ok):
             if ok:
-                self.entry_msg.delete(0, tk.END)
                 self._load_conversation_data()
             else:
                 messagebox.showwarning("Erro", "Falha ao enviar.")
-        except Exception as e:
-            print(e)
+                if not self.entry_msg.get(): self.entry_msg.insert(0, text)
+        self.rpc.call(method, self.session, self.active_chat_target, text,
+                      on_result=_sent, on_error=lambda e: _sent(False))
 
     def send_file_current(self):
         if self.active_chat_is_group:
@@ -385,73 +524,258 @@ class MainChatGUI:
         if not filepath: return
         filename = os.path.basename(filepath)
         try:
-            if os.path.getsize(filepath) > 5 * 1024 * 1024:
-                messagebox.showwarning("Arquivo", "Muito grande (max 5MB).")
+            if os.path.getsize(filepath) > MAX_FILE_SIZE:
+                messagebox.showwarning("Arquivo", "Muito grande (max 2GB).")
                 return
-            with open(filepath, "rb") as f:
-                b64_data = base64.b64encode(f.read()).decode('utf-8')
-            ok, msg = self.server.send_file(self.username, self.active_chat_target, filename, b64_data)
+        except OSError as e:
+            messagebox.showerror("Erro", f"Falha no envio: {e}")
+            return
+        target, session = self.active_chat_target, self.session
+
+        def _upload(proxy, job):
+            return upload_file(proxy, session, target, filepath, progress=job.progress)
+
+        def _done(result):
+            ok, msg = result
+            self.transfer_status.config(text="")
             if ok:
-                self.server.send_message(self.username, self.active_chat_target, f"📎 Enviou arquivo: {filename}")
-                self._load_conversation_data()
+                self.rpc.call("send_message", session, target, f"📎 Enviou arquivo: {filename}",
+                              on_result=lambda _: self._load_conversation_data())
                 messagebox.showinfo("Sucesso", f"Arquivo '{filename}' enviado!")
             else:
                 messagebox.showerror("Erro", msg)
-        except Exception as e:
+
+        def _failed(e):
+            self.transfer_status.config(text="")
             messagebox.showerror("Erro", f"Falha no envio: {e}")
 
+        self.transfer_status.config(text=f"Enviando {filename}...")
+        self.transfers.submit(_upload, on_result=_done, on_error=_failed,
+                              on_progress=self._transfer_progress(f"Enviando {filename}"))
+
+    def _transfer_progress(self, label):
+        def _show(done, total):
+            self.transfer_status.config(text=f"{label}: {done * 100 // total}%")
+        return _show
+
     def show_files_current(self):
         if self.active_chat_is_group: return
-        try:
-            files = self.server.get_files_list(self.username, self.active_chat_target)
-            win = tk.Toplevel(self.master)
-            win.title(f"Arquivos - {self.active_chat_target}")
-            win.geometry("400x300")
-            lb = tk.Listbox(win, width=60, font=("Segoe UI", 9))
-            lb.pack(padx=10, pady=10, fill="both", expand=True)
-            file_map = {}
-            for idx, (fid, s, r, fname, fsize, ts) in enumerate(files):
+        target, conversation = self.active_chat_target, self._active_conversation()
+        # Abre já com a lista guardada e atualiza quando a do servidor chegar
+        fill = self._show_files(target, self.cache.files(conversation))
+
+        def _fresh(files):
+            self.cache.store_files(conversation, files)
+            fill(files)
+        self.rpc.call("get_files_list", self.session, target, tag="chat",
+                      on_result=_fresh, on_error=lambda e: print(f"Erro arquivos: {e}"))
+
+    def _show_files(self, target, files):
+        win = tk.Toplevel(self.master)
+        win.title(f"Arquivos - {target}")
+        win.geometry("400x300")
+        lb = tk.Listbox(win, width=60, font=("Segoe UI", 9))
+        lb.pack(padx=10, pady=10, fill="both", expand=True)
+        file_map = {}
+        def _fill(files):
+            if not lb.winfo_exists(): return
+            lb.delete(0, tk.END)
+            file_map.clear()
+            for idx, (fid, s, r, fname, fsize, ts) in enumerate(files or []):
                 direction = "Enviado" if s == self.username else "Recebido"
                 lb.insert(tk.END, f"{direction} | {fname} | {ts}")
                 file_map[idx] = (fid, fname)
-            def _down():
-                sel = lb.curselection()
-                if not sel: return
-                fid, fname = file_map[sel[0]]
-                path = filedialog.asksaveasfilename(initialfile=fname)
-                if path:
-                    sfname, b64 = self.server.download_file(fid)
-                    if b64:
-                        with open(path, "wb") as f: f.write(base64.b64decode(b64))
-                        messagebox.showinfo("Sucesso", "Download concluído.")
-            tk.Button(win, text="Baixar Selecionado", command=_down, bg=THEME["secondary"], fg="white").pack(pady=10)
-        except Exception: pass
-
-    def load_users(self):
-        try:
-            users = self.server.list_users()
-            try: status_map = dict(self.server.get_status_map())
-            except: status_map = {}
-            self.user_list.delete(0, tk.END)
-            for uid, uname, banned in users:
-                if uname == self.username: continue
-                display = uname + (" (banido)" if banned else "")
-                self.user_list.insert(tk.END, display)
-                idx = self.user_list.size() - 1
-                color = "#00c853" if status_map.get(uname, False) else "#757575"
-                self.user_list.itemconfig(idx, fg=color)
-        except Exception as e: print(f"Erro users: {e}")
-
-    def load_groups(self):
-        try:
-            data = self.server.list_groups_with_status(self.username)
-            self.group_list.delete(0, tk.END)
-            self.group_admins = {}
-            for name, admin_uname, status in data:
-                self.group_admins[name] = admin_uname
-                tag = "" if status == "aprovado" else f"({status})"
-                self.group_list.insert(tk.END, f"{name} {tag}".strip())
-        except Exception as e: print(f"Erro groups: {e}")
+        _fill(files)
+        def _down():
+            sel = lb.curselection()
+            if not sel: return
+            fid, fname = file_map[sel[0]]
+            path = filedialog.asksaveasfilename(initialfile=fname)
+            if path:
+                self._download(fid, fname, path)
+        tk.Button(win, text="Baixar Selecionado", command=_down, bg=THEME["secondary"], fg="white").pack(pady=10)
+        return _fill
+
+    def _download(self, fid, fname, path):
+        session = self.session
+
+        def _done(ok):
+            self.transfer_status.config(text="")
+            if ok:
+                messagebox.showinfo("Sucesso", "Download concluído.")
+            else:
+                messagebox.showerror("Erro", "Falha no download.")
+
+        self.transfer_status.config(text=f"Baixando {fname}...")
+        self.transfers.submit(lambda proxy, job: download_file(proxy, session, fid, path, progress=job.progress),
+                              on_result=_done, on_error=lambda e: _done(False),
+                              on_progress=self._transfer_progress(f"Baixando {fname}"))
+
+    def load_home(self):
+        self.rpc.call("bootstrap", self.session, on_result=self._show_home,
+                      on_error=lambda e: print(f"Erro ao carregar a tela inicial: {e}"))
+
+    def _show_home(self, home):
+        if not home: return
+        if self.cache.bind(home.get("db_id")) and self.active_chat_target:
+            # o chat aberto foi desenhado com o cache de outro banco
+            self.load_chat_interface(self.active_chat_target, self.active_chat_is_group)
+        if not self.sync_seq:
+            self.sync_seq = home["seq"]
+        self._inbox = {(kind, name): [msg_id, sender, text, ts, unread, home["seq"]]
+                       for kind, name, msg_id, sender, text, ts, unread in home["inbox"]}
+        self._pending = home["pending"]
+        self._apply_presence(home["presence"])
+        # grupos apagados ou deixados enquanto o cliente estava fechado
+        self.cache.retain_groups(name for name, _, status in home["groups"] if status == "aprovado")
+        self._show_users(home["users"])
+        self._show_groups(home["groups"])
+        if self.view:
+            self._mark_active_read()
+
+    def _show_users(self, users):
+        self._users = users
+        self.user_list.delete(0, tk.END)
+        self._user_rows = {}
+        self._banned = {uname for uid, uname, banned in users if banned}
+        for uid, uname, banned in self._by_recency("dm", users, lambda u: u[1]):
+            if uname == self.username: continue
+            self.user_list.insert(tk.END, self._user_label(uname))
+            idx = self.user_list.size() - 1
+            self._user_rows[uname] = idx
+            self._color_user(uname)
+
+    def _user_label(self, uname):
+        label = uname + (" (banido)" if uname in self._banned else "")
+        last = self._inbox.get(("dm", uname))
+        if last:
+            label += self._unread_badge(last[4])
+            text = last[2].replace("\n", " ")
+            prefix = "Você: " if last[1] == self.username else ""
+            label += f"  · {prefix}{text[:24]}{'…' if len(text) > 24 else ''}"
+        return label
+
+    @staticmethod
+    def _unread_badge(unread):
+        if not unread:
+            return ""
+        return f" ({unread} nova{'s' if unread > 1 else ''})"
+
+    def _by_recency(self, kind, items, name):
+        """Conversas com mensagens primeiro (a mais recente no topo); as demais na ordem recebida."""
+        rank = {}
+        for k, n in self._inbox:
+            if k == kind:
+                rank[n] = len(rank)
+        return sorted(items, key=lambda item: rank.get(name(item), len(rank)))
+
+    def _inbox_key(self, conversation):
+        """Chave de evento ("dm:a:b" / "group:nome") -> chave de _inbox."""
+        kind = "group" if conversation.startswith("group:") else "dm"
+        return (kind, self._conversation_label(conversation))
+
+    def _note_message(self, ev):
+        """
+        Atualiza trecho, não lidas e posição da conversa na caixa de entrada
+        sem pedir nada ao servidor. Devolve a lista lateral afetada.
+        """
+        key = self._inbox_key(ev["conversation"])
+        last = self._inbox.get(key)
+        if last and last[0] >= ev["id"]:
+            return None
+        # como no servidor: mensagem própria zera, a dos outros soma (a
+        # conversa aberta é marcada como lida logo depois)
+        unread = 0 if ev["sender"] == self.username else (last[4] if last else 0) + 1
+        entry = [ev["id"], ev["sender"], ev["content"][:80], ev["timestamp"], unread, ev.get("seq") or 0]
+        self._inbox.pop(key, None)
+        self._inbox = {key: entry, **self._inbox}
+        return key[0]
+
+    def _note_read(self, ev):
+        """conversation_read (desta ou de outra sessão do usuário)."""
+        key = self._inbox_key(ev["conversation"])
+        last = self._inbox.get(key)
+        if not last or (ev.get("seq") or 0) <= last[5]:
+            return None  # leitura anterior a uma mensagem já contada
+        last[4] = ev["unread"]
+        last[5] = ev.get("seq") or 0
+        return key[0]
+
+    def _mark_active_read(self):
+        """Marca a conversa aberta como lida até a última mensagem exibida."""
+        conversation = self._active_conversation()
+        last = self._inbox.get(self._inbox_key(conversation)) if conversation else None
+        if not last or not last[4] or not self.view.last_id:
+            return
+        last[4] = 0
+        self._refresh_sidebar({"group" if self.active_chat_is_group else "dm"})
+
+        def _marked(unread):
+            if unread:  # parcial: ainda há mensagens depois de last_id
+                last[4] = unread
+                self._refresh_sidebar({"group" if conversation.startswith("group:") else "dm"})
+
+        self.rpc.call("mark_read", self.session, conversation, self.view.last_id,
+                      on_result=_marked, on_error=lambda e: None)
+
+    def _refresh_sidebar(self, kinds):
+        """Redesenha as listas na ordem do inbox mantendo o item selecionado."""
+        for kind in kinds:
+            lb = self.user_list if kind == "dm" else self.group_list
+            sel = lb.curselection()
+            selected = lb.get(sel[0]).split(" ")[0] if sel else None
+            if kind == "dm":
+                self._show_users(self._users)
+            else:
+                self._show_groups(self._groups)
+            for idx, label in enumerate(lb.get(0, tk.END)):
+                if label.split(" ")[0] == selected:
+                    lb.selection_set(idx)
+                    lb.activate(idx)
+                    break
+
+    def _apply_presence(self, result):
+        """Aplica (versão, mudanças, completo) de get_presence_changes; devolve os nomes alterados."""
+        version, changes, full = result
+        changed = set(self._online) if full else set()
+        if full:
+            self._online = set()
+        for uname, online in changes:
+            changed.add(uname)
+            if online: self._online.add(uname)
+            else: self._online.discard(uname)
+        self._presence_version = version
+        return changed
+
+    def _color_user(self, uname):
+        idx = self._user_rows.get(uname)
+        if idx is None: return
+        color = "#00c853" if uname in self._online else "#757575"
+        self.user_list.itemconfig(idx, fg=color)
+
+    def _refresh_presence(self):
+        # Só as mudanças desde a última versão vista: O(mudanças), sem listar usuários
+        def _show(result):
+            for uname in self._apply_presence(result):
+                self._color_user(uname)
+        self.rpc.call("get_presence_changes", self._presence_version,
+                      on_result=_show, on_error=lambda e: None)
+        self.master.after(PRESENCE_REFRESH_MS, self._refresh_presence)
+
+    def _show_groups(self, data):
+        self._groups = data
+        self.group_list.delete(0, tk.END)
+        self.group_admins = {}
+        for name, admin_uname, status in self._by_recency("group", data, lambda g: g[0]):
+            self.group_admins[name] = admin_uname
+            tag = "" if status == "aprovado" else f"({status})"
+            if self._pending.get(name):
+                tag = f"({len(self._pending[name])} pedidos)"
+            last = self._inbox.get(("group", name))
+            badge = self._unread_badge(last[4]) if last else ""
+            self.group_list.insert(tk.END, f"{name}{badge} {tag}".strip())
+        if self.view and self.active_chat_is_group:
+            self.view.set_admin(self.group_admins.get(self.active_chat_target, ""))
 
     def on_contact_select(self):
         sel = self.user_list.get(tk.ACTIVE)
@@ -470,6 +794,66 @@ class MainChatGUI:
         elif self.group_list.curselection(): self.on_group_select()
         else: messagebox.showinfo("Info", "Selecione um item na lista.")
 
+    def open_search(self):
+        win = tk.Toplevel(self.master)
+        win.title("Buscar mensagens")
+        win.geometry("520x400")
+        top = tk.Frame(win); top.pack(fill="x", padx=10, pady=10)
+        entry = tk.Entry(top, font=("Segoe UI", 10)); entry.pack(side="left", fill="x", expand=True)
+        scopes = {"Todas": "all", "Privadas": "private", "Grupos": "groups"}
+        current = self._active_conversation()
+        if current:
+            scopes[f"Só {self.active_chat_target}"] = current
+        scope = ttk.Combobox(top, values=list(scopes), state="readonly", width=16)
+        scope.set("Todas"); scope.pack(side="left", padx=5)
+        lb = tk.Listbox(win, font=("Segoe UI", 9)); lb.pack(fill="both", expand=True, padx=10)
+        more = ttk.Button(win, text="Mais resultados", style="Gray.TButton", state="disabled")
+        more.pack(pady=5)
+        found = []   # (conversa, id) por linha da lista
+        state = {"cursor": None}
+
+        def _show(page, append):
+            if not lb.winfo_exists(): return
+            if not append:
+                lb.delete(0, tk.END); found.clear()
+            if page is None: return
+            for conv, msg_id, sender, snippet, ts in page["results"]:
+                lb.insert(tk.END, f"{self._conversation_label(conv)} | {sender}: {snippet}  ({self.converter_hora_brasilia(ts)})")
+                found.append(conv)
+            if not found: lb.insert(tk.END, "Nenhuma mensagem encontrada.")
+            state["cursor"] = page["cursor"]
+            more.config(state="normal" if page["cursor"] is not None else "disabled")
+
+        def _search(append=False):
+            query = entry.get().strip()
+            if not query: return
+            self.rpc.cancel("search")
+            self.rpc.call("search_messages", self.session, query, scopes[scope.get()], SEARCH_PAGE,
+                          state["cursor"] if append else None, tag="search",
+                          on_result=lambda page: _show(page, append))
+
+        def _open(event=None):
+            sel = lb.curselection()
+            if not sel or sel[0] >= len(found): return
+            conv = found[sel[0]]
+            if conv.startswith("group:"):
+                self.load_chat_interface(conv[len("group:"):], True)
+            else:
+                self.load_chat_interface(self._conversation_label(conv), False)
+
+        entry.bind("<Return>", lambda e: _search())
+        lb.bind("<Double-Button-1>", _open)
+        more.config(command=lambda: _search(append=True))
+        win.bind("<Destroy>", lambda e: e.widget is win and self.rpc.cancel("search"))
+        entry.focus_set()
+
+    def _conversation_label(self, conv):
+        """dm:a:b -> o outro participante; group:nome -> nome."""
+        if conv.startswith("group:"):
+            return conv[len("group:"):]
+        prefix = f"dm:{self.username}:"
+        return conv[len(prefix):] if conv.startswith(prefix) else conv[len("dm:"):-len(self.username) - 1]
+
     def create_group(self):
         win = tk.Toplevel(self.master)
         win.title("Novo Grupo")
@@ -482,101 +866,146 @@ class MainChatGUI:
         tk.Radiobutton(win, text="Apagar Grupo", variable=var, value="delete").pack()
         def _save():
             name = entry.get().strip()
-            if name and self.server.create_group(self.username, name, var.get()):
-                self.load_groups()
-                win.destroy()
-            else: messagebox.showerror("Erro", "Falha ao criar.")
+            if not name:
+                messagebox.showerror("Erro", "Falha ao criar.")
+                return
+            def _created(ok):
+                if ok:
+                    self.load_home()
+                    win.destroy()
+                else: messagebox.showerror("Erro", "Falha ao criar.")
+            self.rpc.call("create_group", self.session, name, var.get(), on_result=_created)
         tk.Button(win, text="Criar", command=_save, bg=THEME["secondary"], fg="white").pack(pady=10)
 
     def request_join_group(self):
         sel = self.group_list.get(tk.ACTIVE)
         if not sel: return
         gname = sel.split(" ")[0]
-        if self.server.request_join_group(self.username, gname):
-            messagebox.showinfo("Sucesso", "Solicitação enviada.")
-            self.load_groups()
-        else: messagebox.showerror("Erro", "Falha.")
+        def _sent(ok):
+            if ok:
+                messagebox.showinfo("Sucesso", "Solicitação enviada.")
+                self.load_home()
+            else: messagebox.showerror("Erro", "Falha.")
+        self.rpc.call("request_join_group", self.session, gname, on_result=_sent)
 
     def add_user_to_group(self):
         sel = self.group_list.get(tk.ACTIVE)
         if not sel: return
         gname = sel.split(" ")[0]
         win = tk.Toplevel(self.master)
-        tk.Label(win, text="Username:").pack(); e = tk.Entry(win); e.pack()
-        def _add():
-            if self.server.add_member_direct(self.username, gname, e.get()):
+        tk.Label(win, text="Usernames (separados por vírgula):").pack(); e = tk.Entry(win); e.pack()
+        def _added(results):
+            failed = [u for u, (ok, value) in zip(names, results) if not (ok and value)]
+            if not failed:
                 messagebox.showinfo("Sucesso", "Adicionado.")
                 win.destroy()
-            else: messagebox.showerror("Erro", "Falha.")
+            else: messagebox.showerror("Erro", "Falha: " + ", ".join(failed))
+        names = []
+        def _add():
+            names[:] = [u.strip() for u in e.get().split(",") if u.strip()]
+            if not names: return
+            batch = RpcBatch(self.rpc, self.session)
+            for u in names:
+                batch.add("add_member_direct", gname, u)
+            batch.flush(on_done=_added)
         tk.Button(win, text="Add", command=_add).pack()
 
     def open_group_requests(self):
         sel = self.group_list.get(tk.ACTIVE)
         if not sel: return
         gname = sel.split(" ")[0]
-        reqs = self.server.list_pending_requests(self.username, gname)
+        self.rpc.call("list_pending_requests", self.session, gname,
+                      on_result=lambda reqs: self._show_requests(gname, reqs))
+
+    def _show_requests(self, gname, reqs):
         if not reqs:
             messagebox.showinfo("Info", "Nenhuma solicitação.")
             return
         win = tk.Toplevel(self.master)
-        lb = tk.Listbox(win); lb.pack()
+        lb = tk.Listbox(win, selectmode=tk.EXTENDED); lb.pack()
         for r in reqs: lb.insert(tk.END, r)
-        def _app():
-            u = lb.get(tk.ACTIVE)
-            if u and self.server.approve_member(self.username, gname, u):
-                lb.delete(tk.ACTIVE); self.load_groups()
-        tk.Button(win, text="Aprovar", command=_app).pack()
+        def _approve(users):
+            if not users: return
+            def _approved(ok, u):
+                if ok and lb.winfo_exists() and u in lb.get(0, tk.END):
+                    lb.delete(lb.get(0, tk.END).index(u))
+            # um lote: uma ida ao servidor e uma transação para todas as aprovações
+            batch = RpcBatch(self.rpc, self.session)
+            for u in users:
+                batch.add("approve_member", gname, u, on_result=lambda ok, u=u: _approved(ok, u))
+            batch.flush(on_done=lambda results: self.load_home())
+        tk.Button(win, text="Aprovar selecionados",
+                  command=lambda: _approve([lb.get(i) for i in lb.curselection()])).pack(fill="x")
+        tk.Button(win, text="Aprovar todos",
+                  command=lambda: _approve(list(lb.get(0, tk.END)))).pack(fill="x")
 
     def delete_group(self):
         sel = self.group_list.get(tk.ACTIVE)
         if not sel: return
         gname = sel.split(" ")[0]
         if messagebox.askyesno("Confirmar", f"Excluir {gname}?"):
-            if self.server.delete_group(self.username, gname):
-                self.load_groups()
-                if self.active_chat_target == gname: self._render_empty_state()
-            else: messagebox.showerror("Erro", "Falha.")
+            def _deleted(ok):
+                if ok:
+                    self.load_home()
+                    if self.active_chat_target == gname: self._render_empty_state()
+                else: messagebox.showerror("Erro", "Falha.")
+            self.rpc.call("delete_group", self.session, gname, on_result=_deleted)
 
     def request_ban_user(self):
         win = tk.Toplevel(self.master)
         tk.Label(win, text="Alvo:").pack(); t=tk.Entry(win); t.pack()
         tk.Label(win, text="Motivo:").pack(); r=tk.Entry(win); r.pack()
-        def _b():
-            ok, msg = self.server.request_ban_user(self.username, t.get(), r.get())
+        def _done(result):
+            ok, msg = result
             messagebox.showinfo("Info", msg)
             if ok: win.destroy()
+        def _b():
+            self.rpc.call("request_ban_user", self.session, t.get(), r.get(), on_result=_done)
         tk.Button(win, text="Banir", command=_b, bg="red", fg="white").pack()
 
     def _presence_loop(self):
-        try: self.server.heartbeat(self.username)
-        except: pass
+        self.rpc.call("heartbeat", self.session, on_error=lambda e: None)
         self.master.after(20000, self._presence_loop)
 
     def _start_callback(self):
         class ClientCallback:
             def __init__(self, gui): self.gui = gui
             @Pyro5.server.expose
-            def notify_private(self, sender, receiver):
-                # Se a janela ativa é com quem enviou ou recebeu
-                if self.gui.active_chat_target in [sender, receiver]:
-                    self.gui.master.after(0, self.gui._load_conversation_data)
-                elif self.gui.active_chat_is_group and receiver == self.gui.active_chat_target:
-                    self.gui.master.after(0, self.gui._load_conversation_data)
-
-            @Pyro5.server.expose
-            def notify_file(self, s, r, f):
-                self.notify_private(s, r)
+            def notify_events(self, events):
+                # Chega numa thread do Pyro; a interface só é tocada no mainloop
+                self.gui.master.after(0, self.gui._apply_events, events)
         
         # host="" garante que o daemon escute conexões de fora (rede)
         self._daemon = Pyro5.server.Daemon(host="") 
         self._cb = ClientCallback(self)
         self._uri = self._daemon.register(self._cb)
         threading.Thread(target=self._daemon.requestLoop, daemon=True).start()
-        try: self.server.register_callback(self.username, self._uri)
-        except: pass
+        # register_callback testa a conexão de volta (pode levar segundos): roda no worker
+        self.rpc.call("register_callback", self.session, self._uri,
+                      on_result=self._callback_registered,
+                      on_error=lambda e: self._callback_registered(False))
+
+    def _callback_registered(self, ok):
+        self._push_ok = bool(ok)
+        if not self._push_ok:
+            # Servidor não alcança nosso daemon (NAT/firewall): busca os eventos por long-poll
+            self._events = EventStream(
+                SERVER_NAME, self.session,
+                on_events=lambda evs: self.master.after(0, self._apply_events, evs),
+                on_reset=lambda: self.master.after(0, self._catch_up),
+                seq=self.sync_seq,
+            )
+            self._events.start()
+            self._push_ok = True
 
     def _safe_logout(self):
-        try: self.server.unregister_callback(self.username)
+        if self._events: self._events.stop()
+        self.rpc.close()
+        self.transfers.close()
+        self.cache.close()
+        try: self.server.unregister_callback(self.session)
+        except: pass
+        try: self.server.logout(self.session)
         except: pass
         self.master.destroy()
 
@@ -0,0 +1,100 @@
+# cliente/event_stream.py
+# Recebimento de eventos por long-poll, para quando o servidor não consegue
+# conectar no callback do cliente (NAT, firewall). Usa o canal asyncio do
+# servidor (get_longpoll_address) e, se ele não existir ou não for
+# alcançável, a RPC wait_events. O cursor (seq) é o do log de eventos do
+# servidor, o mesmo de sync(): após um reset, on_reset() completa com sync.
+import json
+import socket
+import threading
+import time
+
+import Pyro5.api
+import Pyro5.errors
+
+LONGPOLL_TIMEOUT = 25   # espera pedida ao servidor por chamada (segundos)
+RETRY_DELAY = 3         # pausa após erro de rede
+
+
+class EventStream:
+    """
+    Thread que busca eventos e chama on_events(lista) a cada lote; quando o
+    servidor indica que eventos foram perdidos (reset), chama on_reset().
+    seq: cursor inicial (o sync_seq do cliente; 0 = a partir de agora).
+    Os callbacks rodam nesta thread: quem mexe em interface deve repassar
+    para o mainloop (ex.: master.after).
+    """
+
+    def __init__(self, server_uri, session, on_events, on_reset, seq=0):
+        self.server_uri = server_uri
+        self.session = session
+        self.on_events = on_events
+        self.on_reset = on_reset
+        self.seq = seq
+        self._use_socket = True
+        self._connected = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="event-stream", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        proxy = Pyro5.api.Proxy(self.server_uri)  # proxy próprio desta thread
+        proxy._pyroTimeout = LONGPOLL_TIMEOUT + 10
+        while not self._stop.is_set():
+            try:
+                address = proxy.get_longpoll_address() if self._use_socket else None
+                if address:
+                    try:
+                        self._run_socket(tuple(address))
+                    except (OSError, ValueError):
+                        if not self._connected:
+                            self._use_socket = False  # canal asyncio inalcançável: fica na RPC
+                        else:
+                            self._stop.wait(RETRY_DELAY)
+                    continue
+                self._run_rpc(proxy)
+            except (OSError, Pyro5.errors.CommunicationError):
+                self._stop.wait(RETRY_DELAY)
+
+    def _handle(self, result):
+        """Processa uma resposta; False se a sessão não vale mais."""
+        if not result or "error" in result:
+            self._stop.set()
+            return False
+        if result.get("reset"):
+            self.on_reset()
+        elif result.get("events"):
+            self.on_events(result["events"])
+        self.seq = result["seq"]
+        return True
+
+    def _run_socket(self, address):
+        with socket.create_connection(address, timeout=LONGPOLL_TIMEOUT + 10) as sock:
+            self._connected = True
+            stream = sock.makefile("rwb")
+            while not self._stop.is_set():
+                request = {"session": self.session, "since": self.seq, "timeout": LONGPOLL_TIMEOUT}
+                stream.write(json.dumps(request).encode() + b"\n")
+                stream.flush()
+                line = stream.readline()
+                if not line:
+                    raise ConnectionError("canal de long-poll fechado")
+                if not self._handle(json.loads(line)):
+                    return
+
+    def _run_rpc(self, proxy):
+        while not self._stop.is_set():
+            since, started = self.seq, time.monotonic()
+            result = proxy.wait_events(self.session, since, LONGPOLL_TIMEOUT)
+            if not self._handle(result):
+                return
+            if since and not result["events"] and not result["reset"] \
+                    and time.monotonic() - started < 1:
+                # servidor sem vagas de espera: respondeu na hora; evita girar em falso
+                self._stop.wait(RETRY_DELAY)
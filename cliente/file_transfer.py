@@ -0,0 +1,128 @@
+# cliente/file_transfer.py
+# Upload e download de arquivos em partes, com retomada após desconexão.
+import hashlib
+import os
+
+import Pyro5.api
+import Pyro5.errors
+
+CHUNK_SIZE = 512 * 1024
+MAX_FILE_SIZE = 2 * 1024 ** 3
+MAX_RETRIES = 5
+
+
+def transfer_proxy(uri):
+    """Proxy próprio para transferências: marshal envia bytes crus, sem base64."""
+    proxy = Pyro5.api.Proxy(uri)
+    proxy._pyroSerializer = "marshal"
+    return proxy
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _reconnect(proxy, retries):
+    if retries > MAX_RETRIES:
+        return False
+    try:
+        proxy._pyroReconnect(tries=3)
+        return True
+    except Pyro5.errors.CommunicationError:
+        return False
+
+
+def upload_file(proxy, session, receiver, filepath, progress=None):
+    """
+    Envia o arquivo em partes. progress(enviados, total) é chamado a cada parte.
+    Retorna (bool, mensagem) como send_file.
+    """
+    filename = os.path.basename(filepath)
+    size = os.path.getsize(filepath)
+    if size > MAX_FILE_SIZE:
+        return (False, f"Arquivo muito grande (máx {MAX_FILE_SIZE // 1024 ** 3} GB).")
+    digest = file_sha256(filepath)
+
+    retries = 0
+    upload_id = None
+    with open(filepath, "rb") as f:
+        while True:
+            try:
+                if upload_id is None:
+                    # begin_upload também serve para retomar: devolve o offset do servidor
+                    upload_id, received = proxy.begin_upload(session, receiver, filename, size, digest)
+                    if upload_id is None:
+                        return (False, received)
+                    f.seek(received)
+                if progress: progress(received, size)
+
+                while received < size:
+                    chunk = f.read(CHUNK_SIZE)
+                    ok, result = proxy.put_chunk(session, upload_id, received, chunk, hashlib.sha256(chunk).hexdigest())
+                    if not ok:
+                        # Offset divergente ou parte corrompida: ressincroniza com o servidor
+                        received = proxy.upload_status(session, upload_id)
+                        if received < 0:
+                            return (False, result)
+                        f.seek(received)
+                        retries += 1
+                        if retries > MAX_RETRIES:
+                            return (False, result)
+                        continue
+                    received = result
+                    if progress: progress(received, size)
+
+                return proxy.commit_upload(session, upload_id)
+            except Pyro5.errors.CommunicationError:
+                retries += 1
+                if not _reconnect(proxy, retries):
+                    raise
+                upload_id = None
+
+
+def download_file(proxy, session, file_id, dest_path, progress=None):
+    """
+    Baixa o arquivo em partes para dest_path, retomando após desconexões e
+    conferindo o SHA-256 no final. Retorna True/False.
+    """
+    filename, size, digest = proxy.get_file_info(session, file_id)
+    if filename is None:
+        return False
+
+    retries = 0
+    received = 0
+    h = hashlib.sha256()
+    tmp_path = dest_path + ".part"
+    try:
+        with open(tmp_path, "wb") as f:
+            while received < size:
+                try:
+                    chunk = proxy.read_file_chunk(session, file_id, received, CHUNK_SIZE)
+                except Pyro5.errors.CommunicationError:
+                    retries += 1
+                    if not _reconnect(proxy, retries):
+                        raise
+                    continue
+                if not chunk:
+                    break
+                f.write(chunk)
+                h.update(chunk)
+                received += len(chunk)
+                if progress: progress(received, size)
+    except BaseException:
+        # o .part nunca é retomado (a próxima tentativa começa do zero)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    if received != size or (digest and h.hexdigest() != digest):
+        os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, dest_path)
+    return True
@@ -0,0 +1,279 @@
+# cliente/local_cache.py
+# Cache local (SQLite) das conversas, para abrir um chat sem esperar o
+# servidor e sobreviver a reinícios. Cada conversa guarda um trecho
+# contínuo do fim do histórico: a página mais recente, o que chegou depois
+# (busca incremental) e as páginas antigas carregadas na rolagem. Assim o
+# cliente desenha o que tem e só pede ao servidor o que veio depois de
+# last_id. Os ids só valem para o banco que os gerou: bind() compara a
+# identidade do banco do servidor (db_id do bootstrap) com a guardada e
+# descarta o cache do usuário se forem diferentes.
+import os
+import sqlite3
+import time
+
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".whatsut", "cache.db")
+CACHE_MAX_BYTES = 50 * 1024 ** 2  # conteúdo guardado por usuário (aproximado)
+ROW_OVERHEAD = 64                 # bytes contados por mensagem além do texto
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS owners (
+    owner TEXT PRIMARY KEY,
+    db_id TEXT NOT NULL                    -- banco do servidor de onde vieram as linhas
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS conversations (
+    owner TEXT NOT NULL,
+    conversation TEXT NOT NULL,
+    last_id INTEGER NOT NULL DEFAULT 0,    -- última mensagem vista
+    complete INTEGER NOT NULL DEFAULT 0,   -- 1 = a primeira mensagem do histórico está no cache
+    bytes INTEGER NOT NULL DEFAULT 0,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (owner, conversation)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS messages (
+    owner TEXT NOT NULL,
+    conversation TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    sender TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT,
+    PRIMARY KEY (owner, conversation, id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS files (
+    owner TEXT NOT NULL,
+    conversation TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    sender TEXT,
+    receiver TEXT,
+    filename TEXT,
+    size INTEGER,
+    timestamp TEXT,
+    PRIMARY KEY (owner, conversation, id)
+) WITHOUT ROWID;
+"""
+
+
+class LocalCache:
+    """
+    Linhas no formato da MessageView: (id, remetente, conteúdo, timestamp).
+    Quando o total de um usuário passa de max_bytes, as conversas acessadas
+    há mais tempo saem inteiras; se só sobrar a conversa atual, as suas
+    mensagens mais antigas são descartadas (o trecho continua contínuo).
+    Erros de disco nunca chegam à interface: o cache vira um cache vazio.
+    """
+
+    def __init__(self, owner, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        self.owner = owner
+        self.max_bytes = max_bytes
+        self.conn = None
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.conn = sqlite3.connect(path)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(_SCHEMA)
+        except (OSError, sqlite3.Error) as e:
+            print(f"[CACHE] desativado: {e}")
+            self.conn = None
+
+    # --------- leitura ---------
+    def load(self, conversation, limit):
+        """Últimas `limit` mensagens; devolve (linhas, há_mais_antigas)."""
+        if self.conn is None:
+            return [], True
+        try:
+            with self.conn:
+                self.conn.execute(
+                    "UPDATE conversations SET last_access = ? WHERE owner = ? AND conversation = ?",
+                    (time.time(), self.owner, conversation),
+                )
+            rows = self.conn.execute(
+                "SELECT id, sender, content, timestamp FROM messages "
+                "WHERE owner = ? AND conversation = ? ORDER BY id DESC LIMIT ?",
+                (self.owner, conversation, limit),
+            ).fetchall()
+            complete = self._complete(conversation)
+        except sqlite3.Error as e:
+            print(f"[CACHE] erro: {e}")
+            return [], True
+        rows.reverse()
+        return rows, len(rows) >= limit or not complete
+
+    def load_before(self, conversation, before_id, limit):
+        """Mensagens anteriores a before_id; devolve (linhas, há_mais_antigas)."""
+        if self.conn is None:
+            return [], True
+        try:
+            rows = self.conn.execute(
+                "SELECT id, sender, content, timestamp FROM messages "
+                "WHERE owner = ? AND conversation = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (self.owner, conversation, before_id, limit),
+            ).fetchall()
+            complete = self._complete(conversation)
+        except sqlite3.Error as e:
+            print(f"[CACHE] erro: {e}")
+            return [], True
+        rows.reverse()
+        return rows, len(rows) >= limit or not complete
+
+    def _complete(self, conversation):
+        row = self.conn.execute(
+            "SELECT complete FROM conversations WHERE owner = ? AND conversation = ?",
+            (self.owner, conversation),
+        ).fetchone()
+        return bool(row and row[0])
+
+    def files(self, conversation):
+        if self.conn is None:
+            return []
+        try:
+            return self.conn.execute(
+                "SELECT id, sender, receiver, filename, size, timestamp FROM files "
+                "WHERE owner = ? AND conversation = ? ORDER BY id",
+                (self.owner, conversation),
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"[CACHE] erro: {e}")
+            return []
+
+    # --------- escrita ---------
+    def store(self, conversation, rows, complete=False):
+        """
+        Guarda mensagens contíguas às já guardadas. complete=True indica que
+        não existe nada antes da mais antiga delas.
+        """
+        if self.conn is None or not rows and not complete:
+            return
+        last_id = max((r[0] for r in rows), default=0)
+        try:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT INTO conversations (owner, conversation, last_id, complete, bytes, last_access) "
+                    "VALUES (?, ?, ?, ?, 0, ?) ON CONFLICT (owner, conversation) DO UPDATE SET "
+                    "last_id = MAX(last_id, excluded.last_id), "
+                    "complete = MAX(complete, excluded.complete), last_access = excluded.last_access",
+                    (self.owner, conversation, last_id, int(complete), time.time()),
+                )
+                cur = self.conn.executemany(
+                    "INSERT OR IGNORE INTO messages (owner, conversation, id, sender, content, timestamp) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(self.owner, conversation, r[0], r[1], r[2], r[3]) for r in rows],
+                )
+                if cur.rowcount > 0:
+                    self.conn.execute(
+                        "UPDATE conversations SET bytes = (SELECT COALESCE(SUM(LENGTH(content)), 0) + COUNT(*) * ? "
+                        "FROM messages WHERE owner = ? AND conversation = ?) WHERE owner = ? AND conversation = ?",
+                        (ROW_OVERHEAD, self.owner, conversation, self.owner, conversation),
+                    )
+                    self._evict(conversation)
+        except sqlite3.Error as e:
+            print(f"[CACHE] erro: {e}")
+
+    def store_files(self, conversation, files):
+        """Substitui a lista de arquivos da conversa (é pequena)."""
+        if self.conn is None:
+            return
+        try:
+            with self.conn:
+                self.conn.execute("DELETE FROM files WHERE owner = ? AND conversation = ?",
+                                  (self.owner, conversation))
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO files (owner, conversation, id, sender, receiver, filename, size, timestamp) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(self.owner, conversation) + tuple(f) for f in files],
+                )
+        except sqlite3.Error as e:
+            print(f"[CACHE] erro: {e}")
+
+    # --------- invalidação ---------
+    def bind(self, db_id):
+        """
+        Associa o cache ao banco do servidor. Se as linhas guardadas vieram
+        de outro banco (outro servidor, banco recriado) ou de antes desta
+        verificação existir, descarta todas; devolve True nesse caso.
+        """
+        if self.conn is None or not db_id:
+            return False
+        try:
+            row = self.conn.execute("SELECT db_id FROM owners WHERE owner = ?",
+                                    (self.owner,)).fetchone()
+            if row and row[0] == db_id:
+                return False
+            with self.conn:
+                for table in ("messages", "files", "conversations"):
+                    self.conn.execute(f"DELETE FROM {table} WHERE owner = ?", (self.owner,))
+                self.conn.execute("INSERT OR REPLACE INTO owners (owner, db_id) VALUES (?, ?)",
+                                  (self.owner, db_id))
+        except sqlite3.Error as e:
+            print(f"[CACHE] erro: {e}")
+            return False
+        return True
+
+    def drop(self, conversation):
+        """Esquece a conversa (grupo apagado, saída do grupo, histórico inconsistente)."""
+        if self.conn is None:
+            return
+        try:
+            with self.conn:
+                for table in ("messages", "files", "conversations"):
+                    self.conn.execute(f"DELETE FROM {table} WHERE owner = ? AND conversation = ?",
+                                      (self.owner, conversation))
+        except sqlite3.Error as e:
+            print(f"[CACHE] erro: {e}")
+
+    def retain_groups(self, group_names):
+        """Descarta os grupos guardados que não estão mais em group_names."""
+        if self.conn is None:
+            return
+        keep = {f"group:{name}" for name in group_names}
+        try:
+            stale = [c for (c,) in self.conn.execute(
+                "SELECT conversation FROM conversations WHERE owner = ? AND conversation LIKE 'group:%'",
+                (self.owner,),
+            ) if c not in keep]
+        except sqlite3.Error as e:
+            print(f"[CACHE] erro: {e}")
+            return
+        for conversation in stale:
+            self.drop(conversation)
+
+    def _evict(self, current):
+        total = self.conn.execute(
+            "SELECT COALESCE(SUM(bytes), 0) FROM conversations WHERE owner = ?", (self.owner,)
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for conversation, size in self.conn.execute(
+            "SELECT conversation, bytes FROM conversations WHERE owner = ? AND conversation != ? "
+            "ORDER BY last_access", (self.owner, current),
+        ).fetchall():
+            for table in ("messages", "files", "conversations"):
+                self.conn.execute(f"DELETE FROM {table} WHERE owner = ? AND conversation = ?",
+                                  (self.owner, conversation))
+            total -= size
+            if total <= self.max_bytes:
+                return
+        # só resta a conversa atual: corta as mais antigas até caber na metade do limite
+        keep_bytes = self.max_bytes // 2
+        kept, cutoff = 0, None
+        for msg_id, length in self.conn.execute(
+            "SELECT id, LENGTH(content) FROM messages WHERE owner = ? AND conversation = ? ORDER BY id DESC",
+            (self.owner, current),
+        ):
+            kept += length + ROW_OVERHEAD
+            if kept > keep_bytes:
+                cutoff = msg_id
+                break
+        if cutoff is None:
+            return
+        self.conn.execute("DELETE FROM messages WHERE owner = ? AND conversation = ? AND id <= ?",
+                          (self.owner, current, cutoff))
+        self.conn.execute("UPDATE conversations SET bytes = ?, complete = 0 WHERE owner = ? AND conversation = ?",
+                          (kept - length - ROW_OVERHEAD, self.owner, current))
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
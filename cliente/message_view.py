@@ -0,0 +1,279 @@
+# cliente/message_view.py
+# Lista de mensagens virtualizada: só as mensagens perto da área visível têm
+# widgets. Cada balão é uma janela no Canvas, tirada de um pool e reusada
+# (só o texto e as cores mudam) quando a rolagem a afasta da tela. As alturas
+# são estimadas até o balão ser desenhado pela primeira vez e depois ficam
+# medidas; os deslocamentos (soma das alturas) localizam as mensagens
+# visíveis por busca binária.
+import bisect
+import tkinter as tk
+from tkinter import ttk
+
+OVERSCAN = 400          # pixels materializados acima/abaixo da área visível
+LOAD_OLDER_MARGIN = 200 # distância do topo que dispara a carga da página anterior
+ROW_PADY = 2
+ROW_PADX = 15
+WRAP_LENGTH = 450
+CHARS_PER_LINE = 60     # estimativa de quebra para wraplength=450 em Segoe UI 10
+LINE_HEIGHT = 17
+
+
+class _Bubble:
+    """Balão reaproveitável: um LabelFrame com nome (opcional), texto e hora."""
+
+    def __init__(self, view):
+        canvas = view.canvas
+        self.frame = tk.LabelFrame(canvas, bd=0, padx=8, pady=5)
+        self.name = tk.Label(self.frame, font=("Segoe UI", 8, "bold"))
+        self.text = tk.Label(self.frame, font=("Segoe UI", 10), fg="black", wraplength=WRAP_LENGTH)
+        self.time = tk.Label(self.frame, font=("Segoe UI", 7), fg="#777")
+        self.text.pack(anchor="w")
+        self.time.pack(anchor="e")
+        self.item = canvas.create_window(0, 0, window=self.frame, anchor="nw", state="hidden")
+        self.msg_id = None
+        self.is_me = False
+        for w in (self.frame, self.name, self.text, self.time):
+            view._bind_wheel(w)
+
+    def show(self, view, row):
+        msg_id, sender, content, ts = row
+        is_me = sender == view.username
+        bg = view.theme["bubble_out"] if is_me else view.theme["bubble_in"]
+        self.msg_id = msg_id
+        self.is_me = is_me
+        self.frame.config(bg=bg)
+        if not is_me and view.is_group:
+            is_admin = sender == view.admin_name
+            self.name.config(text=sender + (" (Admin)" if is_admin else ""), bg=bg,
+                             fg="orange" if is_admin else "gray")
+            if not self.name.winfo_manager():
+                self.name.pack(anchor="w", before=self.text)
+        elif self.name.winfo_manager():
+            self.name.pack_forget()
+        self.text.config(text=content, bg=bg, justify="right" if is_me else "left")
+        self.time.config(text=view.format_time(ts), bg=bg)
+
+
+class MessageView:
+    """
+    rows: (id, remetente, conteúdo, timestamp) em ordem crescente de id.
+    on_need_older() é chamada quando a rolagem chega perto do topo e ainda
+    há páginas antigas (has_older); quem chama responde com prepend().
+    """
+
+    def __init__(self, parent, username, is_group, theme, format_time,
+                 on_need_older=None, admin_name=""):
+        self.username = username
+        self.is_group = is_group
+        self.theme = theme
+        self.format_time = format_time
+        self.on_need_older = on_need_older
+        self.admin_name = admin_name
+        self.rows = []
+        self.has_older = False
+        self.loading_older = False
+        self._heights = []      # altura de cada linha (medida ou estimada)
+        self._measured = {}     # id -> altura medida
+        self._offsets = [0]     # _offsets[i] = topo da linha i; o último é a altura total
+        self._live = {}         # id -> _Bubble visível
+        self._pool = []
+        self._refresh_pending = False
+        self._in_refresh = False
+
+        self.canvas = tk.Canvas(parent, bg=theme["bg_chat"], highlightthickness=0)
+        self.scrollbar = ttk.Scrollbar(parent, orient="vertical", command=self._scroll)
+        self.canvas.configure(yscrollcommand=self._on_yscroll)
+        self.canvas.bind("<Configure>", lambda e: self._relayout())
+        self._bind_wheel(self.canvas)
+
+    def pack(self, **kw):
+        self.canvas.pack(**kw)
+        self.scrollbar.pack(side="right", fill="y", in_=self.canvas)
+
+    # --------- dados ---------
+    @property
+    def last_id(self):
+        return self.rows[-1][0] if self.rows else 0
+
+    @property
+    def first_id(self):
+        return self.rows[0][0] if self.rows else 0
+
+    def append(self, rows):
+        """Acrescenta no fim; se a rolagem estava no fim, continua nele."""
+        rows = [r for r in rows if r[0] > self.last_id]
+        if not rows:
+            return
+        at_bottom = self._at_bottom()
+        self.rows.extend(rows)
+        self._heights.extend(self._estimate(r) for r in rows)
+        self._rebuild_offsets()
+        if at_bottom:
+            self._scroll_to(self._offsets[-1])
+        self._refresh()
+
+    def prepend(self, rows, has_older):
+        """Acrescenta uma página antiga no início sem mover o que está na tela."""
+        self.loading_older = False
+        self.has_older = has_older
+        rows = [r for r in rows if not self.rows or r[0] < self.first_id]
+        if not rows:
+            return
+        added = [self._estimate(r) for r in rows]
+        top = self.canvas.canvasy(0)
+        self.rows[:0] = rows
+        self._heights[:0] = added
+        self._rebuild_offsets()
+        self._scroll_to(top + sum(added))
+        self._refresh()
+
+    def set_admin(self, admin_name):
+        if admin_name != self.admin_name:
+            self.admin_name = admin_name
+            self._release_all()
+            self._refresh()
+
+    def scroll_to_bottom(self):
+        self._scroll_to(self._offsets[-1])
+        self._refresh()
+
+    # --------- rolagem ---------
+    def _bind_wheel(self, widget):
+        widget.bind("<MouseWheel>", lambda e: self._wheel(-1 if e.delta > 0 else 1))
+        widget.bind("<Button-4>", lambda e: self._wheel(-1))
+        widget.bind("<Button-5>", lambda e: self._wheel(1))
+
+    def _wheel(self, direction):
+        self.canvas.yview_scroll(direction * 3, "units")
+        self._schedule_refresh()
+
+    def _scroll(self, *args):
+        self.canvas.yview(*args)
+        self._schedule_refresh()
+
+    def _on_yscroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self._schedule_refresh()
+
+    def _scroll_to(self, y):
+        total = self._offsets[-1]
+        top = max(0, min(y, total - self.canvas.winfo_height()))
+        self.canvas.yview_moveto(top / total if total else 0)
+
+    def _at_bottom(self):
+        return self.canvas.canvasy(self.canvas.winfo_height()) >= self._offsets[-1] - ROW_PADY
+
+    def _schedule_refresh(self):
+        if not self._refresh_pending:
+            self._refresh_pending = True
+            self.canvas.after_idle(self._refresh)
+
+    # --------- materialização ---------
+    def _estimate(self, row):
+        lines = sum(max(1, -(-len(part) // CHARS_PER_LINE)) for part in str(row[2]).split("\n"))
+        name = 14 if self.is_group and row[1] != self.username else 0
+        return self._measured.get(row[0]) or 30 + name + lines * LINE_HEIGHT + 2 * ROW_PADY
+
+    def _rebuild_offsets(self):
+        offsets = [0]
+        total = 0
+        for h in self._heights:
+            total += h
+            offsets.append(total)
+        self._offsets = offsets
+        self.canvas.configure(scrollregion=(0, 0, self.canvas.winfo_width(), total))
+
+    def _visible_range(self):
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        lo = max(0, bisect.bisect_right(self._offsets, top - OVERSCAN) - 1)
+        hi = min(len(self.rows), bisect.bisect_left(self._offsets, bottom + OVERSCAN))
+        return lo, hi
+
+    def _refresh(self):
+        # update_idletasks (em _materialize) roda callbacks pendentes: evita reentrar
+        if self._in_refresh or not self.canvas.winfo_exists():
+            return
+        self._in_refresh = True
+        try:
+            for _ in range(3):  # medições novas mudam os deslocamentos; converge em poucas passadas
+                if not self._materialize():
+                    break
+        finally:
+            self._in_refresh = False
+            self._refresh_pending = False
+        if (self.has_older and not self.loading_older and self.on_need_older
+                and self.rows and self.canvas.canvasy(0) < LOAD_OLDER_MARGIN):
+            self.loading_older = True
+            self.on_need_older()
+
+    def _materialize(self):
+        """Garante balões para as linhas perto da tela; True se alguma altura mudou."""
+        lo, hi = self._visible_range()
+        wanted = {self.rows[i][0]: i for i in range(lo, hi)}
+        for msg_id in [m for m in self._live if m not in wanted]:
+            bubble = self._live.pop(msg_id)
+            self.canvas.itemconfigure(bubble.item, state="hidden")
+            self._pool.append(bubble)
+
+        # âncora: a primeira linha visível fica no mesmo lugar da tela
+        top = self.canvas.canvasy(0)
+        anchor = lo if lo < hi else None
+        anchor_dy = self._offsets[anchor] - top if anchor is not None else 0
+        width = self.canvas.winfo_width()
+        new = []
+        for msg_id, i in wanted.items():
+            bubble = self._live.get(msg_id)
+            if bubble is None:
+                bubble = self._pool.pop() if self._pool else _Bubble(self)
+                bubble.show(self, self.rows[i])
+                self._live[msg_id] = bubble
+                new.append((bubble, i))
+            self._place(bubble, i, width)
+
+        changed = False
+        if new:
+            self.canvas.update_idletasks()  # uma passada de layout mede todos os balões novos
+            for bubble, i in new:
+                height = bubble.frame.winfo_reqheight() + 2 * ROW_PADY
+                self._measured[bubble.msg_id] = height
+                if height != self._heights[i]:
+                    self._heights[i] = height
+                    changed = True
+
+        if changed:
+            at_bottom = self._at_bottom()
+            self._rebuild_offsets()
+            for msg_id, bubble in self._live.items():
+                self._place(bubble, wanted[msg_id], width)
+            if at_bottom:
+                self._scroll_to(self._offsets[-1])
+            elif anchor is not None:
+                self._scroll_to(self._offsets[anchor] - anchor_dy)
+        return changed
+
+    def _place(self, bubble, i, width):
+        y = self._offsets[i] + ROW_PADY
+        if bubble.is_me:
+            self.canvas.coords(bubble.item, width - ROW_PADX, y)
+            self.canvas.itemconfigure(bubble.item, anchor="ne", state="normal")
+        else:
+            self.canvas.coords(bubble.item, ROW_PADX, y)
+            self.canvas.itemconfigure(bubble.item, anchor="nw", state="normal")
+
+    def _relayout(self):
+        self._rebuild_offsets()
+        width = self.canvas.winfo_width()
+        index = {row[0]: i for i, row in enumerate(self.rows) if row[0] in self._live}
+        for msg_id, bubble in self._live.items():
+            self._place(bubble, index[msg_id], width)
+        self._schedule_refresh()
+
+    def _release_all(self):
+        for bubble in self._live.values():
+            self.canvas.itemconfigure(bubble.item, state="hidden")
+            self._pool.append(bubble)
+        self._live.clear()
+
+    def stats(self):
+        return {"rows": len(self.rows), "live": len(self._live), "pooled": len(self._pool)}
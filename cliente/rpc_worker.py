@@ -0,0 +1,182 @@
+# cliente/rpc_worker.py
+# Executa as chamadas ao servidor fora da thread do Tk. Cada RpcWorker tem a
+# sua thread, o seu proxy Pyro5 e uma fila de jobs; os resultados voltam para
+# a interface por master.after, então os callbacks sempre rodam no mainloop.
+import queue
+import threading
+
+import Pyro5.api
+
+
+class Cancelled(Exception):
+    """Levantada dentro de um job cancelado (pelo callback de progresso)."""
+
+
+class Job:
+    def __init__(self, worker, fn, args, on_result, on_error, on_progress, tag):
+        self.worker = worker
+        self.fn = fn
+        self.args = args
+        self.on_result = on_result
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.tag = tag
+        self.cancelled = False
+        self._last_pct = -1
+
+    def cancel(self):
+        self.cancelled = True
+
+    def progress(self, done, total):
+        """Para passar como progress(feito, total) às funções de transferência."""
+        if self.cancelled:
+            raise Cancelled()
+        if self.on_progress is None or not total:
+            return
+        pct = int(done * 100 / total)
+        if pct != self._last_pct:  # no máximo 101 atualizações de tela por job
+            self._last_pct = pct
+            self.worker._post(self, self.on_progress, done, total)
+
+
+class RpcWorker:
+    """
+    Fila de jobs atendida por uma thread com proxy próprio (FIFO: um envio
+    seguido de uma recarga chega ao servidor nessa ordem). Jobs com tag
+    podem ser cancelados em grupo: os que ainda não rodaram são pulados e o
+    resultado dos que já rodaram é descartado.
+    """
+
+    def __init__(self, master, server_uri, connect=Pyro5.api.Proxy, name="rpc"):
+        self.master = master
+        self.server_uri = server_uri
+        self.connect = connect      # uri -> proxy (ex.: file_transfer.transfer_proxy)
+        self._queue = queue.Queue()
+        self._jobs = set()          # jobs pendentes ou em execução
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def call(self, method, *args, on_result=None, on_error=None, tag=None):
+        """proxy.<method>(*args) na thread do worker."""
+        return self.submit(lambda proxy, job: getattr(proxy, method)(*args),
+                           on_result=on_result, on_error=on_error, tag=tag)
+
+    def submit(self, fn, *args, on_result=None, on_error=None, on_progress=None, tag=None):
+        """
+        fn(proxy, job, *args) roda na thread do worker; on_result(valor),
+        on_error(exceção) e on_progress(feito, total) rodam no mainloop.
+        """
+        job = Job(self, fn, args, on_result, on_error, on_progress, tag)
+        with self._lock:
+            self._jobs.add(job)
+        self._queue.put(job)
+        return job
+
+    def cancel(self, tag):
+        with self._lock:
+            for job in self._jobs:
+                if job.tag == tag:
+                    job.cancel()
+
+    def pending(self, tag=None):
+        with self._lock:
+            return sum(1 for j in self._jobs if tag is None or j.tag == tag)
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            for job in self._jobs:
+                job.cancel()
+        self._queue.put(None)
+
+    def _run(self):
+        proxy = self.connect(self.server_uri)  # criado aqui: o proxy pertence a esta thread
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            if job.cancelled:
+                self._done(job)
+                continue
+            try:
+                result = job.fn(proxy, job, *job.args)
+            except Cancelled:
+                self._done(job)
+            except Exception as e:
+                self._done(job)
+                self._post(job, job.on_error or self._log_error, e)
+            else:
+                self._done(job)
+                if job.on_result is not None:
+                    self._post(job, job.on_result, result)
+        proxy._pyroRelease()
+
+    def _done(self, job):
+        with self._lock:
+            self._jobs.discard(job)
+
+    def _post(self, job, fn, *args):
+        def deliver():
+            if not job.cancelled and not self._closed:
+                fn(*args)
+        try:
+            self.master.after(0, deliver)
+        except RuntimeError:
+            pass  # mainloop já encerrado
+
+    @staticmethod
+    def _log_error(e):
+        print(f"[RPC] erro: {e}")
+
+
+class RpcBatch:
+    """
+    Acumula chamadas e as envia juntas pela RPC batch() do servidor (uma
+    ida e volta e uma transação para o lote). Cada add() recebe o seu
+    on_result(retorno) / on_error(mensagem); on_done(resultados) roda
+    depois de todos. Com delay_ms, o primeiro add() agenda o flush: chamadas
+    feitas em sequência pela interface saem no mesmo lote.
+    """
+
+    def __init__(self, worker, session, delay_ms=None, atomic=False):
+        self.worker = worker
+        self.session = session
+        self.delay_ms = delay_ms
+        self.atomic = atomic
+        self._ops = []
+        self._callbacks = []
+        self._scheduled = False
+
+    def add(self, method, *args, on_result=None, on_error=None):
+        self._ops.append((method,) + args)
+        self._callbacks.append((on_result, on_error))
+        if self.delay_ms is not None and not self._scheduled:
+            self._scheduled = True
+            self.worker.master.after(self.delay_ms, self.flush)
+        return self
+
+    def __len__(self):
+        return len(self._ops)
+
+    def flush(self, on_done=None, on_error=None, tag=None):
+        self._scheduled = False
+        ops, callbacks = self._ops, self._callbacks
+        self._ops, self._callbacks = [], []
+        if not ops:
+            return None
+
+        def deliver(results):
+            if results is None:
+                results = [(False, "sessão inválida")] * len(ops)
+            for (ok, value), (on_item, on_item_error) in zip(results, callbacks):
+                if ok and on_item is not None:
+                    on_item(value)
+                elif not ok and on_item_error is not None:
+                    on_item_error(value)
+            if on_done is not None:
+                on_done(results)
+
+        return self.worker.call("batch", self.session, ops, self.atomic,
+                                on_result=deliver, on_error=on_error, tag=tag)
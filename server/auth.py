@@ -0,0 +1,164 @@
+# server/auth.py
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from crypto_utils import hash_password, verify_password, password_rounds, BCRYPT_ROUNDS
+
+HASH_WORKERS = 2        # processos dedicados ao bcrypt
+HASH_MAX_PENDING = 64   # hashes na fila antes de recusar novos logins
+HASH_WAIT_TIMEOUT = 5   # segundos esperando vaga na fila
+SESSION_TTL = 12 * 3600 # sessão expira após esse tempo sem uso
+SESSION_SWEEP_EVERY = 256  # create() que também varre as sessões expiradas
+
+
+class Overloaded(Exception):
+    """Fila de hashing cheia: o login deve ser tentado de novo mais tarde."""
+
+
+class PasswordHasher:
+    """
+    bcrypt fora das threads do Pyro5: as operações rodam num pool de
+    processos, com fila limitada (admission control). Quem não consegue vaga
+    em HASH_WAIT_TIMEOUT segundos recebe Overloaded em vez de travar o servidor.
+    """
+
+    def __init__(self, workers=HASH_WORKERS, max_pending=HASH_MAX_PENDING,
+                 rounds=BCRYPT_ROUNDS, wait_timeout=HASH_WAIT_TIMEOUT):
+        self.rounds = rounds
+        self.wait_timeout = wait_timeout
+        self._pool = ProcessPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self.max_pending = max_pending
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self._counters_lock = threading.Lock()
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            with self._counters_lock:
+                self.rejected += 1
+            raise Overloaded("Servidor ocupado, tente novamente.")
+        with self._counters_lock:
+            self.pending += 1
+        try:
+            return self._pool.submit(fn, *args).result()
+        finally:
+            with self._counters_lock:
+                self.pending -= 1
+                self.completed += 1
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(hash_password, password, self.rounds)
+
+    def verify(self, password, hashed):
+        return self._run(verify_password, password, hashed)
+
+    def needs_rehash(self, hashed):
+        """True se o hash foi gerado com um custo diferente do atual."""
+        try:
+            return password_rounds(hashed) != self.rounds
+        except (ValueError, IndexError):
+            return True
+
+    def close(self):
+        self._pool.shutdown(cancel_futures=True)
+
+    def stats(self):
+        with self._counters_lock:
+            return {
+                "rounds": self.rounds,
+                "pending": self.pending,
+                "max_pending": self.max_pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+
+
+class SessionStore:
+    """
+    Tokens de sessão em memória. O token só existe no cliente; aqui fica o
+    SHA-256 dele como chave, e a conferência final usa hmac.compare_digest.
+    Sessões abandonadas são removidas por sweep(), chamado periodicamente
+    pelo servidor e, de forma amortizada, a cada SESSION_SWEEP_EVERY create().
+    """
+
+    def __init__(self, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self._sessions = {}  # sha256(token) -> [token, username, expira_em]
+        self._by_user = {}   # username -> {sha256(token)}
+        self._lock = threading.Lock()
+        self._created = 0
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def create(self, username):
+        token = secrets.token_urlsafe(32)
+        key = self._key(token)
+        with self._lock:
+            self._sessions[key] = [token, username, time.time() + self.ttl]
+            self._by_user.setdefault(username, set()).add(key)
+            self._created += 1
+            sweep = self._created % SESSION_SWEEP_EVERY == 0
+        if sweep:
+            self.sweep()
+        return token
+
+    def resolve(self, token):
+        """Username dono da sessão, ou None se inválida/expirada."""
+        if not isinstance(token, str):
+            return None
+        key = self._key(token)
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None or not hmac.compare_digest(entry[0], token):
+                return None
+            if entry[2] < now:
+                self._drop(key)
+                return None
+            entry[2] = now + self.ttl  # expiração deslizante
+            return entry[1]
+
+    def _drop(self, key):
+        """Remove a sessão de key; chamar com self._lock."""
+        entry = self._sessions.pop(key, None)
+        if entry:
+            keys = self._by_user.get(entry[1])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_user[entry[1]]
+        return entry
+
+    def revoke(self, token):
+        if not isinstance(token, str):
+            return False
+        key = self._key(token)
+        with self._lock:
+            entry = self._drop(key)
+        return entry is not None
+
+    def revoke_user(self, username):
+        with self._lock:
+            for key in self._by_user.pop(username, set()):
+                self._sessions.pop(key, None)
+
+    def sweep(self):
+        """Remove as sessões expiradas; devolve quantas foram removidas."""
+        now = time.time()
+        with self._lock:
+            expired = [key for key, entry in self._sessions.items() if entry[2] < now]
+            for key in expired:
+                self._drop(key)
+        return len(expired)
+
+    def stats(self):
+        return {"active": len(self._sessions), "users": len(self._by_user)}
@@ -0,0 +1,69 @@
+# server/bench_groups.py
+# Custo de list_groups_with_status conforme o número de grupos cresce:
+# N+1 consultas (list_groups + membership_status por grupo) contra a
+# consulta única com LEFT JOIN e contra o cache por usuário.
+#
+# Uso: python bench_groups.py [grupos ...]
+import os
+import sys
+import tempfile
+import time
+
+from cache import GroupStatusCache
+from database import Database
+
+REPEAT = 20
+
+
+def n_plus_one(db, uid):
+    res = []
+    for gid, name, admin_uname, admin_on_leave in db.list_groups():
+        res.append((name, admin_uname, db.membership_status(uid, gid)))
+    return res
+
+
+def timed(fn):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        fn()
+    return (time.perf_counter() - start) / REPEAT * 1000
+
+
+def run(groups):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"), pool_size=1)
+        db.add_user("admin", b"x")
+        db.add_user("leitor", b"x")
+        cursor = db.conn.cursor()
+        cursor.executemany(
+            "INSERT INTO groups (name, admin) VALUES (?, 1)",
+            ((f"grupo{i}",) for i in range(groups))
+        )
+        # o leitor participa de um em cada dez grupos
+        cursor.executemany(
+            "INSERT INTO group_members (user_id, group_id, approved) VALUES (2, ?, 1)",
+            ((gid,) for gid in range(1, groups + 1, 10))
+        )
+        db.conn.commit()
+
+        cache = GroupStatusCache(db)
+        cache.get(2)  # aquece o cache
+        result = (
+            timed(lambda: n_plus_one(db, 2)),
+            timed(lambda: db.list_groups_with_status(2)),
+            timed(lambda: cache.get(2)),
+        )
+        db.close()
+    return result
+
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [100, 1000, 10000, 20000]
+    print(f"{'grupos':>8} {'N+1 (ms)':>10} {'JOIN (ms)':>10} {'cache (ms)':>11}")
+    for groups in sizes:
+        naive, joined, cached = run(groups)
+        print(f"{groups:>8} {naive:>10.2f} {joined:>10.2f} {cached:>11.4f}")
+
+
+if __name__ == "__main__":
+    main()
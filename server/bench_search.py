@@ -0,0 +1,152 @@
+# server/bench_search.py
+# Busca textual num corpus sintético: tempo de carga com os triggers do FTS5,
+# tempo de reconstrução do índice e latência de search_messages para termos
+# comuns, médios e raros (distribuição de Zipf), comparada a um LIKE '%termo%'
+# sobre as mesmas conversas.
+#
+# Uso: python bench_search.py [mensagens] [usuários] [grupos]
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+
+from database import Database, conversation_key, fts_query
+
+VOCABULARY = 20000
+WORDS_PER_MESSAGE = (4, 16)
+BATCH = 50000
+REPEAT = 5
+
+
+def words():
+    rnd = random.Random(42)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    vocab = ["".join(rnd.choice(letters) for _ in range(rnd.randint(3, 9))) + str(i)
+             for i in range(VOCABULARY)]
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(VOCABULARY)))
+    return vocab, cum_weights
+
+
+def load(db, messages, users, groups, vocab, cum_weights):
+    rnd = random.Random(7)
+    conn = db.conn
+    conn.executemany("INSERT INTO users (username, password_hash) VALUES (?, x'00')",
+                     ((f"user{i}",) for i in range(users)))
+    conn.executemany("INSERT INTO groups (name, admin) VALUES (?, 1)",
+                     ((f"grupo{i}",) for i in range(groups)))
+    # cada usuário participa de ~5 grupos
+    conn.executemany(
+        "INSERT OR IGNORE INTO group_members (user_id, group_id, approved) VALUES (?, ?, 1)",
+        ((u, rnd.randint(1, groups)) for u in range(1, users + 1) for _ in range(5))
+    )
+    conn.commit()
+
+    def text():
+        return " ".join(rnd.choices(vocab, cum_weights=cum_weights, k=rnd.randint(*WORDS_PER_MESSAGE)))
+
+    done = 0
+    while done < messages:
+        n = min(BATCH, messages - done)
+        half = n // 2
+        pairs = ((rnd.randint(1, users), rnd.randint(1, users)) for _ in range(half))
+        conn.executemany(
+            "INSERT INTO messages (sender, receiver, content, user_lo, user_hi) VALUES (?, ?, ?, ?, ?)",
+            ((a, b, text()) + conversation_key(a, b) for a, b in pairs)
+        )
+        conn.executemany(
+            "INSERT INTO group_messages (group_id, sender, content) VALUES (?, ?, ?)",
+            ((rnd.randint(1, groups), rnd.randint(1, users), text()) for _ in range(n - half))
+        )
+        conn.commit()
+        done += n
+
+
+def timed(fn):
+    result = fn()
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        fn()
+    return (time.perf_counter() - start) / REPEAT * 1000, result
+
+
+def like_search(db, user_id, term, limit=20):
+    """Sem índice: varre as mensagens visíveis ao usuário."""
+    cursor = db.conn.cursor()
+    cursor.execute("""
+        SELECT id FROM messages
+        WHERE (sender = ? OR receiver = ?) AND content LIKE ?
+        UNION ALL
+        SELECT id FROM group_messages
+        WHERE group_id IN (SELECT group_id FROM group_members WHERE user_id = ? AND approved = 1)
+          AND content LIKE ?
+        LIMIT ?
+    """, (user_id, user_id, f"%{term}%", user_id, f"%{term}%", limit))
+    return cursor.fetchall()
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    groups = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    vocab, cum_weights = words()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        db = Database(path, pool_size=1)
+        if not db.fts:
+            print("Este SQLite não tem FTS5.")
+            return
+
+        start = time.perf_counter()
+        load(db, messages, users, groups, vocab, cum_weights)
+        elapsed = time.perf_counter() - start
+        print(f"{messages} mensagens, {users} usuários, {groups} grupos")
+        print(f"  carga com triggers   {elapsed:8.1f} s  ({messages / elapsed:.0f} msg/s)")
+
+        start = time.perf_counter()
+        db.rebuild_fts()
+        print(f"  rebuild              {time.perf_counter() - start:8.1f} s")
+        start = time.perf_counter()
+        db.optimize_fts()
+        print(f"  optimize             {time.perf_counter() - start:8.1f} s")
+        print(f"  arquivo              {os.path.getsize(path) / 1024 ** 2:8.0f} MB")
+
+        user_id = users // 2
+        row = db.conn.execute(
+            "SELECT receiver FROM messages WHERE sender = ? LIMIT 1", (user_id,)
+        ).fetchone()
+        other = row[0] if row else user_id
+        (group_id,) = db.conn.execute(
+            "SELECT group_id FROM group_members WHERE user_id = ? LIMIT 1", (user_id,)
+        ).fetchone()
+        cases = [
+            ("comum", vocab[0]),
+            ("médio", vocab[200]),
+            ("raro", vocab[VOCABULARY - 1]),
+            ("duas palavras", f"{vocab[3]} {vocab[50]}"),
+            ("prefixo", vocab[100][:4]),
+        ]
+        print(f"\n{'consulta':<15} {'todas (ms)':>11} {'privadas':>9} {'um grupo':>9} "
+              f"{'1 conversa':>11} {'achados':>8}")
+        for label, text in cases:
+            query = fts_query(text)
+            t_all, rows = timed(lambda: db.search_messages(user_id, query))
+            t_dm, _ = timed(lambda: db.search_messages(user_id, query, groups=False))
+            t_grp, _ = timed(lambda: db.search_messages(user_id, query, private=False,
+                                                        groups=group_id))
+            t_one, _ = timed(lambda: db.search_messages(user_id, query, private=other,
+                                                        groups=False))
+            print(f"{label:<15} {t_all:>11.2f} {t_dm:>9.2f} {t_grp:>9.2f} {t_one:>11.2f} "
+                  f"{len(rows):>8}")
+
+        print("\nLIKE '%termo%' (sem índice, mesmas conversas):")
+        for label, text in cases[:3]:
+            t_like, _ = timed(lambda: like_search(db, user_id, text))
+            print(f"{label:<15} {t_like:>11.2f} ms")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# server/bench_write_behind.py
+# Compara mensagens/s de save_message em cada nível de durabilidade:
+# commit por linha ("full", "normal") contra o write-behind em lote ("group").
+#
+# Uso: python bench_write_behind.py [threads] [mensagens_por_thread]
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from database import Database, DURABILITY_LEVELS
+
+
+def run(durability, threads, per_thread):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"), pool_size=threads, durability=durability)
+        db.add_user("alice", b"x")
+        db.add_user("bob", b"x")
+
+        def worker():
+            for i in range(per_thread):
+                db.save_message(1, 2, f"mensagem {i}")
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        start = time.perf_counter()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+        total = db.conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        db.close()
+
+    assert total == threads * per_thread
+    return total / elapsed
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    print(f"{threads} threads x {per_thread} mensagens")
+    for durability in DURABILITY_LEVELS:
+        rate = run(durability, threads, per_thread)
+        print(f"  {durability:<8} {rate:10.0f} msg/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# server/blob_store.py
+import hashlib
+import os
+import tempfile
+from abc import ABC, abstractmethod
+
+BLOB_DIR = "blobs"
+
+
+class BlobStore(ABC):
+    """
+    Armazenamento de conteúdo endereçado pelo SHA-256 (hex) dos bytes.
+    O Database só guarda o hash; qualquer subclasse que implemente estes
+    métodos pode ser passada em Database(blob_store=...).
+    """
+
+    @abstractmethod
+    def put(self, data):
+        """Grava os bytes (se ainda não existirem) e devolve o hash."""
+
+    @abstractmethod
+    def get(self, digest):
+        """Conteúdo inteiro do blob."""
+
+    @abstractmethod
+    def open(self, digest):
+        """Arquivo binário aberto para leitura (para servir por partes)."""
+
+    @abstractmethod
+    def exists(self, digest):
+        """True se o blob está guardado."""
+
+    @abstractmethod
+    def delete(self, digest):
+        """Remove o blob (sem erro se ele não existir)."""
+
+    @abstractmethod
+    def digests(self, older_than=None):
+        """Hashes guardados; com older_than (epoch), só os gravados antes disso."""
+
+
+class DiskBlobStore(BlobStore):
+    """
+    Blobs em disco, em diretórios fragmentados pelo hash:
+    <root>/ab/cd/abcd...  Arquivos idênticos são gravados uma única vez.
+    """
+
+    def __init__(self, root=BLOB_DIR):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        if self.exists(digest):
+            return digest
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self._commit(tmp_path, digest)
+        return digest
+
+    def put_file(self, tmp_path, digest):
+        """Move um arquivo já gravado (hash conferido por quem chama) para o store."""
+        if self.exists(digest):
+            os.remove(tmp_path)
+        else:
+            self._commit(tmp_path, digest)
+        return digest
+
+    def _commit(self, tmp_path, digest):
+        final = self.path(digest)
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        # os.replace é atômico: leitores nunca veem um blob pela metade
+        os.replace(tmp_path, final)
+
+    def get(self, digest):
+        with self.open(digest) as f:
+            return f.read()
+
+    def open(self, digest):
+        return open(self.path(digest), "rb")
+
+    def delete(self, digest):
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+    def digests(self, older_than=None):
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if dirpath == self.root:
+                dirnames[:] = [d for d in dirnames if d != os.path.basename(self.tmp_dir)]
+                continue
+            for name in filenames:
+                if older_than is not None:
+                    try:
+                        if os.path.getmtime(os.path.join(dirpath, name)) >= older_than:
+                            continue
+                    except FileNotFoundError:
+                        continue
+                yield name
+
+    def size(self, digest):
+        return os.path.getsize(self.path(digest))
@@ -0,0 +1,542 @@
+# server/cache.py
+import sys
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+
+class LRUCache:
+    """Dicionário LRU thread-safe com contadores de acerto/erro."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def peek(self, key):
+        """Como get(), sem contar acerto/erro nem mexer na ordem."""
+        with self._lock:
+            return self._data.get(key)
+
+    def pop(self, key):
+        with self._lock:
+            return self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class UserDirectory:
+    """
+    Cache em memória de usuários: username -> (id, username, hash, banned),
+    o mesmo formato de Database.get_user(). Carregado sob demanda; toda
+    escrita que muda um usuário precisa passar por aqui (ou chamar invalidate).
+    all() guarda também a lista completa (Database.list_users()).
+    """
+
+    def __init__(self, db, capacity=10000):
+        self.db = db
+        self._cache = LRUCache(capacity)
+        self._all = None
+        # Incrementado a cada invalidação: uma leitura do banco que começou
+        # antes de uma invalidação não pode repovoar o cache com dado velho.
+        # Conferência + put e incremento + pop ficam sob a mesma trava.
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, username):
+        user = self._cache.get(username)
+        if user is None:
+            generation = self._generation
+            user = self.db.get_user(username)
+            if user is not None:
+                with self._lock:
+                    if generation == self._generation:
+                        self._cache.put(username, user)
+        return user
+
+    def all(self):
+        users = self._all
+        if users is None:
+            generation = self._generation
+            users = self.db.list_users()
+            with self._lock:
+                if generation == self._generation:
+                    self._all = users
+        return users
+
+    def invalidate(self, username):
+        with self._lock:
+            self._generation += 1
+            self._cache.pop(username)
+            self._all = None
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._cache.clear()
+            self._all = None
+
+    # --------- escritas que mudam o usuário ---------
+    def ban(self, username):
+        self.db.ban_user(username)
+        self.invalidate(username)
+
+    def unban(self, username):
+        self.db.unban_user(username)
+        self.invalidate(username)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+class GroupStatusCache:
+    """
+    Cache por usuário da lista (nome, admin, approved) devolvida por
+    Database.list_groups_with_status(). Mudanças de membro invalidam só o
+    usuário afetado; criar/apagar grupo ou trocar admin limpa tudo.
+    """
+
+    def __init__(self, db, capacity=5000):
+        self.db = db
+        self._cache = LRUCache(capacity)
+        self._generation = 0  # ver UserDirectory
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        rows = self._cache.get(user_id)
+        if rows is None:
+            generation = self._generation
+            rows = self.db.list_groups_with_status(user_id)
+            with self._lock:
+                if generation == self._generation:
+                    self._cache.put(user_id, rows)
+        return rows
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._generation += 1
+            self._cache.pop(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
+
+
+class Roster:
+    """
+    Membros de um grupo, user_id -> username: aprovados por ordem de entrada
+    (o primeiro é o sucessor do admin) e pedidos pendentes. Os métodos de
+    mudança espelham os de Database e são chamados por GroupRosters.
+    """
+    __slots__ = ("approved", "pending", "_names")
+
+    def __init__(self, approved=(), pending=()):
+        self.approved = OrderedDict(approved)
+        self.pending = dict(pending)
+        self._names = None  # tuple(approved.values()), refeita após mudança
+
+    def status(self, user_id):
+        """Como Database.membership_status: 1 aprovado, 0 pendente, None fora."""
+        if user_id in self.approved:
+            return 1
+        if user_id in self.pending:
+            return 0
+        return None
+
+    def members(self):
+        if self._names is None:
+            self._names = tuple(self.approved.values())
+        return self._names
+
+    def successor(self, user_id):
+        """Aprovado mais antigo que não seja user_id (olha no máximo dois)."""
+        for member_id in self.approved:
+            if member_id != user_id:
+                return member_id
+        return None
+
+    # --------- mudanças (mesma semântica das escritas do Database) ---------
+    def request(self, user_id, username):
+        if user_id not in self.approved:
+            self.pending.setdefault(user_id, username)
+
+    def approve(self, user_id, username):
+        if user_id in self.approved:
+            return
+        self.pending.pop(user_id, None)
+        self.approved[user_id] = username
+        self._names = None
+
+    def add(self, user_id, username):
+        # INSERT OR REPLACE: a entrada recomeça, então vai para o fim
+        self.pending.pop(user_id, None)
+        self.approved.pop(user_id, None)
+        self.approved[user_id] = username
+        self._names = None
+
+    def remove(self, user_id):
+        self.pending.pop(user_id, None)
+        if self.approved.pop(user_id, None) is not None:
+            self._names = None
+
+
+class GroupRosters:
+    """
+    Roster (ver Roster) por grupo, carregado sob demanda com uma consulta
+    (list_group_members) e depois mantido por update(), sem reler o banco:
+    checagem de permissão, fan-out e sucessão do admin não dependem do
+    tamanho do grupo. Toda escrita em group_members roda dentro de
+    writing(group_id); cargas concorrentes com uma escrita são descartadas.
+    """
+
+    def __init__(self, db, capacity=2000):
+        self.db = db
+        self._cache = LRUCache(capacity)
+        self._lock = threading.Lock()  # protege os rosters (lidos e mudados por várias threads)
+        self._generation = 0
+        self._writers = 0
+
+    def _roster(self, group_id):
+        roster = self._cache.get(group_id)
+        if roster is None:
+            generation = self._generation
+            rows = self.db.list_group_members(group_id)
+            roster = Roster(((uid, name) for uid, name, approved in rows if approved == 1),
+                            ((uid, name) for uid, name, approved in rows if approved != 1))
+            with self._lock:
+                if generation == self._generation and not self._writers:
+                    self._cache.put(group_id, roster)
+        return roster
+
+    def status(self, group_id, user_id):
+        roster = self._roster(group_id)
+        with self._lock:
+            return roster.status(user_id)
+
+    def members(self, group_id):
+        """Usernames dos aprovados, por ordem de entrada."""
+        roster = self._roster(group_id)
+        with self._lock:
+            return roster.members()
+
+    def pending(self, group_id):
+        """Usernames com pedido pendente, por ordem de pedido."""
+        roster = self._roster(group_id)
+        with self._lock:
+            return list(roster.pending.values())
+
+    def successor(self, group_id, user_id):
+        roster = self._roster(group_id)
+        with self._lock:
+            return roster.successor(user_id)
+
+    # --------- escritas ---------
+    @contextmanager
+    def writing(self, group_id):
+        """
+        Envolve a escrita em group_members (e o update() correspondente).
+        Se o bloco levantar exceção, o roster do grupo é descartado.
+        """
+        with self._lock:
+            self._writers += 1
+            self._generation += 1
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            with self._lock:
+                self._writers -= 1
+                self._generation += 1
+                if not ok:
+                    self._cache.pop(group_id)
+
+    def update(self, group_id, change, *args):
+        """Aplica Roster.<change>(*args) ao roster do grupo, se estiver carregado."""
+        with self._lock:
+            roster = self._cache.peek(group_id)
+            if roster is not None:
+                getattr(roster, change)(*args)
+
+    def drop(self, group_id):
+        with self._lock:
+            self._generation += 1
+            self._cache.pop(group_id)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
+
+
+class HomeCache:
+    """
+    Cache por usuário da parte da tela inicial (bootstrap) que não está em
+    outro cache: pedidos pendentes nos grupos que ele administra e a caixa
+    de entrada (conversation_state e group_state). Em vez de invalidação
+    espalhada pelo servidor, cada entrada guarda o seq do log de eventos em
+    que foi conferida: toda mudança que afeta esses dados grava um evento
+    visível ao usuário, então a entrada vale enquanto não houver evento
+    dele depois desse seq. get() devolve (seq, dados) com o seq usado na
+    conferência.
+    """
+
+    def __init__(self, db, capacity=5000):
+        self.db = db
+        self._cache = LRUCache(capacity)
+        self.stale = 0
+
+    def get(self, user_id):
+        latest = self.db.event_seq_range()[1]
+        entry = self._cache.get(user_id)
+        if entry is not None:
+            seq, data = entry
+            if seq == latest:
+                return seq, data
+            if not self.db.get_events_after(user_id, seq, 1):
+                # nada novo para ele: avança o seq para não reler esses eventos
+                self._cache.put(user_id, (latest, data))
+                return latest, data
+            self.stale += 1
+        pending = {}
+        for group, username in self.db.list_admin_pending_requests(user_id):
+            pending.setdefault(group, []).append(username)
+        data = {"pending": pending, "inbox": self.db.list_inbox(user_id)}
+        self._cache.put(user_id, (latest, data))
+        return latest, data
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats["stale"] = self.stale
+        return stats
+
+
+def _row_bytes(row):
+    """Memória aproximada de uma linha de mensagem (tupla + campos)."""
+    return sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row)
+
+
+class _Tail:
+    """Fim de uma conversa: contém todas as mensagens com id > floor."""
+    __slots__ = ("rows", "floor", "bytes")
+
+    def __init__(self, rows, floor):
+        self.rows = deque(rows)
+        self.floor = floor
+        self.bytes = sum(_row_bytes(r) for r in rows)
+
+    def last_id(self):
+        return self.rows[-1][0] if self.rows else self.floor
+
+
+class _Loading:
+    """Marca de uma carga em andamento; uma escrita na conversa a invalida."""
+    __slots__ = ("dirty",)
+
+    def __init__(self):
+        self.dirty = False
+
+
+class ConversationTails:
+    """
+    Cauda em memória das conversas ativas: as `size` mensagens mais
+    recentes de cada conversa privada ou grupo, nas mesmas linhas que o
+    Database devolve. As escritas chegam por append() depois do commit e só
+    entram se prev_id bater com a última mensagem guardada (senão a cauda é
+    descartada e recarregada na próxima leitura). Na falta, load(n) traz as
+    n últimas do banco. O total é limitado por max_bytes; as conversas
+    lidas há mais tempo saem primeiro.
+    """
+
+    def __init__(self, size=100, max_bytes=32 * 1024 ** 2):
+        self.size = size
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()  # chave -> _Tail ou _Loading
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.gaps = 0
+        self.evictions = 0
+
+    # --------- leitura ---------
+    def since(self, key, after_id, limit, load):
+        """
+        Como get_*_after (ou a última página, com after_id=0); None quando
+        a cauda não cobre o pedido e a leitura precisa ir ao banco.
+        """
+        def select(tail):
+            if not after_id:
+                return self._latest(tail, None, limit)
+            if after_id < tail.floor:
+                return None
+            rows = []
+            for row in reversed(tail.rows):
+                if row[0] <= after_id:
+                    break
+                rows.append(row)
+            rows.reverse()
+            return rows[:limit]
+        return self._read(key, select, load)
+
+    def before(self, key, before_id, limit, load):
+        """Como get_*_before; None quando a cauda não cobre o pedido."""
+        return self._read(key, lambda tail: self._latest(tail, before_id, limit), load)
+
+    @staticmethod
+    def _latest(tail, before_id, limit):
+        rows = [r for r in tail.rows if before_id is None or r[0] < before_id]
+        if len(rows) >= limit:
+            return rows[len(rows) - limit:]
+        return rows if tail.floor == 0 else None
+
+    def _read(self, key, select, load):
+        with self._lock:
+            tail = self._data.get(key)
+            if isinstance(tail, _Tail):
+                rows = select(tail)
+                if rows is not None:
+                    self.hits += 1
+                    self._data.move_to_end(key)
+                    return rows
+                self.misses += 1
+                return None  # histórico anterior à cauda
+            self.misses += 1
+            token = self._data[key] = _Loading()
+        try:
+            rows = load(self.size)
+        except Exception:
+            with self._lock:
+                if self._data.get(key) is token:
+                    del self._data[key]
+            raise
+        with self._lock:
+            if self._data.get(key) is not token:
+                return None
+            del self._data[key]
+            if token.dirty:
+                return None  # houve escrita durante a carga: rows pode estar incompleta
+            self.loads += 1
+            # rows são as últimas da conversa: toda mensagem >= rows[0] está nelas
+            tail = _Tail(rows, 0 if len(rows) < self.size else rows[0][0] - 1)
+            self._install(key, tail)
+            return select(tail)
+
+    # --------- escrita ---------
+    def append(self, key, msg_id, prev_id, row):
+        """Mensagem gravada (já commitada); prev_id None = primeira da conversa."""
+        with self._lock:
+            tail = self._data.get(key)
+            if tail is None:
+                if prev_id is None:
+                    self._install(key, _Tail([row], 0))
+                return
+            if isinstance(tail, _Loading):
+                tail.dirty = True
+                return
+            last = tail.last_id()
+            if msg_id <= last:
+                return  # já está na cauda (carregada depois do commit)
+            if (prev_id or 0) != last:
+                self._remove(key)  # lacuna: uma escrita não passou por aqui
+                self.gaps += 1
+                return
+            size = _row_bytes(row)
+            tail.rows.append(row)
+            tail.bytes += size
+            self.bytes += size
+            while len(tail.rows) > self.size:
+                old = tail.rows.popleft()
+                tail.floor = old[0]
+                size = _row_bytes(old)
+                tail.bytes -= size
+                self.bytes -= size
+            self._data.move_to_end(key)
+            self._evict()
+
+    def drop(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def _install(self, key, tail):
+        self._data[key] = tail
+        self.bytes += tail.bytes
+        self._evict()
+
+    def _remove(self, key):
+        tail = self._data.pop(key, None)
+        if isinstance(tail, _Tail):
+            self.bytes -= tail.bytes
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and len(self._data) > 1:
+            _, tail = self._data.popitem(last=False)
+            if isinstance(tail, _Tail):
+                self.bytes -= tail.bytes
+                self.evictions += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "conversations": len(self._data),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "loads": self.loads,
+            "gaps": self.gaps,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,118 @@
+# server/check_indexes.py
+# Regressão de índices: executa cada método de consulta do Database num banco
+# temporário, captura o SQL gerado e confere com EXPLAIN QUERY PLAN que a
+# tabela principal é lida pelo índice esperado (e nunca por varredura completa).
+#
+# Uso: python check_indexes.py   (código de saída != 0 em caso de falha)
+import os
+import sys
+import tempfile
+
+from database import Database
+
+# (método, argumentos, tabela consultada, índice esperado)
+# "INTEGER PRIMARY KEY" = busca por faixa do rowid (sem índice secundário)
+# "PRIMARY KEY" = busca pela chave de uma tabela WITHOUT ROWID
+# Uma tupla aceita qualquer um dos índices.
+# Busca: o FTS5 devolve os rowids e as mensagens são lidas pela chave
+# primária; antes, os grupos do usuário saem da chave de group_members.
+SEARCH = ("INTEGER PRIMARY KEY", "sqlite_autoindex_group_members_1")
+# Log de eventos: um ramo por forma de visibilidade, cada um no seu índice.
+EVENTS = ("idx_events_user_a", "idx_events_user_b", "idx_events_global", "idx_events_group")
+CHECKS = [
+    ("get_messages_between", (1, 2), "messages", "idx_messages_conversation"),
+    ("get_messages_after", (1, 2, 0, 100), "messages", "idx_messages_conversation"),
+    ("get_messages_before", (1, 2, 10, 100), "messages", "idx_messages_conversation"),
+    ("get_group_messages", (1,), "group_messages", "idx_group_messages_group"),
+    ("get_group_messages_after", (1, 0, 100), "group_messages", "idx_group_messages_group"),
+    ("get_group_messages_before", (1, 10, 100), "group_messages", "idx_group_messages_group"),
+    ("get_files_between", (1, 2), "file_transfers", "idx_file_transfers_conversation"),
+    ("membership_status", (2, 1), "group_members", "sqlite_autoindex_group_members_1"),
+    ("list_pending_requests", (1,), "group_members", "idx_group_members_order"),
+    ("list_group_members", (1, True), "group_members", "idx_group_members_order"),
+    ("list_group_members", (1, False), "group_members", "idx_group_members_order"),
+    ("list_ban_requests", ("pending",), "ban_requests", "idx_ban_requests_status"),
+    ("get_events_after", (1, 0, 100), "events", EVENTS),
+    ("list_admin_pending_requests", (1,), "groups", "idx_groups_admin"),
+    ("list_inbox", (2,), "conversation_state", "PRIMARY KEY"),
+    ("list_inbox", (2,), "group_members", "sqlite_autoindex_group_members_1"),
+    ("search_messages", (1, '"oi"*'), "messages", SEARCH),
+    ("search_messages", (1, '"oi"*'), "group_messages", SEARCH),
+]
+
+
+def _seed(db):
+    db.add_user("alice", b"x")
+    db.add_user("bob", b"x")
+    db.create_group("grupo", 1)
+    db.request_join_group(2, 1)
+    db.save_message(1, 2, "oi")
+    db.save_group_message(1, 1, "oi grupo")
+    db.save_file(1, 2, "a.txt", b"abc")
+    db.create_ban_request(1, 2, "spam")
+
+
+def _captured_sql(db, method, args):
+    statements = []
+    conn = db.conn
+    conn.set_trace_callback(statements.append)
+    try:
+        getattr(db, method)(*args)
+    finally:
+        conn.set_trace_callback(None)
+    return [s for s in statements if s.lstrip().upper().startswith("SELECT")]
+
+
+def _plan_aliases(sql, table):
+    """Nomes pelos quais a tabela aparece no plano (nome ou alias)."""
+    names = {table}
+    tokens = sql.replace("\n", " ").split()
+    for i, tok in enumerate(tokens[:-1]):
+        if tok == table and tokens[i + 1].upper() not in ("WHERE", "JOIN", "ON", "ORDER"):
+            names.add(tokens[i + 1])
+    return names
+
+
+def check(db):
+    failures = []
+    conn = db.conn
+    for method, args, table, index in CHECKS:
+        indexes = index if isinstance(index, tuple) else (index,)
+        statements = _captured_sql(db, method, args)
+        if not statements:
+            failures.append(f"{method}: nenhuma consulta capturada")
+            continue
+        for sql in statements:
+            plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+            aliases = _plan_aliases(sql, table)
+            scans = [p for p in plan if p.startswith("SCAN ") and p.split()[1] in aliases]
+            uses = [p for p in plan for index in indexes
+                    if f"USING INDEX {index}" in p
+                    or f"USING COVERING INDEX {index}" in p
+                    or (index == "INTEGER PRIMARY KEY" and "USING INTEGER PRIMARY KEY" in p)
+                    or (index == "PRIMARY KEY" and "USING PRIMARY KEY" in p)]
+            status = "ok" if uses and not scans else "FALHOU"
+            print(f"[{status}] {method}: {' | '.join(plan)}")
+            if status != "ok":
+                failures.append(f"{method}: esperado {' ou '.join(indexes)} em {table}")
+    return failures
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "check.db"), pool_size=1)
+        try:
+            _seed(db)
+            failures = check(db)
+        finally:
+            db.close()
+
+    if failures:
+        print("\n".join(failures))
+        return 1
+    print("Todos os métodos de consulta usam seus índices.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
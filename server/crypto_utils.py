@@ -1,10 +1,19 @@
 # server/crypto_utils.py
 import bcrypt
 
+# Custo padrão do bcrypt; hashes com outro custo são refeitos no próximo login
+BCRYPT_ROUNDS = 12
+
 # 🔒 Gera hash a partir de senha em texto
-def hash_password(password: str) -> bytes:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> bytes:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds))
 
 # 🔓 Verifica se senha em texto corresponde ao hash
 def verify_password(password: str, hashed: bytes) -> bool:
     return bcrypt.checkpw(password.encode(), hashed)
+
+# 🔢 Custo (rounds) usado num hash bcrypt: b"$2b$12$..." -> 12
+def password_rounds(hashed: bytes) -> int:
+    if isinstance(hashed, str):
+        hashed = hashed.encode()
+    return int(hashed.split(b"$")[2])
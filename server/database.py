@@ -1,12 +1,453 @@
+import hashlib
+import json
+import queue
 import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from pathlib import Path
 
+from events import (message_event, group_message_event, file_event, state_event,
+                    dm_key, group_key)
+
 DB_NAME = "whatsut.db"
 
+# Uma conexão por thread de trabalho do Pyro5; o tamanho do pool deve
+# acompanhar o THREADPOOL_SIZE do daemon (ver start_server()).
+DEFAULT_POOL_SIZE = 32
+BUSY_TIMEOUT_MS = 5000
+MAX_ROWID = 2 ** 63 - 1
+
+# Níveis de durabilidade das escritas de mensagens e arquivos:
+#   "full"   -> commit por linha, synchronous=FULL
+#   "normal" -> commit por linha, synchronous=NORMAL (padrão)
+#   "group"  -> write-behind: uma thread escritora agrupa as linhas e faz um
+#               commit (synchronous=FULL) por lote; quem chamou espera o
+#               Future do seu lote, então só retorna com a linha já durável
+DURABILITY_LEVELS = ("full", "normal", "group")
+GROUP_COMMIT_MAX_BATCH = 256
+GROUP_COMMIT_MAX_DELAY_MS = 5
+
+# Índices secundários gerenciados: criados (ou recriados) em toda inicialização.
+# A verificação de uso de cada índice fica em check_indexes.py.
+INDEXES = {
+    "idx_messages_conversation": "messages (user_lo, user_hi, id)",
+    "idx_group_messages_group": "group_messages (group_id, id)",
+    "idx_file_transfers_conversation": "file_transfers (user_lo, user_hi, id)",
+    "idx_file_transfers_blob": "file_transfers (blob_hash)",
+    "idx_group_members_order": "group_members (group_id, approved, approved_at, joined_at)",
+    "idx_ban_requests_status": "ban_requests (status, timestamp)",
+    "idx_groups_admin": "groups (admin)",
+    "idx_events_user_a": "events (user_a, seq)",
+    "idx_events_user_b": "events (user_b, seq)",
+    "idx_events_group": "events (group_id, seq)",
+    "idx_events_global": "events (seq) WHERE user_a IS NULL AND user_b IS NULL AND group_id IS NULL",
+}
+# Índices substituídos: removidos na inicialização de bancos antigos.
+# (sender, receiver, id) e (receiver, sender, id) davam às conversas
+# privadas duas buscas (uma por sentido); a chave (user_lo, user_hi) dá uma.
+# idx_messages_peer servia ao resumo da tela inicial, hoje em conversation_state.
+# idx_conversation_state_recent dava a caixa de entrada já ordenada; com os
+# grupos em group_state a ordem sai da junção das duas, e a chave primária basta.
+# idx_group_members_group ordenava por joined_at; a ordem de entrada é approved_at.
+DROPPED_INDEXES = ("idx_messages_pair", "idx_messages_inbox", "idx_file_transfers_pair",
+                   "idx_messages_peer", "idx_conversation_state_recent",
+                   "idx_group_members_group")
+
+# Tamanho do trecho de conteúdo nos resumos de conversa (conversation_state)
+SUMMARY_PREVIEW = 80
+
+# conversation_state: uma linha por usuário e conversa privada. Toda
+# mensagem privada passa por este upsert (na mesma transação): unread = 0
+# zera o contador (mensagem do próprio usuário), unread = 1 soma uma não lida.
+# Grupos não entram aqui: o resumo fica em group_state (uma linha por grupo)
+# e cada membro só tem o read_id em group_members; as não lidas são contadas
+# na leitura, até UNREAD_COUNT_MAX.
+_STATE_UPSERT = """
+ON CONFLICT (user_id, kind, peer) DO UPDATE SET
+    seq = excluded.seq,
+    last_id = excluded.last_id,
+    last_sender = excluded.last_sender,
+    preview = excluded.preview,
+    timestamp = excluded.timestamp,
+    unread = CASE WHEN excluded.unread = 0 THEN 0 ELSE conversation_state.unread + excluded.unread END,
+    read_id = MAX(conversation_state.read_id, excluded.read_id)
+"""
+
+UNREAD_COUNT_MAX = 999
+
+# Momento atual com milissegundos (approved_at): aprovações no mesmo segundo
+# mantêm a ordem em que foram gravadas
+_NOW_MS = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+# sweep_blobs(): blobs sem referência só saem depois desta idade (segundos),
+# para não apagar o de uma gravação de outro processo ainda em andamento
+BLOB_SWEEP_GRACE = 3600
+
+# Log de eventos (tabela events): linhas mantidas por prune_events(), que
+# apaga o excedente em transações de EVENT_PRUNE_BATCH linhas
+EVENT_LOG_RETENTION = 1_000_000
+EVENT_PRUNE_BATCH = 5000
+
+# Busca textual (FTS5, external content): um índice por tabela de mensagens,
+# mantido por triggers na mesma transação do INSERT/DELETE. A coluna scope
+# guarda quem pode ver a linha ("u<remetente> u<destinatário>" ou "g<grupo>"):
+# o filtro de visibilidade entra no MATCH e é resolvido pelo próprio índice.
+# A view *_src é o conteúdo externo (reconstrução e snippet()).
+FTS_TOKENIZER = "unicode61 remove_diacritics 2"
+FTS_INDEXES = {
+    "messages_fts": ("messages", "'u' || {r}.sender || ' u' || {r}.receiver"),
+    "group_messages_fts": ("group_messages", "'g' || {r}.group_id"),
+}
+SEARCH_SNIPPET_TOKENS = 12
+# Até este número de grupos o escopo entra no MATCH (um termo g<id> por
+# grupo); acima dele o MATCH fica só no conteúdo e os grupos do usuário são
+# filtrados por join com group_members, para a consulta não crescer com eles
+SEARCH_MAX_SCOPE_GROUPS = 32
+
+
+def fts_query(text):
+    """
+    Texto digitado -> expressão MATCH do FTS5: cada palavra vira uma frase
+    entre aspas (operadores e pontuação não são interpretados), todas
+    obrigatórias, e a última também casa como prefixo. None se vazio.
+    """
+    words = [w.replace('"', '""') for w in str(text).split()]
+    if not words:
+        return None
+    return " ".join(f'"{w}"' for w in words) + "*"
+
+
+def conversation_key(user_a_id, user_b_id):
+    """(user_lo, user_hi) da conversa privada: igual para os dois sentidos."""
+    return (user_a_id, user_b_id) if user_a_id <= user_b_id else (user_b_id, user_a_id)
+
+
+def utc_now():
+    """Mesmo formato do CURRENT_TIMESTAMP do SQLite (UTC)."""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class _Lease:
+    """Marca a posse de uma conexão pela thread atual (vive no threading.local)."""
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn):
+        self.conn = conn
+
+
+class ConnectionPool:
+    """
+    Pool limitado de conexões SQLite em modo WAL.
+    Cada thread recebe sempre a mesma conexão enquanto estiver viva; quando a
+    thread termina, a conexão volta para o pool e é reaproveitada.
+    """
+
+    def __init__(self, path=DB_NAME, size=DEFAULT_POOL_SIZE,
+                 busy_timeout=BUSY_TIMEOUT_MS, synchronous="NORMAL"):
+        self.path = path
+        self.size = size
+        self.busy_timeout = busy_timeout
+        self.synchronous = synchronous
+        self._idle = queue.LifoQueue()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all = []
+        self._closed = False
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            timeout=self.busy_timeout / 1000
+        )
+        # WAL: leitores nunca esperam por escritores (e vice-versa)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        return conn
+
+    def connection(self):
+        lease = getattr(self._local, "lease", None)
+        if lease is not None:
+            return lease.conn
+
+        conn = self._checkout()
+        lease = _Lease(conn)
+        # Quando a thread morre o threading.local é descartado e a conexão volta
+        weakref.finalize(lease, self._release, conn)
+        self._local.lease = lease
+        return conn
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Pool de conexões fechado")
+            create = len(self._all) < self.size
+            if create:
+                conn = self._open()
+                self._all.append(conn)
+        if create:
+            return conn
+
+        try:
+            return self._idle.get(timeout=self.busy_timeout / 1000)
+        except queue.Empty:
+            raise sqlite3.OperationalError(
+                f"Pool de conexões esgotado ({self.size} conexões em uso)"
+            )
+
+    def _release(self, conn):
+        if self._closed:
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            return
+        self._idle.put(conn)
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "open": len(self._all),
+            "idle": self._idle.qsize(),
+        }
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            conns, self._all = self._all, []
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+
+class GroupCommitWriter:
+    """
+    Thread escritora única do modo "group". Drena a fila de escritas e faz
+    um commit por lote: enquanto um commit (fsync) está em andamento as novas
+    escritas se acumulam na fila e entram juntas no próximo lote. O lote
+    fecha por tamanho (max_batch) ou por prazo (max_delay_ms).
+    """
+
+    def __init__(self, pool, max_batch=GROUP_COMMIT_MAX_BATCH,
+                 max_delay_ms=GROUP_COMMIT_MAX_DELAY_MS):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.batches = 0
+        self.rows = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn):
+        """Agenda fn(cursor); o Future recebe o retorno de fn após o commit."""
+        future = Future()
+        self._queue.put((fn, future))
+        return future
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        conn = self.pool.connection()
+        conn.execute("PRAGMA synchronous = FULL")
+        running = True
+        while running:
+            item = self._queue.get()
+            if item is None:
+                break
+            # Junta o que já está na fila (chegou durante o commit anterior);
+            # o lote fecha quando a fila esvazia, enche ou estoura o prazo
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch and time.monotonic() < deadline:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            self._commit_batch(conn, batch)
+
+    def _commit_batch(self, conn, batch):
+        cursor = conn.cursor()
+        results = []
+        try:
+            cursor.execute("BEGIN")
+            for fn, future in batch:
+                # Savepoint por linha: uma escrita inválida não derruba o lote
+                cursor.execute("SAVEPOINT linha")
+                try:
+                    results.append((future, fn(cursor), None))
+                    cursor.execute("RELEASE linha")
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO linha")
+                    cursor.execute("RELEASE linha")
+                    results.append((future, None, e))
+            conn.commit()
+        except Exception as e:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+            for fn, future in batch:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.rows += len(batch)
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def stats(self):
+        return {
+            "pending": self._queue.qsize(),
+            "batches": self.batches,
+            "rows": self.rows,
+        }
+
+
 class Database:
-    def __init__(self):
-        self.conn = sqlite3.connect(DB_NAME, check_same_thread=False)
+    def __init__(self, path=DB_NAME, pool_size=DEFAULT_POOL_SIZE, durability="normal",
+                 blob_store=None):
+        """
+        blob_store: se informado (ver blob_store.py), o conteúdo dos arquivos
+        vai para ele e file_transfers guarda só metadados e o hash SHA-256.
+        """
+        self.blob_store = blob_store
+        self._blob_pending = {}  # hash -> gravações em andamento (ver blob_reference)
+        self._blob_lock = threading.Lock()
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"durability deve ser um de {DURABILITY_LEVELS}")
+        self.durability = durability
+        synchronous = "FULL" if durability == "full" else "NORMAL"
+        # No modo "group" a thread escritora fica com uma conexão só para ela
+        extra = 1 if durability == "group" else 0
+        self.pool = ConnectionPool(path, pool_size + extra, synchronous=synchronous)
+        self._tx = threading.local()  # transação explícita aberta pela thread (transaction())
+        self.fts = False              # FTS5 disponível (ver create_fts)
+        self.fts_created = []         # índices criados (e preenchidos) nesta inicialização
         self.create_tables()
+        self._writer = GroupCommitWriter(self.pool) if durability == "group" else None
+
+    @property
+    def conn(self):
+        """Conexão exclusiva da thread atual."""
+        return self.pool.connection()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self.pool.close()
+
+    def stats(self):
+        stats = {"durability": self.durability, "pool": self.pool.stats()}
+        if self._writer is not None:
+            stats["writer"] = self._writer.stats()
+        return stats
+
+    # --------- ESCRITAS (commit por linha ou em lote) ---------
+    @contextmanager
+    def transaction(self):
+        """
+        Agrupa as escritas da thread atual numa transação só: dentro do
+        bloco os métodos de escrita não fazem commit (ver _commit) e as
+        escritas de submit_write rodam na própria conexão, não na thread
+        escritora. Commit ao sair do bloco; rollback se ele levantar exceção.
+        """
+        if getattr(self._tx, "active", False):
+            raise sqlite3.ProgrammingError("transação já aberta nesta thread")
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        self._tx.active = True
+        try:
+            yield
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._tx.active = False
+
+    @contextmanager
+    def savepoint(self, name="item"):
+        """Dentro de transaction(): desfaz só as escritas do bloco se ele levantar exceção."""
+        cursor = self.conn.cursor()
+        cursor.execute(f"SAVEPOINT {name}")
+        try:
+            yield
+        except BaseException:
+            cursor.execute(f"ROLLBACK TO {name}")
+            cursor.execute(f"RELEASE {name}")
+            raise
+        cursor.execute(f"RELEASE {name}")
+
+    def _commit(self):
+        """Commit da escrita atual, exceto dentro de transaction() (quem fecha é o bloco)."""
+        if not getattr(self._tx, "active", False):
+            self.conn.commit()
+
+    def _rollback(self):
+        """
+        Desfaz a escrita que falhou (sem isso a conexão fica com a transação
+        aberta e a trava de escrita presa). Dentro de transaction() o comando
+        que falhou já foi desfeito pelo SQLite e o resto é decidido pelo bloco.
+        """
+        if not getattr(self._tx, "active", False):
+            self.conn.rollback()
+
+    def submit_write(self, fn):
+        """
+        Executa fn(cursor) numa transação de escrita. Devolve um Future com o
+        retorno de fn, resolvido quando a linha estiver gravada conforme o
+        nível de durabilidade configurado.
+        """
+        if getattr(self._tx, "active", False):
+            # a thread escritora esperaria pela trava desta transação: roda aqui
+            future = Future()
+            try:
+                with self.savepoint("escrita"):
+                    future.set_result(fn(self.conn.cursor()))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        if self._writer is not None:
+            return self._writer.submit(fn)
+
+        future = Future()
+        try:
+            cursor = self.conn.cursor()
+            result = fn(cursor)
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        return future
+
+    def _write(self, fn):
+        return self.submit_write(fn).result()
 
     def create_tables(self):
         cursor = self.conn.cursor()
@@ -39,6 +480,7 @@ class Database:
             group_id INTEGER,
             approved INTEGER DEFAULT 0,
             joined_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            approved_at DATETIME,
             PRIMARY KEY(user_id, group_id),
             FOREIGN KEY(user_id) REFERENCES users(id),
             FOREIGN KEY(group_id) REFERENCES groups(id)
@@ -53,6 +495,8 @@ class Database:
             receiver INTEGER NOT NULL,
             content TEXT NOT NULL,
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            user_lo INTEGER,
+            user_hi INTEGER,
             FOREIGN KEY(sender) REFERENCES users(id),
             FOREIGN KEY(receiver) REFERENCES users(id)
         )
@@ -81,6 +525,8 @@ class Database:
             file_data BLOB NOT NULL,
             file_size INTEGER NOT NULL,
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            user_lo INTEGER,
+            user_hi INTEGER,
             FOREIGN KEY(sender) REFERENCES users(id),
             FOREIGN KEY(receiver) REFERENCES users(id)
         )
@@ -100,6 +546,34 @@ class Database:
         )
         """)
 
+        # Log de eventos: uma linha por mudança, gravada na mesma transação.
+        # Quem vê cada evento: user_a/user_b, os membros aprovados de group_id
+        # ou todos (as três colunas nulas).
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            user_a INTEGER,
+            user_b INTEGER,
+            group_id INTEGER,
+            payload TEXT NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+
+        # Identidade do banco: sorteada na criação, muda se o arquivo for
+        # recriado. Os clientes a usam para descartar caches de outro banco.
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        """)
+        cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('instance_id', ?)",
+                       (uuid.uuid4().hex,))
+        cursor.execute("SELECT value FROM meta WHERE key = 'instance_id'")
+        self.instance_id = cursor.fetchone()[0]
+
         self.conn.commit()
         
         # --- MIGRAÇÕES (CORREÇÃO: Agora dentro de create_tables) ---
@@ -113,9 +587,312 @@ class Database:
             cursor.execute("ALTER TABLE group_members ADD COLUMN joined_at DATETIME DEFAULT CURRENT_TIMESTAMP")
         except Exception:
             pass # Coluna já existe
+
+        # Momento da aprovação (ordem de entrada e de sucessão do admin);
+        # joined_at continua sendo o do pedido. Bancos antigos usam joined_at.
+        try:
+            with self.transaction():
+                cursor.execute("ALTER TABLE group_members ADD COLUMN approved_at DATETIME")
+                cursor.execute("UPDATE group_members SET approved_at = joined_at WHERE approved = 1")
+        except sqlite3.OperationalError as e:
+            if "duplicate column" not in str(e):
+                raise
+
+        # Hash do conteúdo no blob store (file_data fica vazio nesses casos)
+        try:
+            cursor.execute("ALTER TABLE file_transfers ADD COLUMN blob_hash TEXT")
+        except Exception:
+            pass # Coluna já existe
             
         self.conn.commit()
 
+        # Chave da conversa privada (ver conversation_key). Colunas e
+        # preenchimento numa transação só: um banco antigo ou fica com as
+        # colunas preenchidas, ou continua sem elas.
+        for table in ("messages", "file_transfers"):
+            try:
+                with self.transaction():
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN user_lo INTEGER")
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN user_hi INTEGER")
+                    cursor.execute(
+                        f"UPDATE {table} SET user_lo = MIN(sender, receiver), user_hi = MAX(sender, receiver)"
+                    )
+                    if cursor.rowcount > 0:
+                        print(f"[DB] chave de conversa preenchida em {cursor.rowcount} linhas de {table}")
+            except sqlite3.OperationalError as e:
+                if "duplicate column" not in str(e):
+                    raise
+
+        # Caixa de entrada: estado de cada conversa para cada usuário.
+        # kind 'dm' -> peer = id do outro usuário; 'group' -> peer = id do grupo.
+        # read_id = última mensagem lida; unread = mensagens de outros depois dela.
+        # seq = posição da última mensagem no log de eventos: ordena conversas
+        # privadas e de grupo juntas (timestamp só tem resolução de segundos).
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'conversation_state'"
+        ).fetchone()
+        if not exists:
+            with self.transaction():
+                cursor.execute("""
+                CREATE TABLE conversation_state (
+                    user_id INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    peer INTEGER NOT NULL,
+                    seq INTEGER NOT NULL DEFAULT 0,
+                    last_id INTEGER NOT NULL,
+                    last_sender INTEGER NOT NULL,
+                    preview TEXT NOT NULL,
+                    timestamp DATETIME NOT NULL,
+                    unread INTEGER NOT NULL DEFAULT 0,
+                    read_id INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user_id, kind, peer)
+                ) WITHOUT ROWID
+                """)
+                self._backfill_conversation_state(cursor)
+
+        # Resumo de cada grupo (última mensagem) e, em group_members.read_id,
+        # a última mensagem lida por membro. Bancos antigos tinham uma linha
+        # por membro em conversation_state, atualizada a cada mensagem.
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'group_state'"
+        ).fetchone()
+        if not exists:
+            with self.transaction():
+                cursor.execute("ALTER TABLE group_members ADD COLUMN read_id INTEGER NOT NULL DEFAULT 0")
+                cursor.execute("""
+                CREATE TABLE group_state (
+                    group_id INTEGER PRIMARY KEY,
+                    seq INTEGER NOT NULL DEFAULT 0,
+                    last_id INTEGER NOT NULL,
+                    last_sender INTEGER NOT NULL,
+                    preview TEXT NOT NULL,
+                    timestamp DATETIME NOT NULL
+                )
+                """)
+                self._backfill_group_state(cursor)
+        self.create_indexes()
+        self.create_fts()
+
+    def _backfill_conversation_state(self, cursor):
+        """Banco antigo: a última mensagem de cada conversa, tudo como lido (seq 0)."""
+        cursor.execute("""
+            INSERT INTO conversation_state
+                (user_id, kind, peer, last_id, last_sender, preview, timestamp, unread, read_id)
+            SELECT t.me, 'dm', t.peer, m.id, m.sender, substr(m.content, 1, ?), m.timestamp, 0, m.id
+            FROM (SELECT user_lo AS me, user_hi AS peer, MAX(id) AS last_id
+                  FROM messages GROUP BY user_lo, user_hi
+                  UNION ALL
+                  SELECT user_hi, user_lo, MAX(id)
+                  FROM messages WHERE user_hi != user_lo GROUP BY user_lo, user_hi) t
+            JOIN messages m ON m.id = t.last_id
+        """, (SUMMARY_PREVIEW,))
+        if cursor.rowcount > 0:
+            print(f"[DB] caixa de entrada criada: {cursor.rowcount} conversas privadas")
+
+    def _backfill_group_state(self, cursor):
+        """
+        Preenche group_state com a última mensagem de cada grupo e o read_id
+        dos membros: quem tinha linha em conversation_state fica com as
+        mesmas não lidas (a mensagem anterior às `unread` últimas de outros
+        vira o read_id); os demais, com tudo lido.
+        """
+        cursor.execute("""
+            INSERT INTO group_state (group_id, seq, last_id, last_sender, preview, timestamp)
+            SELECT t.group_id,
+                   COALESCE((SELECT MAX(cs.seq) FROM conversation_state cs
+                             WHERE cs.kind = 'group' AND cs.peer = t.group_id), 0),
+                   m.id, m.sender, substr(m.content, 1, ?), m.timestamp
+            FROM (SELECT group_id, MAX(id) AS last_id FROM group_messages GROUP BY group_id) t
+            JOIN group_messages m ON m.id = t.last_id
+        """, (SUMMARY_PREVIEW,))
+        groups = cursor.rowcount
+        cursor.execute("""
+            UPDATE group_members SET read_id = COALESCE(
+                (SELECT last_id FROM group_state WHERE group_id = group_members.group_id), 0)
+        """)
+        old_rows = cursor.execute(
+            "SELECT user_id, peer, last_id, read_id, unread FROM conversation_state WHERE kind = 'group'"
+        ).fetchall()
+        for user_id, group_id, last_id, read_id, unread in old_rows:
+            if unread > 0:
+                row = cursor.execute(
+                    """SELECT id FROM group_messages WHERE group_id = ? AND sender != ?
+                    ORDER BY id DESC LIMIT 1 OFFSET ?""",
+                    (group_id, user_id, unread)
+                ).fetchone()
+                last_id = max(read_id, row[0] if row else 0)
+            cursor.execute(
+                "UPDATE group_members SET read_id = ? WHERE user_id = ? AND group_id = ?",
+                (last_id, user_id, group_id)
+            )
+        cursor.execute("DELETE FROM conversation_state WHERE kind = 'group'")
+        if groups > 0:
+            print(f"[DB] resumo de grupos criado: {groups} grupos")
+
+    def create_indexes(self):
+        cursor = self.conn.cursor()
+        for name in DROPPED_INDEXES:
+            cursor.execute(f"DROP INDEX IF EXISTS {name}")
+        for name, target in INDEXES.items():
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+        # Atualiza as estatísticas usadas pelo planejador de consultas
+        cursor.execute("PRAGMA optimize")
+        self.conn.commit()
+
+    def create_fts(self):
+        """
+        Cria os índices de busca e os triggers. Um índice novo num banco que
+        já tem mensagens é preenchido aqui (uma vez); rebuild_fts.py faz o
+        mesmo fora do servidor. Sem FTS5 no SQLite, a busca fica desligada.
+        """
+        conn = self.conn
+        for fts, (table, scope) in FTS_INDEXES.items():
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,)
+            ).fetchone()
+            try:
+                conn.execute(f"""
+                CREATE VIEW IF NOT EXISTS {fts}_src AS
+                SELECT id, content, {scope.format(r=table)} AS scope FROM {table}
+                """)
+                conn.execute(f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                    content, scope,
+                    content='{fts}_src', content_rowid='id', tokenize='{FTS_TOKENIZER}'
+                )
+                """)
+            except sqlite3.OperationalError as e:
+                conn.rollback()
+                print(f"[DB] busca textual desativada (FTS5 indisponível): {e}")
+                return
+            new, old = scope.format(r="new"), scope.format(r="old")
+            conn.executescript(f"""
+            CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts} (rowid, content, scope) VALUES (new.id, new.content, {new});
+            END;
+            CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, content, scope) VALUES ('delete', old.id, old.content, {old});
+            END;
+            CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table}
+            WHEN new.content IS NOT old.content OR {new} IS NOT {old} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, content, scope) VALUES ('delete', old.id, old.content, {old});
+                INSERT INTO {fts} (rowid, content, scope) VALUES (new.id, new.content, {new});
+            END;
+            """)
+            if not exists:
+                self.fts_created.append(fts)
+                # rank = bm25 só do conteúdo (os tokens de scope não pontuam)
+                conn.execute(f"INSERT INTO {fts} ({fts}, rank) VALUES ('rank', 'bm25(1.0, 0.0)')")
+                if conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                    print(f"[DB] indexando {table} para busca (primeira vez)...")
+                    self.rebuild_fts(fts)
+            conn.commit()
+        self.fts = True
+
+    def rebuild_fts(self, fts=None):
+        """Reconstrói os índices de busca a partir das tabelas de mensagens."""
+        for name in ([fts] if fts else FTS_INDEXES):
+            self.conn.execute(f"INSERT INTO {name} ({name}) VALUES ('rebuild')")
+        self.conn.commit()
+
+    def optimize_fts(self):
+        """Junta os segmentos dos índices de busca (consultas mais rápidas)."""
+        for name in FTS_INDEXES:
+            self.conn.execute(f"INSERT INTO {name} ({name}) VALUES ('optimize')")
+        self.conn.commit()
+
+    def check_fts(self):
+        """Confere os índices contra as tabelas; levanta sqlite3.DatabaseError se divergirem."""
+        for name in FTS_INDEXES:
+            self.conn.execute(f"INSERT INTO {name} ({name}, rank) VALUES ('integrity-check', 1)")
+
+    # --------- LOG DE EVENTOS ---------
+    def _log_event(self, cursor, event, user_a=None, user_b=None, group_id=None):
+        """Grava o evento na transação do cursor; devolve o evento com "seq"."""
+        cursor.execute(
+            """INSERT INTO events (kind, user_a, user_b, group_id, payload, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?)""",
+            (event["type"], user_a, user_b, group_id, json.dumps(event), event["timestamp"])
+        )
+        event["seq"] = cursor.lastrowid
+        return event
+
+    def _username(self, cursor, user_id):
+        cursor.execute("SELECT username FROM users WHERE id = ?", (user_id,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def _group_name(self, cursor, group_id):
+        cursor.execute("SELECT name FROM groups WHERE id = ?", (group_id,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def get_events_after(self, user_id, after_seq, limit):
+        """
+        Eventos visíveis ao usuário com seq > after_seq, em ordem de seq.
+        Uma busca por índice para cada forma de visibilidade (user_a, user_b,
+        eventos globais e cada grupo aprovado), cada uma limitada a `limit`:
+        o custo segue o tráfego do próprio usuário, não o do servidor inteiro.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT seq, payload FROM (
+                SELECT * FROM (SELECT seq, payload FROM events
+                               WHERE user_a = ? AND seq > ? ORDER BY seq LIMIT ?)
+                UNION
+                SELECT * FROM (SELECT seq, payload FROM events
+                               WHERE user_b = ? AND seq > ? ORDER BY seq LIMIT ?)
+                UNION
+                SELECT * FROM (SELECT seq, payload FROM events INDEXED BY idx_events_global
+                               WHERE user_a IS NULL AND user_b IS NULL AND group_id IS NULL
+                                 AND seq > ? ORDER BY seq LIMIT ?)
+                UNION
+                SELECT * FROM (SELECT e.seq, e.payload
+                               FROM group_members gm
+                               JOIN events e ON e.group_id = gm.group_id AND e.seq > ?
+                               WHERE gm.user_id = ? AND gm.approved = 1
+                               ORDER BY e.seq LIMIT ?)
+            )
+            ORDER BY seq ASC
+            LIMIT ?
+        """, (user_id, after_seq, limit, user_id, after_seq, limit, after_seq, limit,
+              after_seq, user_id, limit, limit))
+        events = []
+        for seq, payload in cursor.fetchall():
+            event = json.loads(payload)
+            event["seq"] = seq
+            events.append(event)
+        return events
+
+    def event_seq_range(self):
+        """(menor, maior) seq ainda no log; (0, 0) se vazio."""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT MIN(seq), MAX(seq) FROM events")
+        lo, hi = cursor.fetchone()
+        return (lo or 0, hi or 0)
+
+    def prune_events(self, keep=EVENT_LOG_RETENTION, batch=EVENT_PRUNE_BATCH):
+        """
+        Apaga os eventos mais antigos, mantendo os últimos `keep`. Roda em
+        transações de até `batch` linhas, para não segurar a trava de escrita
+        do SQLite enquanto o servidor atende; devolve quantos apagou.
+        """
+        cutoff = self.event_seq_range()[1] - keep
+        removed = 0
+        while cutoff > 0:
+            def delete(cursor):
+                cursor.execute(
+                    """DELETE FROM events WHERE seq IN (
+                        SELECT seq FROM events WHERE seq <= ? ORDER BY seq LIMIT ?)""",
+                    (cutoff, batch)
+                )
+                return cursor.rowcount
+            count = self._write(delete)
+            removed += count
+            if count < batch:
+                break
+        return removed
+
     # --------- CRUD Usuário ---------
     def add_user(self, username, password_hash):
         cursor = self.conn.cursor()
@@ -124,9 +901,11 @@ class Database:
                 "INSERT INTO users (username, password_hash) VALUES (?, ?)",
                 (username, password_hash)
             )
-            self.conn.commit()
+            self._log_event(cursor, state_event("user_registered", utc_now(), username=username))
+            self._commit()
             return True
         except sqlite3.IntegrityError:
+            self._rollback()
             return False
 
     def get_user(self, username):
@@ -137,15 +916,29 @@ class Database:
         )
         return cursor.fetchone()
 
+    def get_username(self, user_id):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT username FROM users WHERE id = ?", (user_id,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def update_password_hash(self, user_id, password_hash):
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "UPDATE users SET password_hash = ? WHERE id = ?",
+            (password_hash, user_id)
+        )
+        self._commit()
+
     def ban_user(self, username):
         cursor = self.conn.cursor()
         cursor.execute("UPDATE users SET banned = 1 WHERE username = ?", (username,))
-        self.conn.commit()
+        self._commit()
 
     def unban_user(self, username):
         cursor = self.conn.cursor()
         cursor.execute("UPDATE users SET banned = 0 WHERE username = ?", (username,))
-        self.conn.commit()
+        self._commit()
 
     def list_users(self):
         cursor = self.conn.cursor()
@@ -154,12 +947,43 @@ class Database:
 
     # --------- MENSAGENS PRIVADAS ---------
     def save_message(self, sender_id, receiver_id, content):
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "INSERT INTO messages (sender, receiver, content) VALUES (?, ?, ?)",
-            (sender_id, receiver_id, content)
-        )
-        self.conn.commit()
+        """
+        Retorna o evento gravado no log (ver events.message_event), com id,
+        prev_id, timestamp e seq. prev_id é o id da mensagem anterior da
+        mesma conversa (None se for a primeira); o cliente usa para detectar
+        lacunas ao receber eventos.
+        """
+        timestamp = utc_now()
+        user_lo, user_hi = conversation_key(sender_id, receiver_id)
+        def insert(cursor):
+            cursor.execute(
+                """INSERT INTO messages (sender, receiver, content, timestamp, user_lo, user_hi)
+                VALUES (?, ?, ?, ?, ?, ?)""",
+                (sender_id, receiver_id, content, timestamp, user_lo, user_hi)
+            )
+            msg_id = cursor.lastrowid
+            cursor.execute(
+                "SELECT MAX(id) FROM messages WHERE user_lo = ? AND user_hi = ? AND id < ?",
+                (user_lo, user_hi, msg_id)
+            )
+            prev_id = cursor.fetchone()[0]
+            event = message_event(
+                msg_id, prev_id, self._username(cursor, sender_id),
+                self._username(cursor, receiver_id), content, timestamp
+            )
+            event = self._log_event(cursor, event, user_a=sender_id, user_b=receiver_id)
+            seq, preview = event["seq"], content[:SUMMARY_PREVIEW]
+            rows = [(sender_id, receiver_id, seq, msg_id, sender_id, preview, timestamp, 0, msg_id)]
+            if receiver_id != sender_id:
+                rows.append((receiver_id, sender_id, seq, msg_id, sender_id, preview, timestamp, 1, 0))
+            cursor.executemany(
+                """INSERT INTO conversation_state
+                (user_id, kind, peer, seq, last_id, last_sender, preview, timestamp, unread, read_id)
+                VALUES (?, 'dm', ?, ?, ?, ?, ?, ?, ?, ?)""" + _STATE_UPSERT,
+                rows
+            )
+            return event
+        return self._write(insert)
 
     def get_messages_between(self, user_a_id, user_b_id):
         cursor = self.conn.cursor()
@@ -171,24 +995,72 @@ class Database:
         FROM messages m
         JOIN users su ON m.sender = su.id
         JOIN users ru ON m.receiver = ru.id
-        WHERE (m.sender = ? AND m.receiver = ?)
-           OR (m.sender = ? AND m.receiver = ?)
-        ORDER BY m.timestamp ASC
-        """, (user_a_id, user_b_id, user_b_id, user_a_id))
+        WHERE m.user_lo = ? AND m.user_hi = ?
+        ORDER BY m.id ASC
+        """, conversation_key(user_a_id, user_b_id))
         return cursor.fetchall()
 
+    def get_messages_after(self, user_a_id, user_b_id, after_id, limit):
+        """Mensagens com id > after_id, em ordem crescente de id."""
+        cursor = self.conn.cursor()
+        cursor.execute("""
+        SELECT m.id,
+               su.username AS sender_name,
+               ru.username AS receiver_name,
+               m.content,
+               m.timestamp
+        FROM messages m
+        JOIN users su ON m.sender = su.id
+        JOIN users ru ON m.receiver = ru.id
+        WHERE m.user_lo = ? AND m.user_hi = ? AND m.id > ?
+        ORDER BY m.id ASC
+        LIMIT ?
+        """, conversation_key(user_a_id, user_b_id) + (after_id, limit))
+        return cursor.fetchall()
+
+    def get_messages_before(self, user_a_id, user_b_id, before_id, limit):
+        """As `limit` mensagens imediatamente anteriores a before_id (ordem crescente).
+        before_id=None pega as mais recentes."""
+        if before_id is None:
+            before_id = MAX_ROWID
+        cursor = self.conn.cursor()
+        cursor.execute("""
+        SELECT m.id,
+               su.username AS sender_name,
+               ru.username AS receiver_name,
+               m.content,
+               m.timestamp
+        FROM messages m
+        JOIN users su ON m.sender = su.id
+        JOIN users ru ON m.receiver = ru.id
+        WHERE m.user_lo = ? AND m.user_hi = ? AND m.id < ?
+        ORDER BY m.id DESC
+        LIMIT ?
+        """, conversation_key(user_a_id, user_b_id) + (before_id, limit))
+        return cursor.fetchall()[::-1]
+
     # --------- ENVIO DE ARQUIVOS ---------
     def save_file(self, sender_id, receiver_id, filename, file_data):
-        cursor = self.conn.cursor()
+        """Retorna o evento gravado no log (events.file_event); o id do arquivo é event["id"]."""
+        if self.blob_store is not None:
+            digest = hashlib.sha256(file_data).hexdigest()
+            with self.blob_reference(digest):
+                self.blob_store.put(file_data)
+                return self.save_file_ref(sender_id, receiver_id, filename, digest, len(file_data))
+
         file_size = len(file_data)
-        cursor.execute(
-            """INSERT INTO file_transfers 
-            (sender, receiver, filename, file_data, file_size) 
-            VALUES (?, ?, ?, ?, ?)""",
-            (sender_id, receiver_id, filename, file_data, file_size)
-        )
-        self.conn.commit()
-        return cursor.lastrowid
+        timestamp = utc_now()
+        def insert(cursor):
+            cursor.execute(
+                """INSERT INTO file_transfers 
+                (sender, receiver, filename, file_data, file_size, timestamp, user_lo, user_hi) 
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                (sender_id, receiver_id, filename, file_data, file_size, timestamp)
+                + conversation_key(sender_id, receiver_id)
+            )
+            return self._log_file_event(cursor, cursor.lastrowid, sender_id, receiver_id,
+                                        filename, file_size, timestamp)
+        return self._write(insert)
 
     def get_files_between(self, user_a_id, user_b_id):
         cursor = self.conn.cursor()
@@ -198,20 +1070,105 @@ class Database:
         FROM file_transfers f
         JOIN users su ON f.sender = su.id
         JOIN users ru ON f.receiver = ru.id
-        WHERE (f.sender = ? AND f.receiver = ?)
-           OR (f.sender = ? AND f.receiver = ?)
-        ORDER BY f.timestamp ASC
-        """, (user_a_id, user_b_id, user_b_id, user_a_id))
+        WHERE f.user_lo = ? AND f.user_hi = ?
+        ORDER BY f.id ASC
+        """, conversation_key(user_a_id, user_b_id))
         return cursor.fetchall()
 
-    def get_file_data(self, file_id):
+    def save_file_ref(self, sender_id, receiver_id, filename, digest, file_size):
+        """Registra um arquivo cujo conteúdo já está no blob store. Retorna o evento, como save_file."""
+        timestamp = utc_now()
+        def insert(cursor):
+            cursor.execute(
+                """INSERT INTO file_transfers 
+                (sender, receiver, filename, file_data, file_size, blob_hash, timestamp, user_lo, user_hi) 
+                VALUES (?, ?, ?, zeroblob(0), ?, ?, ?, ?, ?)""",
+                (sender_id, receiver_id, filename, file_size, digest, timestamp)
+                + conversation_key(sender_id, receiver_id)
+            )
+            return self._log_file_event(cursor, cursor.lastrowid, sender_id, receiver_id,
+                                        filename, file_size, timestamp)
+        return self._write(insert)
+
+    # --------- BLOBS SEM REFERÊNCIA ---------
+    @contextmanager
+    def blob_reference(self, digest):
+        """
+        Envolve a gravação do blob e da linha que o referencia. Enquanto o
+        bloco roda o blob não é apagado; se ele falhar e nenhuma linha nem
+        outra gravação em andamento usar o hash, o blob é removido.
+        """
+        with self._blob_lock:
+            self._blob_pending[digest] = self._blob_pending.get(digest, 0) + 1
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            with self._blob_lock:
+                left = self._blob_pending.pop(digest) - 1
+                if left:
+                    self._blob_pending[digest] = left
+                elif not ok and not self._blob_referenced(digest):
+                    self.blob_store.delete(digest)
+
+    def _blob_referenced(self, digest):
+        return self.conn.execute(
+            "SELECT 1 FROM file_transfers WHERE blob_hash = ? LIMIT 1", (digest,)
+        ).fetchone() is not None
+
+    def sweep_blobs(self, grace=BLOB_SWEEP_GRACE):
+        """Apaga os blobs que nenhuma linha referencia, gravados há mais de grace segundos."""
+        if self.blob_store is None:
+            return 0
+        removed = 0
+        for digest in list(self.blob_store.digests(older_than=time.time() - grace)):
+            with self._blob_lock:
+                if digest in self._blob_pending or self._blob_referenced(digest):
+                    continue
+                self.blob_store.delete(digest)
+            removed += 1
+        return removed
+
+    def _log_file_event(self, cursor, file_id, sender_id, receiver_id, filename, file_size, timestamp):
+        event = file_event(
+            file_id, self._username(cursor, sender_id), self._username(cursor, receiver_id),
+            filename, file_size, timestamp
+        )
+        return self._log_event(cursor, event, user_a=sender_id, user_b=receiver_id)
+
+    def get_file_parties(self, file_id):
+        """(remetente_id, destinatário_id) do arquivo, ou None."""
         cursor = self.conn.cursor()
         cursor.execute(
-            "SELECT filename, file_data FROM file_transfers WHERE id = ?",
+            "SELECT sender, receiver FROM file_transfers WHERE id = ?",
             (file_id,)
         )
         return cursor.fetchone()
 
+    def get_file_info(self, file_id):
+        """(filename, file_size, blob_hash) sem carregar o conteúdo."""
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "SELECT filename, file_size, blob_hash FROM file_transfers WHERE id = ?",
+            (file_id,)
+        )
+        return cursor.fetchone()
+
+    def get_file_data(self, file_id):
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "SELECT filename, file_data, blob_hash FROM file_transfers WHERE id = ?",
+            (file_id,)
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None
+        filename, file_data, digest = row
+        if digest and self.blob_store is not None:
+            file_data = self.blob_store.get(digest)
+        return (filename, file_data)
+
     # --------- GRUPOS ---------
     def create_group(self, name, admin_id, admin_on_leave='transfer'):
         cursor = self.conn.cursor()
@@ -222,12 +1179,17 @@ class Database:
             )
             gid = cursor.lastrowid
             cursor.execute(
-                "INSERT INTO group_members (user_id, group_id, approved) VALUES (?, ?, 1)",
+                f"""INSERT INTO group_members (user_id, group_id, approved, approved_at)
+                VALUES (?, ?, 1, {_NOW_MS})""",
                 (admin_id, gid)
             )
-            self.conn.commit()
+            self._log_event(cursor, state_event(
+                "group_created", utc_now(), group=name, admin=self._username(cursor, admin_id)
+            ))
+            self._commit()
             return True
         except sqlite3.IntegrityError:
+            self._rollback()
             return False
 
     def get_group(self, name):
@@ -247,23 +1209,48 @@ class Database:
         """)
         return cursor.fetchall()
 
+    def list_groups_with_status(self, user_id):
+        """
+        Todos os grupos com a situação do usuário numa única consulta:
+        (nome, admin_username, approved) com approved = 1, 0 ou None (fora).
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT g.name,
+                   u.username AS admin_username,
+                   CASE WHEN g.admin = ? THEN 1 ELSE gm.approved END AS approved
+            FROM groups g
+            JOIN users u ON g.admin = u.id
+            LEFT JOIN group_members gm ON gm.group_id = g.id AND gm.user_id = ?
+            ORDER BY g.id
+        """, (user_id, user_id))
+        return cursor.fetchall()
+
     def update_group_admin(self, group_id, new_admin_id):
         cursor = self.conn.cursor()
         cursor.execute(
             "UPDATE groups SET admin = ? WHERE id = ?",
             (new_admin_id, group_id)
         )
-        self.conn.commit()
+        self._log_event(cursor, state_event(
+            "group_admin", utc_now(), group=self._group_name(cursor, group_id),
+            admin=self._username(cursor, new_admin_id)
+        ))
+        self._commit()
 
     def delete_group(self, group_id):
         cursor = self.conn.cursor()
         try:
+            name = self._group_name(cursor, group_id)
+            cursor.execute("DELETE FROM group_state WHERE group_id = ?", (group_id,))
             cursor.execute("DELETE FROM group_members WHERE group_id = ?", (group_id,))
             cursor.execute("DELETE FROM group_messages WHERE group_id = ?", (group_id,))
             cursor.execute("DELETE FROM groups WHERE id = ?", (group_id,))
-            self.conn.commit()
+            self._log_event(cursor, state_event("group_deleted", utc_now(), group=name))
+            self._commit()
             return True
         except Exception:
+            self._rollback()
             return False
 
     # --------- MEMBROS DE GRUPO ---------
@@ -274,27 +1261,42 @@ class Database:
                 "INSERT OR IGNORE INTO group_members (user_id, group_id, approved) VALUES (?, ?, 0)",
                 (user_id, group_id)
             )
-            self.conn.commit()
+            if cursor.rowcount:
+                self._log_member_event(cursor, "member_request", user_id, group_id)
+            self._commit()
             return True
         except Exception:
+            self._rollback()
             return False
 
     def approve_member(self, user_id, group_id):
+        # a entrada conta da aprovação (approved_at): é a ordem de sucessão do admin
         cursor = self.conn.cursor()
         cursor.execute(
-            "UPDATE group_members SET approved = 1 WHERE user_id = ? AND group_id = ?",
-            (user_id, group_id)
+            f"""UPDATE group_members
+            SET approved_at = CASE WHEN approved = 1 THEN approved_at ELSE {_NOW_MS} END,
+                read_id = CASE WHEN approved = 1 THEN read_id
+                          ELSE COALESCE((SELECT last_id FROM group_state WHERE group_id = ?), 0) END,
+                approved = 1
+            WHERE user_id = ? AND group_id = ?""",
+            (group_id, user_id, group_id)
         )
-        self.conn.commit()
-        return cursor.rowcount > 0
+        changed = cursor.rowcount > 0
+        if changed:
+            self._log_member_event(cursor, "member_joined", user_id, group_id)
+        self._commit()
+        return changed
 
     def add_member_approved(self, user_id, group_id):
         cursor = self.conn.cursor()
         cursor.execute(
-            "INSERT OR REPLACE INTO group_members (user_id, group_id, approved) VALUES (?, ?, 1)",
-            (user_id, group_id)
+            f"""INSERT OR REPLACE INTO group_members (user_id, group_id, approved, approved_at, read_id)
+            VALUES (?, ?, 1, {_NOW_MS},
+                    COALESCE((SELECT last_id FROM group_state WHERE group_id = ?), 0))""",
+            (user_id, group_id, group_id)
         )
-        self.conn.commit()
+        self._log_member_event(cursor, "member_joined", user_id, group_id)
+        self._commit()
         return True
 
     def remove_member(self, user_id, group_id):
@@ -303,7 +1305,24 @@ class Database:
             "DELETE FROM group_members WHERE user_id = ? AND group_id = ?",
             (user_id, group_id)
         )
-        self.conn.commit()
+        if cursor.rowcount:
+            self._log_member_event(cursor, "member_left", user_id, group_id)
+        self._commit()
+
+    def _log_member_event(self, cursor, kind, user_id, group_id):
+        """
+        member_request vai para o usuário e o admin; member_joined/member_left
+        para o usuário e os membros aprovados do grupo.
+        """
+        cursor.execute("SELECT name, admin FROM groups WHERE id = ?", (group_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        name, admin_id = row
+        event = state_event(kind, utc_now(), group=name, user=self._username(cursor, user_id))
+        if kind == "member_request":
+            return self._log_event(cursor, event, user_a=user_id, user_b=admin_id)
+        return self._log_event(cursor, event, user_a=user_id, group_id=group_id)
 
     def membership_status(self, user_id, group_id):
         cursor = self.conn.cursor()
@@ -315,6 +1334,11 @@ class Database:
         return None if not row else row[0]
 
     def list_group_members(self, group_id, approved_only=False):
+        """
+        Aprovados por ordem de aprovação (approved_at; empates pelo pedido e
+        pela ordem de inserção); sem approved_only, os pendentes vêm antes,
+        por ordem de pedido.
+        """
         cursor = self.conn.cursor()
         if approved_only:
             cursor.execute("""
@@ -322,7 +1346,7 @@ class Database:
                 FROM group_members gm
                 JOIN users u ON gm.user_id = u.id
                 WHERE gm.group_id = ? AND gm.approved = 1
-                ORDER BY gm.joined_at ASC
+                ORDER BY gm.approved_at ASC, gm.joined_at ASC, gm.rowid ASC
             """, (group_id,))
         else:
             cursor.execute("""
@@ -330,6 +1354,7 @@ class Database:
                 FROM group_members gm
                 JOIN users u ON gm.user_id = u.id
                 WHERE gm.group_id = ?
+                ORDER BY gm.approved, gm.approved_at, gm.joined_at, gm.rowid
             """, (group_id,))
         return cursor.fetchall()
 
@@ -343,14 +1368,155 @@ class Database:
         """, (group_id,))
         return cursor.fetchall()
 
+    # --------- TELA INICIAL ---------
+    def list_admin_pending_requests(self, admin_id):
+        """(grupo, username) pendentes em todos os grupos que o usuário administra."""
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT g.name, u.username
+            FROM groups g
+            JOIN group_members gm ON gm.group_id = g.id AND gm.approved = 0
+            JOIN users u ON gm.user_id = u.id
+            WHERE g.admin = ?
+            ORDER BY g.id, gm.joined_at
+        """, (admin_id,))
+        return cursor.fetchall()
+
+    def list_inbox(self, user_id):
+        """
+        Conversas do usuário, da atividade mais recente para a mais antiga:
+        (kind, nome, last_id, remetente, trecho, timestamp, não_lidas), com
+        kind 'dm' (nome = o outro usuário) ou 'group'. As privadas vêm de
+        conversation_state; os grupos, de group_state com as não lidas
+        contadas a partir do read_id do membro (até UNREAD_COUNT_MAX).
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT kind, name, last_id, sender, preview, timestamp, unread FROM (
+                SELECT 'dm' AS kind, pu.username AS name, cs.last_id, su.username AS sender,
+                       cs.preview, cs.timestamp, cs.unread, cs.seq
+                FROM conversation_state cs
+                JOIN users pu ON pu.id = cs.peer
+                JOIN users su ON su.id = cs.last_sender
+                WHERE cs.user_id = ? AND cs.kind = 'dm'
+                UNION ALL
+                SELECT 'group', g.name, gs.last_id, su.username, gs.preview, gs.timestamp,
+                       (SELECT COUNT(*) FROM (
+                            SELECT 1 FROM group_messages m
+                            WHERE m.group_id = mb.group_id AND m.id > mb.read_id
+                              AND m.sender != mb.user_id
+                            LIMIT ?)),
+                       gs.seq
+                FROM group_members mb
+                JOIN group_state gs ON gs.group_id = mb.group_id
+                JOIN groups g ON g.id = mb.group_id
+                JOIN users su ON su.id = gs.last_sender
+                WHERE mb.user_id = ? AND mb.approved = 1
+            )
+            ORDER BY seq DESC, timestamp DESC
+        """, (user_id, UNREAD_COUNT_MAX, user_id))
+        return cursor.fetchall()
+
+    def mark_read(self, user_id, kind, peer, up_to_id):
+        """
+        Marca como lidas as mensagens da conversa até up_to_id. Devolve
+        (não_lidas, evento): o evento conversation_read gravado no log, ou
+        None se nada mudou.
+        """
+        def update(cursor):
+            if kind == "dm":
+                cursor.execute(
+                    """SELECT last_id, read_id, unread FROM conversation_state
+                    WHERE user_id = ? AND kind = 'dm' AND peer = ?""",
+                    (user_id, peer)
+                )
+            else:
+                # grupos não guardam as não lidas: são contadas a partir do read_id
+                cursor.execute(
+                    """SELECT gs.last_id, mb.read_id, NULL FROM group_members mb
+                    JOIN group_state gs ON gs.group_id = mb.group_id
+                    WHERE mb.user_id = ? AND mb.group_id = ? AND mb.approved = 1""",
+                    (user_id, peer)
+                )
+            row = cursor.fetchone()
+            if row is None:
+                return 0, None
+            last_id, read_id, unread = row
+            read_to = min(up_to_id, last_id)
+            if read_to <= read_id and unread is not None:
+                return unread, None
+            changed = read_to > read_id
+            read_to = max(read_to, read_id)
+            if read_to == last_id:
+                unread = 0
+            elif kind == "dm":
+                cursor.execute(
+                    """SELECT COUNT(*) FROM messages
+                    WHERE user_lo = ? AND user_hi = ? AND id > ? AND sender != ?""",
+                    conversation_key(user_id, peer) + (read_to, user_id)
+                )
+                unread = cursor.fetchone()[0]
+            else:
+                cursor.execute(
+                    """SELECT COUNT(*) FROM (SELECT 1 FROM group_messages
+                    WHERE group_id = ? AND id > ? AND sender != ? LIMIT ?)""",
+                    (peer, read_to, user_id, UNREAD_COUNT_MAX)
+                )
+                unread = cursor.fetchone()[0]
+            if not changed:
+                return unread, None
+            if kind == "dm":
+                cursor.execute(
+                    """UPDATE conversation_state SET read_id = ?, unread = ?
+                    WHERE user_id = ? AND kind = 'dm' AND peer = ?""",
+                    (read_to, unread, user_id, peer)
+                )
+            else:
+                cursor.execute(
+                    "UPDATE group_members SET read_id = ? WHERE user_id = ? AND group_id = ?",
+                    (read_to, user_id, peer)
+                )
+            if kind == "dm":
+                conversation = dm_key(self._username(cursor, user_id), self._username(cursor, peer))
+            else:
+                conversation = group_key(self._group_name(cursor, peer))
+            event = state_event("conversation_read", utc_now(), conversation=conversation,
+                                read_id=read_to, unread=unread)
+            return unread, self._log_event(cursor, event, user_a=user_id)
+        return self._write(update)
+
     # --------- MENSAGENS DE GRUPO ---------
     def save_group_message(self, group_id, sender_id, content):
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "INSERT INTO group_messages (group_id, sender, content) VALUES (?, ?, ?)",
-            (group_id, sender_id, content)
-        )
-        self.conn.commit()
+        """Retorna o evento gravado no log (events.group_message_event), como save_message."""
+        timestamp = utc_now()
+        def insert(cursor):
+            cursor.execute(
+                "INSERT INTO group_messages (group_id, sender, content, timestamp) VALUES (?, ?, ?, ?)",
+                (group_id, sender_id, content, timestamp)
+            )
+            msg_id = cursor.lastrowid
+            cursor.execute(
+                "SELECT MAX(id) FROM group_messages WHERE group_id = ? AND id < ?",
+                (group_id, msg_id)
+            )
+            event = group_message_event(
+                msg_id, cursor.fetchone()[0], self._group_name(cursor, group_id),
+                self._username(cursor, sender_id), content, timestamp
+            )
+            event = self._log_event(cursor, event, group_id=group_id)
+            # uma linha por grupo, não por membro: as não lidas saem do read_id
+            cursor.execute(
+                """INSERT OR REPLACE INTO group_state
+                (group_id, seq, last_id, last_sender, preview, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?)""",
+                (group_id, event["seq"], msg_id, sender_id, content[:SUMMARY_PREVIEW], timestamp)
+            )
+            cursor.execute(
+                "UPDATE group_members SET read_id = ? WHERE user_id = ? AND group_id = ?",
+                (msg_id, sender_id, group_id)
+            )
+            return event
+        return self._write(insert)
 
     def get_group_messages(self, group_id):
         cursor = self.conn.cursor()
@@ -359,10 +1525,106 @@ class Database:
             FROM group_messages gm
             JOIN users u ON gm.sender = u.id
             WHERE gm.group_id = ?
-            ORDER BY gm.timestamp ASC
+            ORDER BY gm.id ASC
         """, (group_id,))
         return cursor.fetchall()
 
+    def get_group_messages_after(self, group_id, after_id, limit):
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT gm.id, u.username AS sender_name, gm.content, gm.timestamp
+            FROM group_messages gm
+            JOIN users u ON gm.sender = u.id
+            WHERE gm.group_id = ? AND gm.id > ?
+            ORDER BY gm.id ASC
+            LIMIT ?
+        """, (group_id, after_id, limit))
+        return cursor.fetchall()
+
+    def get_group_messages_before(self, group_id, before_id, limit):
+        if before_id is None:
+            before_id = MAX_ROWID
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT gm.id, u.username AS sender_name, gm.content, gm.timestamp
+            FROM group_messages gm
+            JOIN users u ON gm.sender = u.id
+            WHERE gm.group_id = ? AND gm.id < ?
+            ORDER BY gm.id DESC
+            LIMIT ?
+        """, (group_id, before_id, limit))
+        return cursor.fetchall()[::-1]
+
+    # --------- BUSCA ---------
+    def search_messages(self, user_id, query, private=True, groups=True, limit=20, offset=0):
+        """
+        Busca textual nas conversas visíveis ao usuário, da mais relevante
+        (bm25) para a menos. query é uma expressão MATCH do conteúdo (ver
+        fts_query). private: True = todas as conversas privadas do usuário,
+        id = só a conversa com esse usuário, False = nenhuma. groups: True =
+        todos os grupos em que é membro aprovado, id = só esse grupo (quem
+        chama confere a participação), False = nenhum. Acima de
+        SEARCH_MAX_SCOPE_GROUPS grupos, a participação é conferida por join.
+        Linhas: (conversa, id, remetente, trecho, timestamp); conversa no
+        formato dos eventos (dm:a:b / group:nome).
+        """
+        if not self.fts or not query:
+            return []
+        cursor = self.conn.cursor()
+        parts, params = [], []
+        if private:
+            scope = f"u{user_id}" if private is True else f"u{user_id} AND u{private}"
+            parts.append(f"""
+            SELECT 'dm:' || MIN(su.username, ru.username) || ':' || MAX(su.username, ru.username),
+                   m.id, su.username,
+                   snippet(messages_fts, 0, '[', ']', '…', {SEARCH_SNIPPET_TOKENS}),
+                   m.timestamp, f.rank AS score
+            FROM messages_fts f
+            JOIN messages m ON m.id = f.rowid
+            JOIN users su ON su.id = m.sender
+            JOIN users ru ON ru.id = m.receiver
+            WHERE messages_fts MATCH ?
+            """)
+            params.append(f"content : ({query}) AND scope : ({scope})")
+        if groups:
+            if groups is True:
+                cursor.execute(
+                    "SELECT group_id FROM group_members WHERE user_id = ? AND approved = 1 LIMIT ?",
+                    (user_id, SEARCH_MAX_SCOPE_GROUPS + 1)
+                )
+                group_ids = [row[0] for row in cursor.fetchall()]
+            else:
+                group_ids = [groups]
+            if len(group_ids) > SEARCH_MAX_SCOPE_GROUPS:
+                # muitos grupos: filtra pela participação em vez do escopo no MATCH
+                membership = """JOIN group_members mb ON mb.group_id = gm.group_id
+                       AND mb.user_id = ? AND mb.approved = 1"""
+                params.append(user_id)
+                match = f"content : ({query})"
+            else:
+                membership = ""
+                match = f"content : ({query}) AND scope : ({' OR '.join(f'g{gid}' for gid in group_ids)})"
+            if group_ids:
+                parts.append(f"""
+                SELECT 'group:' || g.name, gm.id, u.username,
+                       snippet(group_messages_fts, 0, '[', ']', '…', {SEARCH_SNIPPET_TOKENS}),
+                       gm.timestamp, f.rank AS score
+                FROM group_messages_fts f
+                JOIN group_messages gm ON gm.id = f.rowid
+                {membership}
+                JOIN groups g ON g.id = gm.group_id
+                JOIN users u ON u.id = gm.sender
+                WHERE group_messages_fts MATCH ?
+                """)
+                params.append(match)
+        if not parts:
+            return []
+        cursor.execute(
+            " UNION ALL ".join(parts) + " ORDER BY score, 2 DESC LIMIT ? OFFSET ?",
+            params + [limit, offset]
+        )
+        return [row[:5] for row in cursor.fetchall()]
+
     # --------- SOLICITAÇÕES DE BANIMENTO ---------
     def create_ban_request(self, requester_id, target_id, reason):
         cursor = self.conn.cursor()
@@ -371,8 +1633,13 @@ class Database:
             VALUES (?, ?, ?)""",
             (requester_id, target_id, reason)
         )
-        self.conn.commit()
-        return cursor.lastrowid
+        request_id = cursor.lastrowid
+        self._log_event(cursor, state_event(
+            "ban_requested", utc_now(), request_id=request_id,
+            target=self._username(cursor, target_id)
+        ), user_a=requester_id)
+        self._commit()
+        return request_id
 
     def list_ban_requests(self, status='pending'):
         cursor = self.conn.cursor()
@@ -393,7 +1660,15 @@ class Database:
             "UPDATE ban_requests SET status = 'approved' WHERE id = ?",
             (request_id,)
         )
-        self.conn.commit()
+        cursor.execute(
+            "SELECT u.username FROM ban_requests br JOIN users u ON br.target_user = u.id WHERE br.id = ?",
+            (request_id,)
+        )
+        row = cursor.fetchone()
+        if row:
+            # banimento muda a lista de usuários de todos
+            self._log_event(cursor, state_event("user_banned", utc_now(), username=row[0]))
+        self._commit()
 
     def reject_ban_request(self, request_id):
         cursor = self.conn.cursor()
@@ -401,4 +1676,9 @@ class Database:
             "UPDATE ban_requests SET status = 'rejected' WHERE id = ?",
             (request_id,)
         )
-        self.conn.commit()
\ No newline at end of file
+        cursor.execute("SELECT requester FROM ban_requests WHERE id = ?", (request_id,))
+        row = cursor.fetchone()
+        if row:
+            self._log_event(cursor, state_event("ban_rejected", utc_now(), request_id=request_id),
+                            user_a=row[0])
+        self._commit()
\ No newline at end of file
@@ -0,0 +1,154 @@
+# server/event_hub.py
+import threading
+import time
+from collections import deque
+
+EVENT_QUEUE_SIZE = 1000     # eventos guardados por usuário
+EVENT_POLL_LIMIT = 500      # eventos devolvidos por chamada
+EVENT_QUEUE_IDLE_TTL = 300  # fila sem consulta há mais tempo é descartada
+
+
+class _UserQueue:
+    __slots__ = ("events", "floor", "served", "late", "last_poll", "listeners")
+
+    def __init__(self, floor, now):
+        self.events = deque()   # (seq, evento), em ordem de seq
+        self.floor = floor      # eventos com seq <= floor não estão mais na fila
+        self.served = floor     # maior seq já devolvido por poll()
+        self.late = []          # (seq, evento) publicados depois de um seq maior já servido
+        self.last_poll = now
+        self.listeners = []
+
+
+class EventHub:
+    """
+    Fila de eventos por usuário para clientes sem callback (long-poll).
+    Só existe fila para quem consultou nos últimos EVENT_QUEUE_IDLE_TTL
+    segundos; os demais recebem os eventos pelo Notifier. O seq é o do log
+    de eventos (events.seq, já presente no evento publicado), o mesmo cursor
+    de sync() e dos callbacks: o cliente guarda o último seq visto e pede o
+    que veio depois. start_seq é o último seq do log quando o servidor
+    iniciou, então cursores de antes de um restart ficam para trás da fila
+    nova. Se o cursor ficou para trás da fila (eventos descartados ou fila
+    recriada), a resposta vem com reset=True e o cliente completa com
+    sync(cursor).
+    As publicações acontecem depois do commit, em threads diferentes, e
+    podem chegar fora da ordem de seq: um evento com seq menor que um já
+    entregue ao usuário vai junto na próxima resposta, mesmo abaixo do cursor.
+    """
+
+    def __init__(self, queue_size=EVENT_QUEUE_SIZE, idle_ttl=EVENT_QUEUE_IDLE_TTL,
+                 clock=time.monotonic, start_seq=0):
+        self.queue_size = queue_size
+        self.idle_ttl = idle_ttl
+        self._clock = clock
+        self._last_seq = start_seq
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._last_sweep = clock()
+        self.published = 0
+        self.dropped = 0
+
+    # --------- produtores ---------
+    def publish(self, username, event):
+        self.publish_many((username,), event)
+
+    def publish_many(self, usernames, event):
+        """
+        Enfileira o evento (com "seq" do log) para os usuários que têm fila;
+        os demais são ignorados.
+        """
+        seq = event["seq"]
+        wake = []
+        with self._lock:
+            self._last_seq = max(self._last_seq, seq)
+            for username in usernames:
+                q = self._queues.get(username)
+                if q is None:
+                    continue
+                if seq <= q.served:
+                    q.late.append((seq, event))
+                elif q.events and seq < q.events[-1][0]:
+                    # fora de ordem, mas ainda não entregue: entra na posição do seq
+                    pos = len(q.events)
+                    while pos and q.events[pos - 1][0] > seq:
+                        pos -= 1
+                    q.events.insert(pos, (seq, event))
+                else:
+                    q.events.append((seq, event))
+                if len(q.events) > self.queue_size:
+                    q.floor = q.events.popleft()[0]
+                    self.dropped += 1
+                self.published += 1
+                wake.extend(q.listeners)
+        for fn in wake:
+            fn()
+
+    # --------- consumidores ---------
+    def poll(self, username, since_seq, limit=EVENT_POLL_LIMIT, latest=0):
+        """
+        Não bloqueia. Devolve {"seq", "events", "reset"}; since_seq=0 só
+        abre a fila e devolve o cursor atual: o maior seq publicado ou
+        `latest` (o último seq do log, para quem pode lê-lo), se maior.
+        """
+        now = self._clock()
+        with self._lock:
+            self._sweep(now)
+            q = self._queues.get(username)
+            if q is None:
+                q = self._queues[username] = _UserQueue(self._last_seq, now)
+            q.last_poll = now
+            if not since_seq:
+                self._last_seq = max(self._last_seq, latest)
+                q.served = max(q.served, self._last_seq)
+                return {"seq": self._last_seq, "events": [], "reset": False}
+            reset = since_seq < q.floor
+            events = [(s, e) for s, e in q.events if reset or s > since_seq][:limit]
+            seq = events[-1][0] if events else max(since_seq, q.floor)
+            q.served = max(q.served, seq)
+            if q.late:
+                events = sorted(q.late + events, key=lambda item: item[0])
+                q.late = []
+            return {"seq": seq, "events": [e for _, e in events], "reset": reset}
+
+    def subscribe(self, username, fn):
+        """fn() é chamada (na thread de quem publicou) a cada evento do usuário."""
+        with self._lock:
+            q = self._queues.get(username)
+            if q is None:
+                q = self._queues[username] = _UserQueue(self._last_seq, self._clock())
+            q.listeners.append(fn)
+
+    def unsubscribe(self, username, fn):
+        with self._lock:
+            q = self._queues.get(username)
+            if q is not None and fn in q.listeners:
+                q.listeners.remove(fn)
+
+    def drop(self, username):
+        """Descarta a fila do usuário (logout/banimento)."""
+        with self._lock:
+            q = self._queues.pop(username, None)
+        if q is not None:
+            for fn in q.listeners:
+                fn()
+
+    def _sweep(self, now):
+        if now - self._last_sweep < self.idle_ttl / 10:
+            return
+        self._last_sweep = now
+        limit = now - self.idle_ttl
+        for username in [u for u, q in self._queues.items()
+                         if q.last_poll < limit and not q.listeners]:
+            del self._queues[username]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queues": len(self._queues),
+                "waiting": sum(len(q.listeners) for q in self._queues.values()),
+                "queued": sum(len(q.events) for q in self._queues.values()),
+                "seq": self._last_seq,
+                "published": self.published,
+                "dropped": self.dropped,
+            }
@@ -0,0 +1,69 @@
+# server/events.py
+# Eventos entregues aos clientes (callback notify_events, long-poll e sync).
+# Cada evento é um dict com "v" = EVENT_VERSION; clientes que não conhecem a
+# versão devem ignorar o conteúdo e buscar a conversa pelas RPCs de histórico.
+# Os eventos gravados na tabela events (Database) levam também "seq", a
+# posição no log global usada como cursor por sync().
+EVENT_VERSION = 1
+
+
+def dm_key(user_a, user_b):
+    """Chave da conversa privada, igual para os dois lados."""
+    lo, hi = sorted((user_a, user_b))
+    return f"dm:{lo}:{hi}"
+
+
+def group_key(group_name):
+    return f"group:{group_name}"
+
+
+def message_event(msg_id, prev_id, sender, receiver, content, timestamp):
+    return {
+        "v": EVENT_VERSION,
+        "type": "message",
+        "conversation": dm_key(sender, receiver),
+        "id": msg_id,
+        "prev_id": prev_id,
+        "sender": sender,
+        "receiver": receiver,
+        "content": content,
+        "timestamp": timestamp,
+    }
+
+
+def group_message_event(msg_id, prev_id, group_name, sender, content, timestamp):
+    return {
+        "v": EVENT_VERSION,
+        "type": "group_message",
+        "conversation": group_key(group_name),
+        "id": msg_id,
+        "prev_id": prev_id,
+        "sender": sender,
+        "group": group_name,
+        "content": content,
+        "timestamp": timestamp,
+    }
+
+
+def file_event(file_id, sender, receiver, filename, size, timestamp):
+    return {
+        "v": EVENT_VERSION,
+        "type": "file",
+        "conversation": dm_key(sender, receiver),
+        "id": file_id,
+        "sender": sender,
+        "receiver": receiver,
+        "filename": filename,
+        "size": size,
+        "timestamp": timestamp,
+    }
+
+
+def state_event(kind, timestamp, **fields):
+    """
+    Mudança de estado sem mensagem (grupos, membros, usuários, banimentos).
+    Vai só para o log de eventos (sync); o cliente recarrega a lista afetada.
+    """
+    event = {"v": EVENT_VERSION, "type": kind, "timestamp": timestamp}
+    event.update(fields)
+    return event
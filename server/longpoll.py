@@ -0,0 +1,152 @@
+# server/longpoll.py
+# Canal lateral de long-poll para clientes cujo callback Pyro5 não é
+# alcançável (NAT, firewall). Um único loop asyncio atende todas as
+# conexões: cada espera é só uma corrotina parada, não uma thread.
+#
+# Protocolo (JSON, uma linha por mensagem, conexão reaproveitável):
+#   -> {"session": "...", "since": 42, "timeout": 25}
+#   <- {"seq": 57, "events": [...], "reset": false}
+#   <- {"error": "..."}   (e a conexão é fechada)
+import asyncio
+import json
+import threading
+
+LONGPOLL_PORT = 0               # 0 = porta livre escolhida pelo sistema
+LONGPOLL_TIMEOUT = 25           # espera padrão por chamada (segundos)
+LONGPOLL_MAX_TIMEOUT = 60
+LONGPOLL_MAX_WAITERS = 10000    # acima disso as chamadas respondem sem esperar
+MAX_REQUEST_LINE = 4096
+
+
+def clamp_timeout(timeout):
+    try:
+        return max(0.0, min(float(timeout), LONGPOLL_MAX_TIMEOUT))
+    except (TypeError, ValueError):
+        return LONGPOLL_TIMEOUT
+
+
+class LongPollServer:
+    """
+    authenticate(session) -> username ou None; pode ler o banco, então
+    roda no executor padrão do loop, fora da thread que atende as esperas.
+    Roda numa thread própria com o seu loop asyncio; start() retorna já com
+    a porta definida. wait() deixa uma thread de fora (a RPC wait_events)
+    esperar no mesmo loop, parada só num Future.
+    """
+
+    def __init__(self, hub, authenticate, host="", port=LONGPOLL_PORT,
+                 max_waiters=LONGPOLL_MAX_WAITERS):
+        self.hub = hub
+        self.authenticate = authenticate
+        self.host = host
+        self.port = port
+        self.max_waiters = max_waiters
+        self.waiters = 0
+        self.connections = 0
+        self._loop = None
+        self._server = None
+        self._ready = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="longpoll", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self.port
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(asyncio.start_server(
+            self._handle, self.host or None, self.port, limit=MAX_REQUEST_LINE
+        ))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+
+    def close(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=2)
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    break  # linha grande demais ou conexão perdida
+                if not line:
+                    break
+                try:
+                    req = json.loads(line)
+                    since = int(req.get("since") or 0)
+                except (ValueError, TypeError, AttributeError):
+                    await self._send(writer, {"error": "requisição inválida"})
+                    break
+                username = await asyncio.get_running_loop().run_in_executor(
+                    None, self.authenticate, req.get("session"))
+                if username is None:
+                    await self._send(writer, {"error": "sessão inválida"})
+                    break
+                result = await self._wait(username, since, clamp_timeout(req.get("timeout", LONGPOLL_TIMEOUT)))
+                if not await self._send(writer, result):
+                    break
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def _send(self, writer, payload):
+        try:
+            writer.write(json.dumps(payload).encode() + b"\n")
+            await writer.drain()
+            return True
+        except ConnectionError:
+            return False
+
+    def wait(self, username, since, timeout):
+        """Como _wait, chamado de outra thread: bloqueia até a resposta."""
+        future = asyncio.run_coroutine_threadsafe(
+            self._wait(username, since, clamp_timeout(timeout)), self._loop)
+        return future.result()
+
+    async def _wait(self, username, since, timeout):
+        result = self.hub.poll(username, since)
+        if result["events"] or result["reset"] or not since or timeout <= 0:
+            return result
+        if self.waiters >= self.max_waiters:
+            return result
+
+        loop = asyncio.get_running_loop()
+        woke = asyncio.Event()
+
+        def wake():
+            loop.call_soon_threadsafe(woke.set)
+
+        self.hub.subscribe(username, wake)
+        self.waiters += 1
+        try:
+            result = self.hub.poll(username, since)
+            if result["events"] or result["reset"]:
+                return result
+            try:
+                await asyncio.wait_for(woke.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        finally:
+            self.waiters -= 1
+            self.hub.unsubscribe(username, wake)
+        return self.hub.poll(username, since)
+
+    def stats(self):
+        return {
+            "port": self.port,
+            "connections": self.connections,
+            "waiters": self.waiters,
+        }
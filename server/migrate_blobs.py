@@ -0,0 +1,72 @@
+# server/migrate_blobs.py
+# Move o conteúdo dos arquivos de file_transfers.file_data (BLOB no banco)
+# para o blob store em disco, deixando no banco só os metadados e o hash.
+# Processa uma linha por vez (memória limitada ao maior arquivo) e faz
+# commit a cada lote, então pode ser interrompido e executado de novo.
+#
+# Uso: python migrate_blobs.py [banco] [diretório_blobs] [--vacuum] [--sweep]
+#   --sweep  apaga também os blobs que nenhum arquivo referencia (o servidor
+#            faz o mesmo ao iniciar; ver Database.sweep_blobs)
+import sys
+
+from blob_store import DiskBlobStore, BLOB_DIR
+from database import Database, DB_NAME
+
+BATCH = 100
+
+
+def migrate(db, store):
+    conn = db.conn
+    cursor = conn.cursor()
+    moved = 0
+    saved = 0
+    last_id = 0
+    while True:
+        cursor.execute(
+            """SELECT id FROM file_transfers
+            WHERE id > ? AND blob_hash IS NULL
+            ORDER BY id LIMIT ?""",
+            (last_id, BATCH)
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            break
+        for file_id in ids:
+            (data,) = cursor.execute(
+                "SELECT file_data FROM file_transfers WHERE id = ?", (file_id,)
+            ).fetchone()
+            digest = store.put(bytes(data))
+            cursor.execute(
+                "UPDATE file_transfers SET blob_hash = ?, file_data = zeroblob(0) WHERE id = ?",
+                (digest, file_id)
+            )
+            moved += 1
+            saved += len(data)
+        conn.commit()
+        last_id = ids[-1]
+        print(f" -> {moved} arquivos migrados ({saved / 1024 / 1024:.1f} MB)")
+    return moved, saved
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    db_path = args[0] if args else DB_NAME
+    blob_dir = args[1] if len(args) > 1 else BLOB_DIR
+
+    print(f"🔧 Migrando arquivos de {db_path} para {blob_dir}...")
+    store = DiskBlobStore(blob_dir)
+    db = Database(db_path, pool_size=1, blob_store=store)
+    try:
+        moved, saved = migrate(db, store)
+        if "--sweep" in sys.argv:
+            print(f" -> {db.sweep_blobs()} blobs sem referência removidos.")
+        if "--vacuum" in sys.argv:
+            print(" -> VACUUM (recuperando o espaço no arquivo do banco)...")
+            db.conn.execute("VACUUM")
+    finally:
+        db.close()
+    print(f"✅ Concluído: {moved} arquivos, {saved / 1024 / 1024:.1f} MB fora do banco.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+# server/notifier.py
+import threading
+from collections import OrderedDict, deque
+
+NOTIFY_WORKERS = 4            # threads que chamam os callbacks dos clientes
+NOTIFY_MAX_RECIPIENTS = 10000 # destinatários com notificação pendente (fila limitada)
+CALLBACK_TIMEOUT = 5          # segundos por chamada ao proxy do cliente
+CALLBACK_MAX_FAILURES = 3     # falhas seguidas até descartar o callback
+FANOUT_BATCH = 256            # destinatários expandidos por vez num fan-out
+EVENTS_METHOD = "notify_events"  # chamadas deste método têm as listas de eventos somadas
+
+
+class Notifier:
+    """
+    Despacha os callbacks (notify_*) fora da thread da RPC.
+    Cada destinatário tem uma lista de chamadas pendentes; chamadas iguais
+    que chegam antes da entrega viram uma só (uma rajada de mensagens de bob
+    para alice gera um único notify_private) e chamadas notify_events
+    pendentes viram uma só, com as listas de eventos concatenadas em ordem.
+    Um destinatário nunca é atendido por duas threads ao mesmo tempo, então
+    um cliente lento só atrasa as próprias notificações. Callbacks que falham
+    CALLBACK_MAX_FAILURES vezes seguidas são removidos.
+
+    notify_many() (mensagens de grupo) só registra o fan-out; as threads de
+    trabalho o expandem em lotes de FANOUT_BATCH destinatários, intercalados
+    com as entregas, então quem envia não espera pelo tamanho do grupo.
+    """
+
+    def __init__(self, workers=NOTIFY_WORKERS, max_recipients=NOTIFY_MAX_RECIPIENTS,
+                 timeout=CALLBACK_TIMEOUT, max_failures=CALLBACK_MAX_FAILURES,
+                 fanout_batch=FANOUT_BATCH):
+        self.timeout = timeout
+        self.fanout_batch = fanout_batch
+        self.max_recipients = max_recipients
+        self.max_failures = max_failures
+        self._callbacks = {}        # username -> proxy
+        self._failures = {}         # username -> falhas seguidas
+        self._pending = {}          # username -> OrderedDict(chave -> (método, args))
+        self._ready = deque()       # destinatários com pendências e sem thread atendendo
+        self._busy = set()
+        self._fanout = deque()      # (destinatários, posição, método, args, filtro)
+        self._cond = threading.Condition()
+        self._closed = False
+        self.enqueued = 0
+        self.coalesced = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self.evicted = 0
+        self.fanouts = 0
+        self._threads = [
+            threading.Thread(target=self._run, name=f"notifier-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    # --------- registro ---------
+    def register(self, username, proxy):
+        proxy._pyroTimeout = self.timeout
+        with self._cond:
+            old = self._callbacks.get(username)
+            self._callbacks[username] = proxy
+            self._failures.pop(username, None)
+        if old is not None and old is not proxy:
+            self._release(old)
+
+    def unregister(self, username):
+        with self._cond:
+            proxy = self._callbacks.pop(username, None)
+            self._failures.pop(username, None)
+            self._pending.pop(username, None)
+        if proxy is not None:
+            self._release(proxy)
+        return proxy is not None
+
+    def has_callback(self, username):
+        return username in self._callbacks
+
+    # --------- envio ---------
+    def notify(self, username, method, *args):
+        """Enfileira proxy.<method>(*args) para o usuário. Nunca bloqueia."""
+        with self._cond:
+            if username not in self._callbacks or self._closed:
+                return False
+            calls = self._pending.get(username)
+            if calls is None:
+                if len(self._pending) >= self.max_recipients:
+                    self.dropped += 1
+                    return False
+                calls = self._pending[username] = OrderedDict()
+                if username not in self._busy:
+                    self._ready.append(username)
+                    self._cond.notify()
+            if method == EVENTS_METHOD:
+                key = (method,)
+                if key in calls:
+                    calls[key][1][0].extend(args[0])
+                    self.coalesced += 1
+                else:
+                    calls[key] = (method, (list(args[0]),))
+            else:
+                key = (method, args)
+                if key in calls:
+                    self.coalesced += 1
+                else:
+                    calls[key] = (method, args)
+            self.enqueued += 1
+            return True
+
+    def notify_many(self, usernames, method, *args, only=None):
+        """
+        Enfileira a mesma chamada para vários usuários. A expansão é feita
+        pelas threads de trabalho; only(username) -> bool, se dado, filtra
+        os destinatários no momento da expansão (ex.: só quem está online).
+        """
+        usernames = list(usernames)
+        with self._cond:
+            if not usernames or self._closed:
+                return False
+            self._fanout.append((usernames, 0, method, args, only))
+            self.fanouts += 1
+            self._cond.notify()
+            return True
+
+    def _expand(self, job):
+        usernames, start, method, args, only = job
+        batch = usernames[start:start + self.fanout_batch]
+        for username in batch:
+            if username in self._callbacks and (only is None or only(username)):
+                self.notify(username, method, *args)
+
+    def _run(self):
+        while True:
+            job = None
+            with self._cond:
+                while not self._ready and not self._fanout and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                if self._fanout:
+                    job = self._fanout.popleft()
+                    usernames, start, method, args, only = job
+                    rest = start + self.fanout_batch
+                    if rest < len(usernames):
+                        # o resto vai para o fim da fila: outros fan-outs e entregas intercalam
+                        self._fanout.append((usernames, rest, method, args, only))
+                        self._cond.notify()
+                else:
+                    username = self._ready.popleft()
+                    calls = self._pending.pop(username, None)
+                    proxy = self._callbacks.get(username)
+                    if not calls or proxy is None:
+                        continue
+                    self._busy.add(username)
+
+            if job is not None:
+                self._expand(job)
+                continue
+
+            ok = self._deliver(proxy, calls)
+            evict = False
+
+            with self._cond:
+                self._busy.discard(username)
+                if ok:
+                    self.delivered += len(calls)
+                    self._failures.pop(username, None)
+                else:
+                    self.errors += 1
+                    failures = self._failures.get(username, 0) + 1
+                    self._failures[username] = failures
+                    if failures >= self.max_failures and self._callbacks.get(username) is proxy:
+                        del self._callbacks[username]
+                        del self._failures[username]
+                        self._pending.pop(username, None)
+                        self.evicted += 1
+                        evict = True
+                        print(f"[CALLBACK] callback de '{username}' removido após {failures} falhas.")
+                if username in self._pending:
+                    # chegaram novas notificações enquanto esta thread entregava
+                    self._ready.append(username)
+                    self._cond.notify()
+            if evict:
+                self._release(proxy)
+
+    def _deliver(self, proxy, calls):
+        try:
+            # o proxy pertence à thread que o criou; só uma thread por destinatário o usa
+            proxy._pyroClaimOwnership()
+            for method, args in calls.values():
+                getattr(proxy, method)(*args)
+            return True
+        except Exception as e:
+            print(f"[CALLBACK] erro: {e}")
+            return False
+
+    def _release(self, proxy):
+        try:
+            proxy._pyroClaimOwnership()
+            proxy._pyroRelease()
+        except Exception:
+            pass
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout=1)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "callbacks": len(self._callbacks),
+                "pending_recipients": len(self._pending),
+                "pending_calls": sum(len(c) for c in self._pending.values()),
+                "ready": len(self._ready),
+                "busy": len(self._busy),
+                "fanout_queue": len(self._fanout),
+                "fanouts": self.fanouts,
+                "enqueued": self.enqueued,
+                "coalesced": self.coalesced,
+                "delivered": self.delivered,
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "evicted": self.evicted,
+            }
@@ -0,0 +1,99 @@
+# server/presence.py
+import heapq
+import threading
+import time
+from collections import deque
+
+PRESENCE_TTL = 90           # segundos sem heartbeat até ficar offline
+CHANGE_LOG_SIZE = 10000     # mudanças guardadas para get_presence_changes
+
+
+class Presence:
+    """
+    Presença online dos usuários.
+    Guarda o último heartbeat de cada usuário, o conjunto de quem está online
+    (mantido de forma incremental) e um heap de expiração, então entradas
+    vencidas saem sem varrer todos os usuários. Cada mudança online/offline
+    incrementa a versão e vai para um log limitado usado por changes_since().
+    """
+
+    def __init__(self, ttl=PRESENCE_TTL, log_size=CHANGE_LOG_SIZE, clock=time.time):
+        self.ttl = ttl
+        self._clock = clock
+        self._last_seen = {}
+        self._online = set()
+        self._heap = []  # (expira_em, username); entradas antigas são ignoradas
+        self._version = 0
+        self._log = deque(maxlen=log_size)  # (versão, username, online)
+        self._lock = threading.Lock()
+
+    def heartbeat(self, username):
+        now = self._clock()
+        with self._lock:
+            self._expire(now)
+            self._last_seen[username] = now
+            heapq.heappush(self._heap, (now + self.ttl, username))
+            self._set(username, True)
+
+    def set_offline(self, username):
+        with self._lock:
+            self._last_seen.pop(username, None)
+            self._set(username, False)
+
+    def is_online(self, username):
+        with self._lock:
+            self._expire(self._clock())
+            return username in self._online
+
+    def online(self):
+        """(versão, lista de usuários online)"""
+        with self._lock:
+            self._expire(self._clock())
+            return self._version, sorted(self._online)
+
+    def changes_since(self, version):
+        """
+        Devolve (versão_atual, [(username, online)], completo).
+        Se a versão pedida não está mais no log (ou é de antes de um restart
+        do servidor), completo=True e a lista traz todos os usuários online.
+        """
+        with self._lock:
+            self._expire(self._clock())
+            oldest = self._log[0][0] if self._log else self._version + 1
+            if version > self._version or version < oldest - 1:
+                return self._version, [(u, True) for u in sorted(self._online)], True
+
+            latest = {}
+            for v, username, online in reversed(self._log):
+                if v <= version:
+                    break
+                latest.setdefault(username, online)
+            return self._version, sorted(latest.items()), False
+
+    def _set(self, username, online):
+        if (username in self._online) == online:
+            return
+        if online:
+            self._online.add(username)
+        else:
+            self._online.discard(username)
+        self._version += 1
+        self._log.append((self._version, username, online))
+
+    def _expire(self, now):
+        heap = self._heap
+        while heap and heap[0][0] < now:
+            expires, username = heapq.heappop(heap)
+            last = self._last_seen.get(username)
+            # Só expira se não houve heartbeat depois desta entrada
+            if last is not None and last + self.ttl <= expires:
+                del self._last_seen[username]
+                self._set(username, False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "online": len(self._online),
+                "version": self._version,
+                "heap": len(self._heap),
+            }
@@ -0,0 +1,55 @@
+# server/rebuild_fts.py
+# Reconstrói os índices de busca textual (messages_fts, group_messages_fts)
+# a partir das tabelas de mensagens. O servidor cria e preenche os índices
+# sozinho na primeira inicialização; este script serve para fazer isso antes
+# (com o servidor parado, num banco grande) e para reparar um índice que
+# divergiu das tabelas (ex.: mensagens alteradas com os triggers ausentes).
+#
+# Uso: python rebuild_fts.py [banco] [--check] [--optimize]
+#   --check     só confere os índices (integrity-check), sem reconstruir
+#   --optimize  junta os segmentos depois de reconstruir
+import sqlite3
+import sys
+import time
+
+from database import Database, DB_NAME, FTS_INDEXES
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    db_path = args[0] if args else DB_NAME
+
+    db = Database(db_path, pool_size=1)
+    try:
+        if not db.fts:
+            print("❌ Este SQLite não tem FTS5; a busca fica desativada.")
+            sys.exit(1)
+        if "--check" in sys.argv:
+            try:
+                db.check_fts()
+            except sqlite3.DatabaseError as e:
+                print(f"❌ Índice divergente: {e}. Rode sem --check para reconstruir.")
+                sys.exit(1)
+            print("✅ Índices de busca conferem com as tabelas.")
+            return
+
+        for name, (table, _) in FTS_INDEXES.items():
+            if name in db.fts_created:
+                print(f" -> {name} criado e preenchido agora.")
+                continue
+            (rows,) = db.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()
+            print(f"🔧 Reconstruindo {name} ({rows} mensagens)...")
+            start = time.perf_counter()
+            db.rebuild_fts(name)
+            print(f" -> {time.perf_counter() - start:.1f}s")
+        if "--optimize" in sys.argv:
+            print(" -> optimize (juntando segmentos)...")
+            db.optimize_fts()
+        db.check_fts()
+    finally:
+        db.close()
+    print("✅ Concluído.")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,18 +2,98 @@
 import Pyro5.api
 import Pyro5.server
 import Pyro5.errors
-import time
 import base64
-from database import Database
-from crypto_utils import hash_password, verify_password
+import serpent
+import sqlite3
+import threading
+import time
+from database import Database, DEFAULT_POOL_SIZE, conversation_key, fts_query
+from events import dm_key
+from blob_store import DiskBlobStore, BLOB_DIR
+from transfers import UploadManager, MAX_CHUNK_SIZE
+from cache import UserDirectory, GroupStatusCache, GroupRosters, HomeCache, ConversationTails
+from presence import Presence
+from auth import PasswordHasher, SessionStore, Overloaded
+from notifier import Notifier
+from event_hub import EventHub
+from longpoll import LongPollServer, LONGPOLL_TIMEOUT
+
+# Paginação do histórico (get_*_since / get_*_before)
+HISTORY_PAGE = 100
+HISTORY_MAX_PAGE = 500
+SYNC_PAGE = 500  # eventos por chamada de sync()
+MAINTENANCE_INTERVAL = 60  # segundos entre as rodadas de _maintenance()
+# Cauda em memória por conversa: uma página cobre a abertura do chat
+TAIL_MESSAGES = HISTORY_PAGE
+TAIL_MAX_BYTES = 32 * 1024 ** 2
+
+# search_messages(): resultados por página e escopos aceitos além de dm:/group:
+SEARCH_PAGE = 20
+SEARCH_MAX_PAGE = 100
+SEARCH_MAX_OFFSET = 1000
+SEARCH_SCOPES = ("all", "private", "groups")
+
+# batch(): operações aceitas (todas recebem a sessão como primeiro argumento)
+BATCH_MAX_OPS = 100
+BATCH_OPS = frozenset({
+    "send_message", "send_group_message", "request_join_group", "approve_member",
+    "add_member_direct", "kick_member", "request_ban_user", "heartbeat",
+    "list_groups_with_status", "list_pending_requests", "get_files_list",
+    "get_conversation_since", "get_group_conversation_since", "mark_read",
+})
+MEMBERSHIP_OPS = frozenset({"request_join_group", "approve_member", "add_member_direct", "kick_member"})
+
+
+# approved (group_members) -> situação mostrada ao cliente
+MEMBER_STATUS = {None: "fora", 0: "pendente", 1: "aprovado"}
+
+
+def _as_bytes(data):
+    """Bytes vindos do Pyro5: o serpent os codifica como dict base64; marshal/msgpack mandam crus."""
+    if isinstance(data, dict):
+        return serpent.tobytes(data)
+    return bytes(data)
+
+
+class _BatchAborted(Exception):
+    """Falha de uma operação num batch(atomic=True): desfaz a transação."""
+
+
+def _page_size(limit):
+    try:
+        return max(1, min(int(limit), HISTORY_MAX_PAGE))
+    except (TypeError, ValueError):
+        return HISTORY_PAGE
 
 @Pyro5.server.expose
 class WhatsUTServer(object):
-    def __init__(self):
-        self.db = Database()
-        self._last_seen = {}
-        self._ttl = 90
-        self._callbacks = {}
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, durability="normal", blob_dir=BLOB_DIR):
+        self.blobs = DiskBlobStore(blob_dir)
+        self.db = Database(pool_size=pool_size, durability=durability, blob_store=self.blobs)
+        self.uploads = UploadManager(self.blobs)
+        self.users = UserDirectory(self.db)
+        self.group_status = GroupStatusCache(self.db)
+        self.rosters = GroupRosters(self.db)
+        self.home = HomeCache(self.db)
+        self.tails = ConversationTails(TAIL_MESSAGES, TAIL_MAX_BYTES)
+        self.presence = Presence()
+        self.hasher = PasswordHasher()
+        self.sessions = SessionStore()
+        self.notifier = Notifier()
+        self.hub = EventHub(start_seq=self.db.event_seq_range()[1])
+        self.longpoll = None  # LongPollServer, iniciado por start_server()
+        self.longpoll_host = None
+        # wait_events espera no loop do LongPollServer, mas a thread do Pyro5
+        # fica parada no Future: no máximo 1/4 do pool espera ao mesmo tempo
+        self._parked = threading.BoundedSemaphore(max(1, pool_size // 4))
+        # Notificações adiadas até o commit de um batch() (por thread)
+        self._batch = threading.local()
+        pruned = self.db.prune_events()
+        if pruned:
+            print(f"[EVENTS] {pruned} eventos antigos removidos do log.")
+        swept = self.db.sweep_blobs()
+        if swept:
+            print(f"[BLOBS] {swept} arquivos sem referência removidos.")
         
         print("\n===== Usuários registrados no banco =====")
         for u in self.db.list_users():
@@ -25,117 +105,179 @@ class WhatsUTServer(object):
 
     # ========== AUTENTICAÇÃO ==========
     def register(self, username, password):
-        hashed = hash_password(password)
+        """Retorna (True, mensagem) ou (False, mensagem), como login()."""
+        try:
+            hashed = self.hasher.hash(password)
+        except Overloaded as e:
+            return (False, str(e))
         success = self.db.add_user(username, hashed)
+        self.users.invalidate(username)
         if success:
             print(f"[REGISTER] novo usuário: {username}")
-        else:
-            print(f"[REGISTER] falha: usuário '{username}' já existe")
-        return success
+            return (True, "Usuário criado! Faça login.")
+        print(f"[REGISTER] falha: usuário '{username}' já existe")
+        return (False, "Nome de usuário indisponível.")
 
     def login(self, username, password):
-        user = self.db.get_user(username)
+        """
+        Retorna (True, mensagem, token_de_sessão) ou (False, mensagem, None).
+        Todas as RPCs do usuário recebem o token no lugar do username.
+        """
+        user = self.users.get(username)
         if not user:
-            return (False, "Usuário não encontrado.")
+            return (False, "Usuário não encontrado.", None)
         
         user_id, user_name, db_hash, banned = user
         
         if banned:
-            return (False, "Usuário banido.")
+            return (False, "Usuário banido.", None)
         
         try:
-            ok = verify_password(password, db_hash)
+            ok = self.hasher.verify(password, db_hash)
+        except Overloaded as e:
+            return (False, str(e), None)
         except Exception as e:
             print(f"[LOGIN] erro verify_password: {e}")
-            return (False, "Erro ao validar senha.")
+            return (False, "Erro ao validar senha.", None)
         
-        if ok:
-            print(f"[LOGIN] usuário '{username}' autenticado.")
-            return (True, "Login autorizado!")
-        else:
+        if not ok:
             print(f"[LOGIN] senha incorreta para '{username}'.")
-            return (False, "Senha incorreta.")
+            return (False, "Senha incorreta.", None)
+
+        # Custo do bcrypt mudou desde o cadastro: aproveita a senha em mãos
+        if self.hasher.needs_rehash(db_hash):
+            try:
+                self.db.update_password_hash(user_id, self.hasher.hash(password))
+                self.users.invalidate(username)
+                print(f"[LOGIN] hash de '{username}' atualizado para {self.hasher.rounds} rounds.")
+            except Exception as e:
+                print(f"[LOGIN] erro ao refazer hash: {e}")
+
+        print(f"[LOGIN] usuário '{username}' autenticado.")
+        return (True, "Login autorizado!", self.sessions.create(username))
+
+    def logout(self, session):
+        username = self.sessions.resolve(session)
+        if username:
+            self.notifier.unregister(username)
+            self.hub.drop(username)
+            self.presence.set_offline(username)
+        return self.sessions.revoke(session)
+
+    def _session_user(self, session):
+        """(id, username, hash, banned) do dono da sessão, ou None se inválida."""
+        username = self.sessions.resolve(session)
+        if username is None:
+            return None
+        user = self.users.get(username)
+        if not user or user[3]:
+            return None
+        return user
 
     # ========== LISTA DE USUÁRIOS ==========
     def list_users(self):
-        return self.db.list_users()
+        return self.users.all()
 
     # ========== MENSAGENS PRIVADAS ==========
-    def send_message(self, sender_username, receiver_username, content):
-        sender = self.db.get_user(sender_username)
-        receiver = self.db.get_user(receiver_username)
+    def send_message(self, session, receiver_username, content):
+        sender = self._session_user(session)
+        receiver = self.users.get(receiver_username)
         if not sender or not receiver:
             return False
+        sender_username = sender[1]
         
         sender_id = sender[0]
         receiver_id = receiver[0]
         
         try:
-            self.db.save_message(sender_id, receiver_id, content)
+            event = self.db.save_message(sender_id, receiver_id, content)
             print(f"[MSG] {sender_username} -> {receiver_username}: {content[:50]}")
             
-            # Notifica callback
-            cb = self._callbacks.get(receiver_username)
-            if cb:
-                try:
-                    cb.notify_private(sender_username, receiver_username)
-                except Exception as e:
-                    print(f"[CALLBACK] erro: {e}")
+            self._append_tail(("dm",) + conversation_key(sender_id, receiver_id), event,
+                              (event["id"], event["sender"], event["receiver"], content, event["timestamp"]))
+            self._publish(receiver_username, event)
             return True
         except Exception as e:
             print(f"[MSG] erro: {e}")
             return False
 
-    def get_conversation(self, user_a, user_b):
-        ua = self.db.get_user(user_a)
-        ub = self.db.get_user(user_b)
+    def get_conversation(self, session, other_user):
+        ua = self._session_user(session)
+        ub = self.users.get(other_user)
         if not ua or not ub:
             return []
         return self.db.get_messages_between(ua[0], ub[0])
 
+    def get_conversation_since(self, session, other_user, after_id=0, limit=HISTORY_PAGE):
+        """
+        Busca incremental: mensagens com id > after_id, em ordem crescente.
+        Com after_id=0 devolve as `limit` mais recentes (abertura do chat).
+        Linhas: (id, remetente, destinatário, conteúdo, timestamp)
+        """
+        ua = self._session_user(session)
+        ub = self.users.get(other_user)
+        if not ua or not ub:
+            return []
+        limit = _page_size(limit)
+        rows = self._tail_since(("dm",) + conversation_key(ua[0], ub[0]), after_id, limit,
+                                lambda n: self.db.get_messages_before(ua[0], ub[0], None, n))
+        if rows is not None:
+            return rows
+        if not after_id:
+            return self.db.get_messages_before(ua[0], ub[0], None, limit)
+        return self.db.get_messages_after(ua[0], ub[0], after_id, limit)
+
+    def get_conversation_before(self, session, other_user, before_id, limit=HISTORY_PAGE):
+        """Página anterior do histórico: as `limit` mensagens antes de before_id."""
+        ua = self._session_user(session)
+        ub = self.users.get(other_user)
+        if not ua or not ub:
+            return []
+        limit = _page_size(limit)
+        rows = self._tail_before(("dm",) + conversation_key(ua[0], ub[0]), before_id, limit,
+                                 lambda n: self.db.get_messages_before(ua[0], ub[0], None, n))
+        if rows is not None:
+            return rows
+        return self.db.get_messages_before(ua[0], ub[0], before_id, limit)
+
     # ========== ENVIO DE ARQUIVOS ==========
-    def send_file(self, sender_username, receiver_username, filename, file_data_b64):
+    def send_file(self, session, receiver_username, filename, file_data_b64):
         """
         file_data_b64: string base64 do arquivo
         Retorna: (bool, mensagem)
         """
-        sender = self.db.get_user(sender_username)
-        receiver = self.db.get_user(receiver_username)
+        sender = self._session_user(session)
+        receiver = self.users.get(receiver_username)
         
         if not sender or not receiver:
             return (False, "Usuário não encontrado")
+        sender_username = sender[1]
         
         try:
             # Decodifica base64
             file_data = base64.b64decode(file_data_b64)
-            file_id = self.db.save_file(sender[0], receiver[0], filename, file_data)
+            event = self.db.save_file(sender[0], receiver[0], filename, file_data)
             print(f"[FILE] {sender_username} -> {receiver_username}: {filename} ({len(file_data)} bytes)")
-            
-            # Notifica callback
-            cb = self._callbacks.get(receiver_username)
-            if cb:
-                try:
-                    cb.notify_file(sender_username, receiver_username, filename)
-                except Exception:
-                    pass
-            
-            return (True, f"Arquivo enviado com ID: {file_id}")
+            self._publish(receiver_username, event)
+            return (True, f"Arquivo enviado com ID: {event['id']}")
         except Exception as e:
             print(f"[FILE] erro: {e}")
             return (False, f"Erro ao enviar arquivo: {e}")
 
-    def get_files_list(self, user_a, user_b):
+    def get_files_list(self, session, other_user):
         """Retorna lista de arquivos trocados entre dois usuários"""
-        ua = self.db.get_user(user_a)
-        ub = self.db.get_user(user_b)
+        ua = self._session_user(session)
+        ub = self.users.get(other_user)
         if not ua or not ub:
             return []
         return self.db.get_files_between(ua[0], ub[0])
 
-    def download_file(self, file_id):
+    def download_file(self, session, file_id):
         """
         Retorna: (filename, file_data_b64) ou (None, None) se não encontrado
         """
+        if not self._can_read_file(session, file_id):
+            return (None, None)
         try:
             result = self.db.get_file_data(file_id)
             if result:
@@ -147,112 +289,242 @@ class WhatsUTServer(object):
             print(f"[DOWNLOAD] erro: {e}")
             return (None, None)
 
+    def _can_read_file(self, session, file_id):
+        """Só remetente e destinatário podem baixar um arquivo."""
+        user = self._session_user(session)
+        if not user:
+            return False
+        parties = self.db.get_file_parties(file_id)
+        return bool(parties) and user[0] in parties
+
+    # ========== TRANSFERÊNCIA EM PARTES ==========
+    # Os bytes trafegam crus (sem base64) quando o cliente usa o serializer
+    # "marshal" ou "msgpack"; o servidor só guarda uma parte por vez em memória.
+    def begin_upload(self, session, receiver_username, filename, size, sha256):
+        """
+        Inicia (ou retoma) um upload. sha256: hash hex do arquivo inteiro.
+        Retorna (upload_id, bytes_já_recebidos) ou (None, mensagem de erro)
+        """
+        sender = self._session_user(session)
+        receiver = self.users.get(receiver_username)
+        if not sender or not receiver:
+            return (None, "Usuário não encontrado")
+        try:
+            upload = self.uploads.begin(sender[0], receiver[0], filename, int(size), sha256)
+            return (upload.id, upload.received)
+        except Exception as e:
+            print(f"[UPLOAD] erro: {e}")
+            return (None, f"Erro ao iniciar envio: {e}")
+
+    def _own_upload(self, session, upload_id):
+        """O upload, se pertencer ao dono da sessão (KeyError caso contrário)."""
+        user = self._session_user(session)
+        upload = self.uploads.get(upload_id)
+        if not user or upload.sender_id != user[0]:
+            raise KeyError("Upload desconhecido ou expirado")
+        return upload
+
+    def put_chunk(self, session, upload_id, offset, data, chunk_sha256):
+        """
+        Grava uma parte em `offset`. chunk_sha256 confere a integridade da parte.
+        Retorna (True, bytes_recebidos) ou (False, mensagem de erro)
+        """
+        try:
+            self._own_upload(session, upload_id)
+            received = self.uploads.put_chunk(upload_id, offset, _as_bytes(data), chunk_sha256)
+            return (True, received)
+        except (KeyError, ValueError) as e:
+            return (False, e.args[0])
+        except Exception as e:
+            print(f"[UPLOAD] erro: {e}")
+            return (False, str(e))
+
+    def upload_status(self, session, upload_id):
+        """Bytes já recebidos (para retomar depois de uma desconexão) ou -1."""
+        try:
+            return self._own_upload(session, upload_id).received
+        except KeyError:
+            return -1
+
+    def commit_upload(self, session, upload_id):
+        """Confere o arquivo inteiro e registra a transferência. Retorna (bool, mensagem)"""
+        try:
+            upload = self._own_upload(session, upload_id)
+            with self.db.blob_reference(upload.sha256):
+                upload = self.uploads.commit(upload_id)
+                event = self.db.save_file_ref(
+                    upload.sender_id, upload.receiver_id, upload.filename, upload.sha256, upload.size
+                )
+        except Exception as e:
+            print(f"[UPLOAD] erro: {e}")
+            return (False, f"Erro ao concluir envio: {e}")
+
+        print(f"[FILE] {event['sender']} -> {event['receiver']}: {upload.filename} ({upload.size} bytes)")
+        self._publish(event["receiver"], event)
+        return (True, f"Arquivo enviado com ID: {event['id']}")
+
+    def abort_upload(self, session, upload_id):
+        try:
+            self._own_upload(session, upload_id)
+        except KeyError:
+            return False
+        return self.uploads.abort(upload_id)
+
+    def get_file_info(self, session, file_id):
+        """(filename, tamanho, sha256) ou (None, 0, None); sha256 é None para arquivos antigos."""
+        if not self._can_read_file(session, file_id):
+            return (None, 0, None)
+        info = self.db.get_file_info(file_id)
+        if not info:
+            return (None, 0, None)
+        return info
+
+    def read_file_chunk(self, session, file_id, offset, length):
+        """Lê até `length` bytes a partir de `offset`, direto do blob store."""
+        if not self._can_read_file(session, file_id):
+            return b""
+        try:
+            length = max(0, min(int(length), MAX_CHUNK_SIZE))
+        except (TypeError, ValueError):
+            return b""
+        info = self.db.get_file_info(file_id)
+        if not info:
+            return b""
+        filename, size, digest = info
+        try:
+            offset = int(offset)
+        except (TypeError, ValueError):
+            return b""
+        if offset < 0 or offset > size:
+            return b""
+        if digest:
+            with self.blobs.open(digest) as f:
+                f.seek(offset)
+                return f.read(length)
+        # Arquivo antigo, ainda dentro do banco
+        filename, file_data = self.db.get_file_data(file_id)
+        return bytes(file_data[offset:offset + length])
+
     # ========== PRESENÇA ONLINE ==========
-    def heartbeat(self, username):
-        self._last_seen[username] = time.time()
+    def heartbeat(self, session):
+        user = self._session_user(session)
+        if not user:  # sessão inválida ou usuário banido
+            return False
+        self.presence.heartbeat(user[1])
         return True
 
     def is_online(self, username):
-        ts = self._last_seen.get(username)
-        if not ts:
-            return False
-        return (time.time() - ts) <= self._ttl
+        return self.presence.is_online(username)
 
-    def set_offline(self, username):
-        if username in self._last_seen:
-            del self._last_seen[username]
+    def set_offline(self, session):
+        user = self._session_user(session)
+        if not user:
+            return False
+        self.presence.set_offline(user[1])
         return True
 
     def get_status_map(self):
-        now = time.time()
-        res = []
-        for uid, uname, banned in self.db.list_users():
-            online = (now - self._last_seen.get(uname, 0) <= self._ttl) and not banned
-            res.append((uname, online))
-        return res
+        """
+        [(username, online)] de todos os usuários (banidos contam como
+        offline). Para acompanhar mudanças use get_presence_changes.
+        """
+        version, online = self.presence.online()
+        online = set(online)
+        return [(uname, uname in online and not banned) for uid, uname, banned in self.users.all()]
+
+    def get_presence_changes(self, since_version=0):
+        """
+        Mudanças de presença desde since_version.
+        Retorna (versão, [(username, online)], completo); com completo=True a
+        lista é o conjunto inteiro de usuários online (cliente refaz o estado).
+        """
+        return self.presence.changes_since(since_version)
 
     # ========== GRUPOS ==========
-    def create_group(self, admin_username, group_name, admin_on_leave='transfer'):
+    def create_group(self, session, group_name, admin_on_leave='transfer'):
         """
         admin_on_leave: 'transfer' (transfere para próximo membro) ou 'delete' (deleta o grupo)
         """
-        admin = self.db.get_user(admin_username)
+        admin = self._session_user(session)
         if not admin:
             return False
-        return self.db.create_group(group_name, admin[0], admin_on_leave)
+        ok = self.db.create_group(group_name, admin[0], admin_on_leave)
+        if ok:
+            self.group_status.clear()  # grupo novo aparece para todos
+        return ok
 
     def list_groups(self):
         return self.db.list_groups()
 
-    def list_groups_with_status(self, username):
-        user = self.db.get_user(username)
+    def list_groups_with_status(self, session):
+        user = self._session_user(session)
         if not user:
             return []
-        uid = user[0]
-        res = []
-        for gid, name, admin_uname, admin_on_leave in self.db.list_groups():
-            if admin_uname == username:
-                status = "aprovado"
-            else:
-                st = self.db.membership_status(uid, gid)
-                if st is None:
-                    status = "fora"
-                elif st == 0:
-                    status = "pendente"
-                else:
-                    status = "aprovado"
-            res.append((name, admin_uname, status))
-        return res
-
-    def request_join_group(self, username, group_name):
-        user = self.db.get_user(username)
+        return [
+            (name, admin_uname, MEMBER_STATUS[approved])
+            for name, admin_uname, approved in self.group_status.get(user[0])
+        ]
+
+    def request_join_group(self, session, group_name):
+        user = self._session_user(session)
         grp = self.db.get_group(group_name)
         if not user or not grp:
             return False
-        return self.db.request_join_group(user[0], grp[0])
+        ok = self._change_roster(grp[0], lambda: self.db.request_join_group(user[0], grp[0]),
+                                 "request", user[0], user[1])
+        self.group_status.invalidate(user[0])
+        return ok
 
-    def list_pending_requests(self, admin_username, group_name):
-        admin = self.db.get_user(admin_username)
+    def list_pending_requests(self, session, group_name):
+        admin = self._session_user(session)
         grp = self.db.get_group(group_name)
         if not admin or not grp:
             return []
         if grp[2] != admin[0]:  # Verifica se é admin
             return []
-        return [u for (u,) in self.db.list_pending_requests(grp[0])]
+        return self.rosters.pending(grp[0])
 
-    def approve_member(self, admin_username, group_name, member_username):
-        admin = self.db.get_user(admin_username)
+    def approve_member(self, session, group_name, member_username):
+        admin = self._session_user(session)
         grp = self.db.get_group(group_name)
-        mem = self.db.get_user(member_username)
+        mem = self.users.get(member_username)
         if not admin or not grp or not mem:
             return False
         if grp[2] != admin[0]:
             return False
-        return self.db.approve_member(mem[0], grp[0])
+        ok = self._change_roster(grp[0], lambda: self.db.approve_member(mem[0], grp[0]),
+                                 "approve", mem[0], mem[1])
+        self.group_status.invalidate(mem[0])
+        return ok
 
-    def add_member_direct(self, admin_username, group_name, member_username):
-        admin = self.db.get_user(admin_username)
+    def add_member_direct(self, session, group_name, member_username):
+        admin = self._session_user(session)
         grp = self.db.get_group(group_name)
-        mem = self.db.get_user(member_username)
+        mem = self.users.get(member_username)
         if not admin or not grp or not mem:
             return False
         if grp[2] != admin[0]:
             return False
-        return self.db.add_member_approved(mem[0], grp[0])
+        ok = self._change_roster(grp[0], lambda: self.db.add_member_approved(mem[0], grp[0]),
+                                 "add", mem[0], mem[1])
+        self.group_status.invalidate(mem[0])
+        return ok
 
-    def leave_group(self, username, group_name):
+    def leave_group(self, session, group_name):
         """Usuário sai do grupo. Se for admin, transfere ou deleta conforme configuração"""
-        user = self.db.get_user(username)
+        user = self._session_user(session)
         grp = self.db.get_group(group_name)
         if not user or not grp:
             return False
+        username = user[1]
         
         gid, name, admin_id, admin_on_leave = grp
         user_id = user[0]
         
         # Se não é admin, apenas remove
         if admin_id != user_id:
-            self.db.remove_member(user_id, gid)
+            self._change_roster(gid, lambda: self.db.remove_member(user_id, gid), "remove", user_id)
+            self.group_status.invalidate(user_id)
             print(f"[GROUP] {username} saiu do grupo {group_name}")
             return True
         
@@ -260,83 +532,281 @@ class WhatsUTServer(object):
         if admin_on_leave == 'delete':
             # Deleta o grupo
             self.db.delete_group(gid)
+            self.group_status.clear()
+            self.rosters.drop(gid)
+            self.tails.drop(("group", gid))
             print(f"[GROUP] Admin {username} saiu. Grupo {group_name} deletado.")
             return True
         else:
             # Transfere para próximo membro (por ordem de entrada)
-            members = self.db.list_group_members(gid, approved_only=True)
-            next_admin = None
-            for mid, mname in members:
-                if mid != user_id:
-                    next_admin = mid
-                    break
+            next_admin = self.rosters.successor(gid, user_id)
             
             if next_admin:
-                self.db.update_group_admin(gid, next_admin)
-                self.db.remove_member(user_id, gid)
+                def transfer():
+                    self.db.update_group_admin(gid, next_admin)
+                    self.db.remove_member(user_id, gid)
+                self._change_roster(gid, transfer, "remove", user_id)
+                self.group_status.clear()  # admin mudou para todos
                 print(f"[GROUP] Admin {username} saiu. Novo admin: ID {next_admin}")
                 return True
             else:
                 # Não há outros membros, deleta o grupo
                 self.db.delete_group(gid)
+                self.group_status.clear()
+                self.rosters.drop(gid)
+                self.tails.drop(("group", gid))
                 print(f"[GROUP] Admin {username} saiu e não há outros membros. Grupo deletado.")
                 return True
 
-    def delete_group(self, admin_username, group_name):
-        admin = self.db.get_user(admin_username)
+    def delete_group(self, session, group_name):
+        admin = self._session_user(session)
         grp = self.db.get_group(group_name)
         if not admin or not grp:
             return False
         if grp[2] != admin[0]:
             return False
-        return self.db.delete_group(grp[0])
+        ok = self.db.delete_group(grp[0])
+        self.group_status.clear()
+        self.rosters.drop(grp[0])
+        self.tails.drop(("group", grp[0]))
+        return ok
 
-    def kick_member(self, admin_username, group_name, member_username):
+    def kick_member(self, session, group_name, member_username):
         """Admin expulsa um membro do grupo"""
-        admin = self.db.get_user(admin_username)
+        admin = self._session_user(session)
         grp = self.db.get_group(group_name)
-        mem = self.db.get_user(member_username)
+        mem = self.users.get(member_username)
         if not admin or not grp or not mem:
             return False
         if grp[2] != admin[0]:  # Verifica se é admin
             return False
-        self.db.remove_member(mem[0], grp[0])
-        print(f"[GROUP] {admin_username} expulsou {member_username} do grupo {group_name}")
+        self._change_roster(grp[0], lambda: self.db.remove_member(mem[0], grp[0]), "remove", mem[0])
+        self.group_status.invalidate(mem[0])
+        print(f"[GROUP] {admin[1]} expulsou {member_username} do grupo {group_name}")
         return True
 
+    def _change_roster(self, group_id, write, change, *args):
+        """
+        Escrita em group_members + Roster.<change>(*args) no roster do grupo
+        (a mudança só entra se write() não devolver False). As duas vão na
+        mesma transação: a trava de escrita do SQLite põe as mudanças do
+        roster na ordem dos commits. Dentro de batch() a transação é a do
+        lote: o roster é descartado e batch() limpa todos depois do commit.
+        """
+        with self.rosters.writing(group_id):
+            if getattr(self._batch, "effects", None) is not None:
+                result = write()
+                self.rosters.drop(group_id)
+                return result
+            with self.db.transaction():
+                result = write()
+                if result is not False:
+                    self.rosters.update(group_id, change, *args)
+            return result
+
     # ========== MENSAGENS DE GRUPO ==========
-    def send_group_message(self, sender_username, group_name, content):
+    def send_group_message(self, session, group_name, content):
         grp = self.db.get_group(group_name)
-        snd = self.db.get_user(sender_username)
+        snd = self._session_user(session)
         if not grp or not snd:
             return False
-        st = self.db.membership_status(snd[0], grp[0])
+        st = self.rosters.status(grp[0], snd[0])
         if st != 1:  # Precisa estar aprovado
             return False
         try:
-            self.db.save_group_message(grp[0], snd[0], content)
-            print(f"[GROUP MSG] {sender_username} em {group_name}: {content[:50]}")
+            event = self.db.save_group_message(grp[0], snd[0], content)
+            print(f"[GROUP MSG] {snd[1]} em {group_name}: {content[:50]}")
+            self._append_tail(("group", grp[0]), event,
+                              (event["id"], event["sender"], content, event["timestamp"]))
+            self._notify_group(grp[0], snd[1], event)
             return True
         except Exception as e:
             print(f"[GROUP MSG] erro: {e}")
             return False
 
-    def get_group_conversation(self, group_name):
+    def _notify_group(self, group_id, sender_username, event):
+        """Avisa os membros aprovados online (exceto quem enviou) sem bloquear o envio."""
+        if self._defer(self._notify_group, group_id, sender_username, event):
+            return
+        members = [u for u in self.rosters.members(group_id) if u != sender_username]
+        self.hub.publish_many(members, event)
+        self.notifier.notify_many(
+            members, "notify_events", [event], only=self.presence.is_online
+        )
+
+    def _member_group(self, session, group_name):
+        """O grupo, se o dono da sessão for membro aprovado; senão None."""
+        user = self._session_user(session)
         grp = self.db.get_group(group_name)
+        if not user or not grp:
+            return None
+        if self.rosters.status(grp[0], user[0]) != 1:
+            return None
+        return grp
+
+    def get_group_conversation(self, session, group_name):
+        grp = self._member_group(session, group_name)
         if not grp:
             return []
         return self.db.get_group_messages(grp[0])
 
+    def get_group_conversation_since(self, session, group_name, after_id=0, limit=HISTORY_PAGE):
+        """
+        Igual a get_conversation_since, para grupos (só membros aprovados).
+        Linhas: (id, remetente, conteúdo, timestamp)
+        """
+        grp = self._member_group(session, group_name)
+        if not grp:
+            return []
+        limit = _page_size(limit)
+        rows = self._tail_since(("group", grp[0]), after_id, limit,
+                                lambda n: self.db.get_group_messages_before(grp[0], None, n))
+        if rows is not None:
+            return rows
+        if not after_id:
+            return self.db.get_group_messages_before(grp[0], None, limit)
+        return self.db.get_group_messages_after(grp[0], after_id, limit)
+
+    def get_group_conversation_before(self, session, group_name, before_id, limit=HISTORY_PAGE):
+        grp = self._member_group(session, group_name)
+        if not grp:
+            return []
+        limit = _page_size(limit)
+        rows = self._tail_before(("group", grp[0]), before_id, limit,
+                                 lambda n: self.db.get_group_messages_before(grp[0], None, n))
+        if rows is not None:
+            return rows
+        return self.db.get_group_messages_before(grp[0], before_id, limit)
+
+    # ========== CAUDA DAS CONVERSAS ==========
+    # Chaves: ("dm", menor_id, maior_id) e ("group", group_id). Dentro de
+    # batch() a transação enxerga escritas ainda não commitadas: as leituras
+    # vão direto ao banco e os appends esperam o commit.
+    def _tail_since(self, key, after_id, limit, load):
+        if getattr(self._batch, "effects", None) is not None:
+            return None
+        return self.tails.since(key, after_id or 0, limit, load)
+
+    def _tail_before(self, key, before_id, limit, load):
+        if getattr(self._batch, "effects", None) is not None:
+            return None
+        return self.tails.before(key, before_id, limit, load)
+
+    def _append_tail(self, key, event, row):
+        if self._defer(self._append_tail, key, event, row):
+            return
+        self.tails.append(key, event["id"], event["prev_id"], row)
+
+    # ========== CAIXA DE ENTRADA ==========
+    def list_inbox(self, session):
+        """
+        Conversas do usuário da mais recente para a mais antiga:
+        [(kind, nome, last_id, remetente, trecho, timestamp, não_lidas)],
+        kind "dm" ou "group". None se a sessão for inválida.
+        """
+        user = self._session_user(session)
+        if not user:
+            return None
+        return self.db.list_inbox(user[0])
+
+    def mark_read(self, session, conversation, up_to_id):
+        """
+        Marca como lidas as mensagens da conversa ("dm:a:b" / "group:nome")
+        até up_to_id. Devolve quantas continuam não lidas, ou None se a
+        sessão ou a conversa forem inválidas. As outras sessões do usuário
+        recebem o evento conversation_read.
+        """
+        user = self._session_user(session)
+        if not user:
+            return None
+        try:
+            up_to_id = int(up_to_id)
+        except (TypeError, ValueError):
+            return None
+        if conversation.startswith("group:"):
+            grp = self._member_group(session, conversation[len("group:"):])
+            if not grp:
+                return None
+            kind, peer = "group", grp[0]
+        else:
+            other = self._dm_peer(user[1], conversation)
+            other = self.users.get(other) if other is not None else None
+            if not other:
+                return None
+            kind, peer = "dm", other[0]
+        unread, event = self.db.mark_read(user[0], kind, peer, up_to_id)
+        if event is not None:
+            self._publish(user[1], event)
+        return unread
+
+    # ========== BUSCA ==========
+    def search_messages(self, session, query, scope="all", limit=SEARCH_PAGE, cursor=None):
+        """
+        Busca textual nas conversas do usuário, por relevância.
+        scope: "all", "private", "groups" ou a chave de uma conversa
+        ("dm:a:b" / "group:nome", como nos eventos).
+        Devolve {"results": [(conversa, id, remetente, trecho, timestamp)],
+        "cursor": valor para a próxima página ou None}; o trecho marca os
+        termos encontrados com [ ]. None se a sessão for inválida.
+        """
+        user = self._session_user(session)
+        if not user:
+            return None
+        empty = {"results": [], "cursor": None}
+        match = fts_query(query)
+        if not match:
+            return empty
+        scope = scope or "all"
+        private, groups = scope in ("all", "private"), scope in ("all", "groups")
+        if scope not in SEARCH_SCOPES:
+            private = groups = False
+            if scope.startswith("group:"):
+                grp = self._member_group(session, scope[len("group:"):])
+                groups = grp[0] if grp else False
+            elif scope.startswith("dm:"):
+                other = self._dm_peer(user[1], scope)
+                other = self.users.get(other) if other is not None else None
+                private = other[0] if other else False
+            if not private and not groups:
+                return empty
+        try:
+            limit = max(1, min(int(limit), SEARCH_MAX_PAGE))
+        except (TypeError, ValueError):
+            limit = SEARCH_PAGE
+        try:
+            offset = max(0, int(cursor or 0))
+        except (TypeError, ValueError):
+            offset = 0
+        if offset > SEARCH_MAX_OFFSET:
+            return empty
+        rows = self.db.search_messages(user[0], match, private=private, groups=groups,
+                                       limit=limit + 1, offset=offset)
+        more = len(rows) > limit and offset + limit <= SEARCH_MAX_OFFSET
+        return {"results": rows[:limit], "cursor": offset + limit if more else None}
+
+    @staticmethod
+    def _dm_peer(username, key):
+        """O outro participante da conversa dm:a:b, se username for um deles."""
+        candidates = []
+        if key.startswith(f"dm:{username}:"):
+            candidates.append(key[len(f"dm:{username}:"):])
+        if key.startswith("dm:") and key.endswith(f":{username}"):
+            candidates.append(key[len("dm:"):-len(f":{username}")])
+        for other in candidates:
+            if dm_key(username, other) == key:
+                return other
+        return None
+
     # ========== BANIMENTO ==========
-    def request_ban_user(self, requester_username, target_username, reason=""):
+    def request_ban_user(self, session, target_username, reason=""):
         """Usuário solicita banimento de outro usuário"""
-        req = self.db.get_user(requester_username)
-        tar = self.db.get_user(target_username)
+        req = self._session_user(session)
+        tar = self.users.get(target_username)
         if not req or not tar:
             return (False, "Usuário não encontrado")
         
         request_id = self.db.create_ban_request(req[0], tar[0], reason)
-        print(f"[BAN REQUEST] {requester_username} solicitou ban de {target_username}")
+        print(f"[BAN REQUEST] {req[1]} solicitou ban de {target_username}")
         return (True, f"Solicitação criada com ID: {request_id}")
 
     def list_ban_requests(self):
@@ -351,7 +821,11 @@ class WhatsUTServer(object):
             requests = self.db.list_ban_requests('approved')
             for rid, req_name, tar_name, reason, ts in requests:
                 if rid == request_id:
-                    self.db.ban_user(tar_name)
+                    self.users.ban(tar_name)
+                    self.presence.set_offline(tar_name)
+                    self.sessions.revoke_user(tar_name)
+                    self.notifier.unregister(tar_name)
+                    self.hub.drop(tar_name)
                     print(f"[BAN] Usuário {tar_name} foi banido")
                     return True
             return False
@@ -368,29 +842,258 @@ class WhatsUTServer(object):
         except Exception:
             return False
 
+    # ========== MÉTRICAS ==========
+    def get_server_stats(self):
+        """Contadores dos caches e do acesso ao banco."""
+        return {
+            "users": self.users.stats(),
+            "group_status": self.group_status.stats(),
+            "rosters": self.rosters.stats(),
+            "home": self.home.stats(),
+            "tails": self.tails.stats(),
+            "presence": self.presence.stats(),
+            "uploads": self.uploads.stats(),
+            "hasher": self.hasher.stats(),
+            "sessions": self.sessions.stats(),
+            "notifier": self.notifier.stats(),
+            "events": self.hub.stats(),
+            "longpoll": self.longpoll.stats() if self.longpoll else None,
+            "db": self.db.stats(),
+        }
+
     # ========== CALLBACKS ==========
-    def register_callback(self, username, cb_uri):
+    def _publish(self, username, event):
+        """Entrega um evento por callback e, se o usuário faz long-poll, pela fila dele."""
+        if self._defer(self._publish, username, event):
+            return
+        self.hub.publish(username, event)
+        self.notifier.notify(username, "notify_events", [event])
+
+    def register_callback(self, session, cb_uri):
+        """
+        Registra o callback do cliente depois de testar que o servidor
+        consegue conectar nele. Retorna False se não conseguir (cliente atrás
+        de NAT/firewall): nesse caso o cliente deve usar o canal de
+        long-poll (get_longpoll_address) ou, sem ele, consultar wait_events.
+        """
+        user = self._session_user(session)
+        if not user:
+            return False
+        username = user[1]
         try:
             proxy = Pyro5.api.Proxy(cb_uri)
+            proxy._pyroTimeout = self.notifier.timeout
+            proxy._pyroBind()
             try:
-                proxy._pyroOneway.add("notify_private")
-                proxy._pyroOneway.add("notify_file")
+                proxy._pyroOneway.add("notify_events")
             except Exception:
                 pass
-            self._callbacks[username] = proxy
+            self.notifier.register(username, proxy)
             return True
-        except Exception:
+        except Exception as e:
+            print(f"[CALLBACK] '{username}' inalcançável: {e}")
             return False
 
-    def unregister_callback(self, username):
+    # ========== SINCRONIZAÇÃO ==========
+    def sync(self, session, since_seq=0, limit=SYNC_PAGE):
+        """
+        Tudo o que mudou para o usuário desde since_seq, em ordem, a partir
+        da tabela events: mensagens, arquivos, grupos, membros, usuários e
+        banimentos. Retorna {"seq", "events", "more", "reset"} (None se a
+        sessão for inválida). since_seq=0 devolve só o cursor atual; com
+        reset=True o cursor é mais antigo que o log e o cliente deve
+        recarregar as listas inteiras.
+        """
+        user = self._session_user(session)
+        if not user:
+            return None
+        oldest, latest = self.db.event_seq_range()
+        if not since_seq:
+            return {"seq": latest, "events": [], "more": False, "reset": False}
+        if since_seq > latest or (oldest and since_seq < oldest - 1):
+            # cursor de outro banco ou anterior ao que sobrou do log
+            return {"seq": latest, "events": [], "more": False, "reset": True}
+        limit = max(1, min(int(limit or SYNC_PAGE), SYNC_PAGE))
+        events = self.db.get_events_after(user[0], since_seq, limit)
+        more = len(events) == limit
+        seq = events[-1]["seq"] if more else max(latest, events[-1]["seq"] if events else 0)
+        return {"seq": seq, "events": events, "more": more, "reset": False}
+
+    # ========== LONG-POLL ==========
+    def wait_events(self, session, since_seq=0, timeout=LONGPOLL_TIMEOUT):
+        """
+        Eventos (os mesmos de notify_events) com seq > since_seq, esperando
+        até timeout segundos se não houver nenhum. O seq é o do log de
+        eventos, o mesmo cursor de sync(). Retorna {"seq", "events",
+        "reset", "longpoll"} ou None se a sessão for inválida; since_seq=0
+        só devolve o cursor atual. A espera acontece no loop asyncio do
+        LongPollServer; esta thread fica parada só no Future da resposta, e
+        no máximo _parked threads esperam ao mesmo tempo. Sem vaga (ou sem
+        LongPollServer), responde na hora. "longpoll" é o endereço do canal
+        asyncio, que não tem esse limite (None se desativado).
+        """
+        user = self._session_user(session)
+        if not user:
+            return None
+        if not since_seq:
+            result = self.hub.poll(user[1], 0, latest=self.db.event_seq_range()[1])
+        elif self.longpoll is None or not self._parked.acquire(blocking=False):
+            result = self.hub.poll(user[1], since_seq)
+        else:
+            try:
+                result = self.longpoll.wait(user[1], since_seq, timeout)
+            finally:
+                self._parked.release()
+        result["longpoll"] = self.get_longpoll_address()
+        return result
+
+    def get_longpoll_address(self):
+        """(host, porta) do canal de long-poll asyncio, ou None se desativado."""
+        if not self.longpoll:
+            return None
+        return (self.longpoll_host, self.longpoll.port)
+
+    # ========== LOTES ==========
+    def batch(self, session, ops, atomic=False):
+        """
+        Executa várias operações numa única transação e numa única ida e
+        volta. ops: lista de (método, arg1, arg2, ...) sem a sessão, que é a
+        mesma para todas; só métodos de BATCH_OPS. Retorna, na ordem de ops,
+        (True, retorno_do_método) ou (False, erro); None se a sessão for
+        inválida. Cada operação tem o seu savepoint: uma exceção desfaz só
+        ela. Com atomic=True a primeira falha (exceção ou retorno False)
+        desfaz o lote inteiro. As notificações saem depois do commit.
+        """
+        if not self._session_user(session):
+            return None
+        ops = list(ops or [])
+        if len(ops) > BATCH_MAX_OPS:
+            return [(False, f"no máximo {BATCH_MAX_OPS} operações por lote")] * len(ops)
+
+        results = []
+        effects = self._batch.effects = []
         try:
-            self._callbacks.pop(username, None)
-            return True
-        except Exception:
+            with self.db.transaction():
+                for op in ops:
+                    ok, result = self._batch_item(session, op)
+                    results.append((ok, result))
+                    if atomic and (not ok or result is False or result is None):
+                        raise _BatchAborted()
+        except _BatchAborted:
+            effects.clear()
+            failed = len(results) - 1
+            results = ([(False, "desfeita")] * failed + [results[-1]]
+                       + [(False, "não executada")] * (len(ops) - failed - 1))
+        except sqlite3.Error as e:
+            effects.clear()
+            results = [(False, f"transação falhou: {e}")] * len(ops)
+        finally:
+            self._batch.effects = None
+
+        if any(op and op[0] in MEMBERSHIP_OPS for op in ops):
+            # invalidações feitas antes do commit podem ter sido repovoadas com o estado antigo
+            self.group_status.clear()
+            self.rosters.clear()
+        for fn, args in effects:
+            fn(*args)
+        return results
+
+    def _batch_item(self, session, op):
+        if not op or op[0] not in BATCH_OPS:
+            return (False, "operação não permitida")
+        try:
+            with self.db.savepoint():
+                return (True, getattr(self, op[0])(session, *op[1:]))
+        except Exception as e:
+            return (False, str(e))
+
+    def _defer(self, fn, *args):
+        """Dentro de batch(), guarda a notificação para depois do commit."""
+        effects = getattr(self._batch, "effects", None)
+        if effects is None:
             return False
+        effects.append((fn, args))
+        return True
+
+    # ========== TELA INICIAL ==========
+    def bootstrap(self, session):
+        """
+        Tudo o que a tela inicial precisa numa chamada (None se a sessão for
+        inválida):
+          seq       cursor do log de eventos (para sync / wait_events)
+          db_id     identidade do banco (muda se ele for recriado), para caches locais
+          users     [(id, username, banned)], como list_users()
+          presence  (versão, [(username, True)], True), como get_presence_changes()
+          groups    [(nome, admin, situação)], como list_groups_with_status()
+          pending   {grupo: [username]} nos grupos que o usuário administra
+          inbox     como list_inbox(): conversas por recência, com não lidas
+          private   [(outro, id, remetente, trecho, timestamp)] última mensagem por conversa
+          group_last [(grupo, id, remetente, trecho, timestamp)] idem por grupo
+        """
+        user = self._session_user(session)
+        if not user:
+            return None
+        seq, home = self.home.get(user[0])
+        version, online = self.presence.online()
+        return {
+            "seq": seq,
+            "db_id": self.db.instance_id,
+            "users": self.users.all(),
+            "presence": (version, [(u, True) for u in online], True),
+            "groups": self.list_groups_with_status(session),
+            "pending": home["pending"],
+            "inbox": home["inbox"],
+            "private": [row[1:6] for row in home["inbox"] if row[0] == "dm"],
+            "group_last": [row[1:6] for row in home["inbox"] if row[0] == "group"],
+        }
+
+    def _session_username(self, session):
+        user = self._session_user(session)
+        return user[1] if user else None
+
+    def unregister_callback(self, session):
+        user = self._session_user(session)
+        if not user:
+            return False
+        self.notifier.unregister(user[1])
+        return True
+
+    # ========== MANUTENÇÃO ==========
+    def _maintenance(self):
+        """
+        Limpezas periódicas: uploads abandonados (e .part órfãos), sessões
+        expiradas e eventos além de database.EVENT_LOG_RETENTION no log.
+        """
+        self.uploads.cleanup()
+        expired = self.sessions.sweep()
+        if expired:
+            print(f"[SESSÕES] {expired} sessões expiradas removidas.")
+        pruned = self.db.prune_events()
+        if pruned:
+            print(f"[EVENTS] {pruned} eventos antigos removidos do log.")
+
+    def _start_maintenance(self, interval=MAINTENANCE_INTERVAL):
+        """Roda _maintenance() numa thread própria a cada `interval` segundos."""
+        def loop():
+            while True:
+                try:
+                    self._maintenance()
+                except Exception as e:
+                    print(f"[MANUTENÇÃO] erro: {e}")
+                time.sleep(interval)
+        threading.Thread(target=loop, name="maintenance", daemon=True).start()
 
 
-def start_server():
+def start_server(pool_size=DEFAULT_POOL_SIZE, durability="normal", blob_dir=BLOB_DIR):
+    """
+    pool_size: número de threads de trabalho do Pyro5 e de conexões SQLite
+    (cada thread usa a sua própria conexão).
+    durability: "full", "normal" ou "group" (commit em lote, ver database.py)
+    blob_dir: diretório do blob store dos arquivos enviados
+    """
+    Pyro5.config.SERVERTYPE = "thread"
+    Pyro5.config.THREADPOOL_SIZE = pool_size
+    Pyro5.config.THREADPOOL_SIZE_MIN = min(Pyro5.config.THREADPOOL_SIZE_MIN, pool_size)
     daemon = Pyro5.server.Daemon()
 
     try:
@@ -401,7 +1104,11 @@ def start_server():
         print("Detalhe:", e)
         return
 
-    obj = WhatsUTServer()
+    obj = WhatsUTServer(pool_size=pool_size, durability=durability, blob_dir=blob_dir)
+    obj.longpoll = LongPollServer(obj.hub, obj._session_username)
+    obj.longpoll_host = daemon.locationStr.rsplit(":", 1)[0]
+    obj.longpoll.start()
+    obj._start_maintenance()
     uri = daemon.register(obj)
     try:
         ns.register("whatsut.server", uri)
@@ -413,6 +1120,7 @@ def start_server():
         ns.register("whatsut.server", uri)
 
     print("🚀 Servidor WhatsUT rodando! URI:", uri)
+    print(f"   Long-poll de eventos na porta {obj.longpoll.port}")
     daemon.requestLoop()
 
 
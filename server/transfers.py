@@ -0,0 +1,151 @@
+# server/transfers.py
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+CHUNK_SIZE = 512 * 1024             # tamanho sugerido para os clientes
+MAX_CHUNK_SIZE = 4 * 1024 * 1024    # maior parte aceita/servida por chamada
+MAX_FILE_SIZE = 2 * 1024 ** 3       # 2 GB
+UPLOAD_TTL = 24 * 3600              # uploads parados há mais tempo são descartados
+
+
+class Upload:
+    """Upload em andamento: as partes são anexadas num arquivo .part em disco."""
+
+    def __init__(self, upload_id, sender_id, receiver_id, filename, size, sha256, path):
+        self.id = upload_id
+        self.sender_id = sender_id
+        self.receiver_id = receiver_id
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256
+        self.path = path
+        self.received = 0
+        self.hasher = hashlib.sha256()
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    @property
+    def key(self):
+        return (self.sender_id, self.receiver_id, self.filename, self.size, self.sha256)
+
+
+class UploadManager:
+    """
+    Uploads em partes (begin / put_chunk / commit). A memória usada fica
+    limitada ao tamanho de uma parte; o arquivo completo só existe em disco.
+    Um begin() com os mesmos dados de um upload pendente o retoma de onde parou.
+    """
+
+    def __init__(self, blob_store, ttl=UPLOAD_TTL):
+        self.blob_store = blob_store
+        self.ttl = ttl
+        self._uploads = {}  # id -> Upload
+        self._by_key = {}   # (remetente, destinatário, nome, tamanho, hash) -> Upload
+        self._lock = threading.Lock()
+
+    def begin(self, sender_id, receiver_id, filename, size, sha256):
+        if size < 0 or size > MAX_FILE_SIZE:
+            raise ValueError(f"Tamanho inválido (máximo {MAX_FILE_SIZE} bytes)")
+        key = (sender_id, receiver_id, filename, size, sha256.lower())
+        with self._lock:
+            upload = self._by_key.get(key)
+            if upload is None:
+                upload_id = uuid.uuid4().hex
+                path = os.path.join(self.blob_store.tmp_dir, f"upload-{upload_id}.part")
+                open(path, "wb").close()
+                upload = Upload(upload_id, sender_id, receiver_id, filename, size, key[4], path)
+                self._uploads[upload_id] = upload
+                self._by_key[key] = upload
+            upload.updated = time.time()
+            return upload
+
+    def get(self, upload_id):
+        upload = self._uploads.get(upload_id)
+        if upload is None:
+            raise KeyError("Upload desconhecido ou expirado")
+        return upload
+
+    def put_chunk(self, upload_id, offset, data, chunk_sha256):
+        """Anexa uma parte. Só aceita offset == bytes já recebidos; devolve o novo total."""
+        upload = self.get(upload_id)
+        with upload.lock:
+            if offset != upload.received:
+                raise ValueError(f"Offset {offset} inesperado; esperado {upload.received}")
+            if len(data) > MAX_CHUNK_SIZE:
+                raise ValueError("Parte grande demais")
+            if upload.received + len(data) > upload.size:
+                raise ValueError("Dados além do tamanho declarado")
+            if hashlib.sha256(data).hexdigest() != chunk_sha256.lower():
+                raise ValueError("Checksum da parte não confere")
+            with open(upload.path, "ab") as f:
+                f.write(data)
+            upload.hasher.update(data)
+            upload.received += len(data)
+            upload.updated = time.time()
+            return upload.received
+
+    def commit(self, upload_id):
+        """Confere tamanho e hash do arquivo inteiro e o move para o blob store."""
+        upload = self.get(upload_id)
+        with upload.lock:
+            if upload.received != upload.size:
+                raise ValueError(f"Upload incompleto ({upload.received}/{upload.size} bytes)")
+            if upload.hasher.hexdigest() != upload.sha256:
+                self.abort(upload_id)
+                raise ValueError("Hash do arquivo não confere; envie novamente")
+            with open(upload.path, "rb+") as f:
+                os.fsync(f.fileno())
+            self.blob_store.put_file(upload.path, upload.sha256)
+            self._forget(upload)
+            return upload
+
+    def abort(self, upload_id):
+        upload = self._uploads.get(upload_id)
+        if upload is None:
+            return False
+        self._forget(upload)
+        try:
+            os.remove(upload.path)
+        except OSError:
+            pass
+        return True
+
+    def _forget(self, upload):
+        with self._lock:
+            self._uploads.pop(upload.id, None)
+            if self._by_key.get(upload.key) is upload:
+                del self._by_key[upload.key]
+
+    def cleanup(self):
+        """
+        Descarta os uploads parados há mais de ttl e os .part sem upload
+        (deixados por um processo anterior) mais velhos que isso. Chamado
+        periodicamente pelo servidor (ver WhatsUTServer._maintenance).
+        """
+        limit = time.time() - self.ttl
+        for upload in [u for u in list(self._uploads.values()) if u.updated < limit]:
+            self.abort(upload.id)
+        known = {u.path for u in list(self._uploads.values())}
+        tmp_dir = self.blob_store.tmp_dir
+        try:
+            names = os.listdir(tmp_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(tmp_dir, name)
+            if not (name.startswith("upload-") and name.endswith(".part")) or path in known:
+                continue
+            try:
+                if os.path.getmtime(path) < limit:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        return {
+            "active": len(self._uploads),
+            "bytes_pending": sum(u.received for u in list(self._uploads.values())),
+        }